@@ -0,0 +1,83 @@
+"""Per-rerun cost of fetching the rule table.
+
+Compares the old ``st.cache_data`` behaviour, which unpickles a fresh copy
+of the cached value on every hit, with a rerun's call to
+``morphology.load_complete_morphology_data`` and a read of every analysis
+of the shared table it returns (including its stat-based reload checks).
+With ``--scale`` the scaled table is written to a temporary rules
+directory and read through a ``RuleTable`` over it.
+
+Usage: python benchmarks/bench_rerun.py [--scale N] [--reruns N]
+"""
+
+import argparse
+import copy
+import os
+import pickle
+import sys
+import tempfile
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from morphology.table import RuleTable, build_morphology_data, load_complete_morphology_data
+from synthetic import write_rules_dir
+
+
+def scaled_table(scale):
+    # Repeat the analyses under new keys to mimic a larger rule set
+    base = build_morphology_data()
+    table = {}
+    for i in range(scale):
+        for key, analysis in base.items():
+            table[f"{key}{i}"] = copy.deepcopy(analysis)
+    return table
+
+
+def rerun(load):
+    # What a rerun does with the table: fetch it and read every analysis
+    decisions = load()
+    for key in decisions:
+        decisions[key]
+    return decisions
+
+
+def measure(fetch, reruns):
+    per_call = min(timeit.repeat(fetch, number=reruns, repeat=5)) / reruns
+    tracemalloc.start()
+    fetch()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return per_call, peak
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=1, help='copies of the rule table')
+    parser.add_argument('--reruns', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.scale == 1:
+            load = load_complete_morphology_data
+            pickled = pickle.dumps(build_morphology_data())
+        else:
+            table = scaled_table(args.scale)
+            shared = RuleTable(write_rules_dir(table, directory))
+            load = lambda: shared
+            pickled = pickle.dumps(table)
+
+        before = measure(lambda: pickle.loads(pickled), args.reruns)
+        after = measure(lambda: rerun(load), args.reruns)
+        analyses = len(load())
+
+    print(f"analyses: {analyses}  reruns: {args.reruns}")
+    print(f"{'':<22}{'per rerun':>14}{'alloc/rerun':>14}")
+    print(f"{'st.cache_data copy':<22}{before[0] * 1e6:>11.2f} us{before[1]:>12} B")
+    print(f"{'shared frozen table':<22}{after[0] * 1e6:>11.2f} us{after[1]:>12} B")
+
+
+if __name__ == '__main__':
+    main()
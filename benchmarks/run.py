@@ -0,0 +1,238 @@
+"""Benchmark suite over synthetic rule tables.
+
+Times table load, index build, index lookups, selection toggling as done
+by the main() loop, export, search, candidate ranking, the feature matrix
+and annotator agreement for tables of 10 to 10,000 analyses, and writes
+the results as JSON so runs can be compared across releases.
+
+Usage: python benchmarks/run.py [--sizes 10,100,1000,10000] [--output results.json]
+       [--compare baseline.json] [--repeat N]
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from morphology.agreement import compare as compare_annotations
+from morphology.export import ExportCache, generate_copy_text
+from morphology.feats import FeatureVocabulary, format_feats
+from morphology.gold import GoldChecker, extract_gold
+from morphology.indexes import RuleIndex
+from morphology.lexicon import LexiconBuilder
+from morphology.matrix import FeatureMatrix
+from morphology.ranking import CandidateRanker, Token
+from morphology.search import SearchIndex
+from morphology.selection import SelectionStore
+from morphology.table import RuleTable, build_recommendation_record, iter_recommendations
+from synthetic import generate_table, write_rules_dir
+
+EXPORT_SELECTION = 1000
+RANK_TOKENS = 10000
+AGREEMENT_TOKENS = 50000
+QUERIES = ('honorific respect', 'plural object', 'teacher', 'sequnce', 'yesterday', 'Nom')
+
+
+def best_of(repeat, setup, run):
+    # Minimum wall time of run(state) over repeat fresh setups
+    timings = []
+    for _ in range(repeat):
+        state = setup()
+        started = time.perf_counter()
+        run(state)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_size(analyses, args):
+    table = generate_table(analyses, args.scenarios, args.recommendations, args.examples, args.seed)
+    with tempfile.TemporaryDirectory() as directory:
+        write_rules_dir(table, directory)
+        return list(_bench_table(directory, args))
+
+
+def _bench_table(directory, args):
+    repeat = args.repeat
+
+    def load(rules):
+        for key in rules:
+            rules[key]
+
+    seconds = best_of(repeat, lambda: RuleTable(directory), load)
+    rules = RuleTable(directory, check_interval=float('inf'))
+    load(rules)
+    ids = [unique_id for unique_id, *_ in iter_recommendations(rules)]
+    yield 'load', seconds, len(rules)
+
+    seconds = best_of(repeat, lambda: RuleIndex(rules, FeatureVocabulary()), lambda index: index.sync())
+    yield 'index_build', seconds, len(ids)
+
+    index = RuleIndex(rules)
+    index.sync()
+    terms = [('xpos', t) for t in index.terms('xpos')] + [('feature_value', t) for t in index.terms('feature_value')]
+    seconds = best_of(repeat, lambda: index, lambda ix: [ix.lookup(kind, term) for kind, term in terms])
+    yield 'index_lookup', seconds, len(terms)
+
+    # One rerun of the main() loop with every other recommendation checked
+    records = {unique_id: build_recommendation_record(rules, unique_id) for unique_id in ids}
+
+    def rerun(store):
+        for i, unique_id in enumerate(ids):
+            if i % 2 == 0:
+                if unique_id not in store:
+                    store.add(records[unique_id])
+            else:
+                store.discard(unique_id)
+
+    seconds = best_of(repeat, SelectionStore, rerun)
+    yield 'selection_rerun', seconds, len(ids)
+
+    selected = SelectionStore(records[unique_id] for unique_id in ids[:EXPORT_SELECTION])
+    seconds = best_of(repeat, ExportCache, lambda cache: generate_copy_text(selected, cache=cache))
+    yield 'export_cold', seconds, len(selected)
+
+    cache = ExportCache()
+    generate_copy_text(selected, cache=cache)
+    seconds = best_of(repeat, lambda: cache, lambda c: generate_copy_text(selected, cache=c))
+    yield 'export_warm', seconds, len(selected)
+
+    seconds = best_of(repeat, lambda: SearchIndex(rules), lambda search_index: search_index.sync())
+    yield 'search_build', seconds, len(ids)
+
+    search_index = SearchIndex(rules)
+    search_index.sync()
+    seconds = best_of(repeat, lambda: search_index, lambda ix: [ix.search(q) for q in QUERIES])
+    yield 'search_query', seconds, len(QUERIES)
+
+    # A document of tokens, each with the factors of one recommendation
+    # and restricted to its XPOS
+    samples = [(rec['xpos'], tuple(rec.get('decision_factors', ()))) for _, _, _, rec in iter_recommendations(rules)]
+    tokens = [Token(None, xpos, None, factors) for xpos, factors in
+              (samples[i % len(samples)] for i in range(RANK_TOKENS))]
+    ranker = CandidateRanker(rules)
+    ranker.factors()
+    seconds = best_of(repeat, lambda: ranker, lambda r: r.rank_many(tokens, limit=3))
+    yield 'rank_batch', seconds, len(tokens)
+
+    examples = extract_gold(rules)
+    checker = GoldChecker(index)
+    seconds = best_of(repeat, lambda: checker, lambda c: c.check(examples))
+    yield 'gold_check', seconds, len(examples)
+
+    builder = LexiconBuilder()
+    builder.add_examples(rules)
+    lexicon = builder.build()
+    words = [word for example in examples for word in example.words]
+    seconds = best_of(repeat, lambda: lexicon, lambda lx: lx.lookup_many(words, limit=10))
+    yield 'lexicon_lookup', seconds, len(words)
+
+    seconds = best_of(repeat, lambda: FeatureMatrix(rules), lambda matrix: matrix.rows())
+    yield 'matrix_build', seconds, len(ids)
+
+    # Two annotators of the example words, the second changing every
+    # tenth token's XPOS to the next example's
+    gold = [(word, example.xpos, format_feats(example.feats)) for example in examples for word in example.words]
+    paths = []
+    for annotator in range(2):
+        path = os.path.join(directory, f"annotator{annotator}.conllu")
+        with open(path, 'w', encoding='utf-8') as f:
+            for start in range(0, AGREEMENT_TOKENS, 10):
+                f.write(f"# sent_id = {start}\n")
+                for i in range(start, start + 10):
+                    form, xpos, feats = gold[i % len(gold)]
+                    if annotator and i % 10 == 0:
+                        xpos = gold[(i + 1) % len(gold)][1]
+                    f.write(f"{i - start + 1}\t{form}\t_\t_\t{xpos}\t{feats}\t0\troot\t_\t_\n")
+                f.write('\n')
+        paths.append(path)
+    seconds = best_of(repeat, lambda: index, lambda ix: compare_annotations(paths, ix, workers=1))
+    yield 'agreement', seconds, AGREEMENT_TOKENS
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    # Returns the results that got slower than baseline by more than threshold
+    previous = {(r['name'], r['analyses']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['name'], result['analyses']))
+        if before and before['per_op_us'] and result['per_op_us'] / before['per_op_us'] > threshold:
+            regressions.append((result, before))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark suite over synthetic rule tables.")
+    parser.add_argument('--sizes', default='10,100,1000,10000', help='comma-separated analysis counts')
+    parser.add_argument('--scenarios', type=int, default=2)
+    parser.add_argument('--recommendations', type=int, default=3)
+    parser.add_argument('--examples', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write JSON results here (default: stdout)')
+    parser.add_argument('--compare', metavar='BASELINE', help='JSON results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = []
+    for analyses in (int(size) for size in args.sizes.split(',')):
+        for name, seconds, ops in bench_size(analyses, args):
+            results.append({
+                'name': name,
+                'analyses': analyses,
+                'scenarios': args.scenarios,
+                'recommendations': args.recommendations,
+                'examples': args.examples,
+                'ops': ops,
+                'seconds': seconds,
+                'per_op_us': seconds / ops * 1e6 if ops else None,
+            })
+            print(f"{name:<16}{analyses:>7} analyses {seconds * 1e3:>10.2f} ms "
+                  f"({results[-1]['per_op_us']:.2f} us/op)", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for result, before in regressions:
+            print(f"REGRESSION {result['name']} @ {result['analyses']}: "
+                  f"{before['per_op_us']:.2f} -> {result['per_op_us']:.2f} us/op", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Synthetic decision tables shaped like the real rule table.
+
+Usage: python benchmarks/synthetic.py OUTPUT_DIR [--analyses N] [--scenarios N]
+       [--recommendations N] [--examples N] [--seed N]
+"""
+
+import argparse
+import json
+import os
+import random
+
+UPOS_XPOS = {
+    'NOUN': ('NN', 'NNS', 'NNP'),
+    'VERB': ('VM', 'VINF', 'VAUX'),
+    'ADV': ('RB',),
+    'PRON': ('PRP', 'V_PRON-HON'),
+    'DET': ('DT',),
+    'ADP': ('IN',),
+    'NUM': ('CD',),
+    'PART': ('RP',),
+}
+
+FEATURES = {
+    'Number': ('Sing', 'Plur'),
+    'Case': ('Nom', 'Acc', 'Loc', 'Ins'),
+    'Gender': ('Masc', 'Fem', 'Neut'),
+    'Person': ('1', '2', '3'),
+    'Honorificity': ('Yes', 'No'),
+    'Tense': ('Pres', 'Past', 'Fut'),
+    'VerbForm': ('Fin', 'Inf', 'Part'),
+    'Degree': ('Pos', 'Cmp', 'Sup'),
+    'NumType': ('Card', 'Ord'),
+    'Polarity': ('Pos', 'Neg'),
+}
+
+WORDS = ('cat', 'house', 'student', 'walk', 'quickly', 'sir', 'three', 'not', 'the', 'in', 'river',
+         'teacher', 'yesterday', 'often', 'book', 'city', 'friend', 'letter', 'garden', 'market')
+
+# Example words are one of WORDS a third of the time and otherwise a
+# pseudo-word of two to four syllables, so that, as in real rules, most
+# recommendations annotate forms no other recommendation does
+SYLLABLES = tuple(consonant + vowel for consonant in 'bdfgklmnprstvz' for vowel in 'aeiou')
+COMMON_WORDS = 1 / 3
+
+FACTORS = ('Subject position', 'Object position', 'Plural verb', 'Respect marking', 'Formal context',
+           'After modals', 'Shows tense', 'Sequence', 'Negation', 'Proper name')
+
+
+def _word(rng):
+    if rng.random() < COMMON_WORDS:
+        return rng.choice(WORDS)
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def _feats(rng):
+    names = rng.sample(sorted(FEATURES), rng.randint(1, 4))
+    parts = []
+    for name in names:
+        values = FEATURES[name]
+        chosen = rng.sample(values, rng.randint(1, min(2, len(values))))
+        parts.append(f"{name}={'/'.join(chosen)}")
+    return ' | '.join(parts)
+
+
+def generate_table(analyses=10, scenarios=2, recommendations=3, examples=3, seed=0):
+    rng = random.Random(seed)
+    upos_tags = sorted(UPOS_XPOS)
+    table = {}
+    for a in range(analyses):
+        upos = upos_tags[a % len(upos_tags)]
+        xpos_tags = list(UPOS_XPOS[upos])
+        analysis_scenarios = []
+        for s in range(scenarios):
+            recs = []
+            for r in range(recommendations):
+                xpos = rng.choice(xpos_tags)
+                feats = _feats(rng)
+                # Gold annotations name one concrete value per feature
+                gold = ', '.join(part.split('/')[0] for part in feats.split(' | '))
+                recs.append({
+                    'choice': f"Use {xpos} (option {a}.{s}.{r})",
+                    'xpos': xpos,
+                    'feats': feats,
+                    'when': f"For {rng.choice(WORDS)} contexts with {rng.choice(FACTORS).lower()}",
+                    'examples': [
+                        f"The {word} appears here ({word}={xpos}, {gold})"
+                        for word in (_word(rng) for _ in range(examples))
+                    ],
+                    'morphological_rules': f"{xpos}: {feats}",
+                    'decision_factors': rng.sample(FACTORS, 3),
+                })
+            analysis_scenarios.append({
+                'context': f"Scenario {s} for {upos}",
+                'question': f"Which {upos.lower()} form fits scenario {s}?",
+                'recommendations': recs,
+            })
+        table[f"SYN{a}_analysis"] = {
+            'title': f"Synthetic {upos} analysis {a} ({', '.join(xpos_tags)})",
+            'description': f"Synthetic analysis {a}",
+            'upos': upos,
+            'xpos_tags': xpos_tags,
+            'scenarios': analysis_scenarios,
+        }
+    return table
+
+
+def write_rules_dir(table, directory):
+    # Same layout as morphology/rules: index.json plus one file per analysis
+    os.makedirs(directory, exist_ok=True)
+    manifest = {'analyses': []}
+    for key, analysis in table.items():
+        entry = {'key': key, 'file': f"{key}.json"}
+        entry.update({field: analysis[field] for field in ('title', 'description', 'upos', 'xpos_tags')})
+        manifest['analyses'].append(entry)
+        with open(os.path.join(directory, entry['file']), 'w', encoding='utf-8') as f:
+            json.dump({'scenarios': analysis['scenarios']}, f, ensure_ascii=False)
+    with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return directory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic rules directory.")
+    parser.add_argument('output')
+    parser.add_argument('--analyses', type=int, default=100)
+    parser.add_argument('--scenarios', type=int, default=2)
+    parser.add_argument('--recommendations', type=int, default=3)
+    parser.add_argument('--examples', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    table = generate_table(args.analyses, args.scenarios, args.recommendations, args.examples, args.seed)
+    print(write_rules_dir(table, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Headless core of the UD morphological decision support tool.
+
+Nothing in this package imports Streamlit, so the rule table, lookups
+and export can be used from batch jobs and workers; ``xpomo.py`` is the
+Streamlit UI on top of it.
+"""
+
+from .export import FORMATS, ExportCache, generate_copy_text, iter_export, write_export
+from .feats import VOCABULARY, FeatureVocabulary, feats_match, format_feats, parse_feats, parse_rule
+from .indexes import RuleIndex, get_rule_index
+from .selection import SelectionStore
+from .table import (
+    available_languages,
+    build_recommendation_record,
+    iter_recommendations,
+    load_complete_morphology_data,
+    parse_recommendation_id,
+    recommendation_id,
+)
+
+__all__ = [
+    'ExportCache',
+    'FORMATS',
+    'FeatureVocabulary',
+    'RuleIndex',
+    'SelectionStore',
+    'VOCABULARY',
+    'available_languages',
+    'build_recommendation_record',
+    'feats_match',
+    'format_feats',
+    'generate_copy_text',
+    'get_rule_index',
+    'iter_export',
+    'iter_recommendations',
+    'load_complete_morphology_data',
+    'parse_feats',
+    'parse_recommendation_id',
+    'parse_rule',
+    'recommendation_id',
+    'write_export',
+]
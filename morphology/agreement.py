@@ -0,0 +1,333 @@
+"""Inter-annotator agreement over XPOS and FEATS.
+
+Two or more CoNLL-U annotations of the same text are aligned sentence by
+sentence. Sentences whose token ids or forms differ between annotators are
+skipped. Each annotator's tokens are reduced to an id per distinct
+(XPOS, FEATS) pair. Those pairs are coded once against label tables seeded
+from the rule table's XPOS tags and feature values. NumPy then expands
+them to one integer array per annotator and dimension (XPOS, or one
+feature). Confusion matrices are ``bincount`` calls over the coded arrays
+and kappa is computed from them, so the cost per token is just reading it.
+
+For two annotators ``kappa`` is Cohen's; for more it is Fleiss'. A feature
+is only scored on tokens where at least one annotator gives it, with
+"absent" as one of its labels. The most frequent disagreements are linked
+to the analysis and scenario of the app that decides between the two
+labels.
+
+Usage: python -m morphology.agreement FILE FILE... [--json OUT] [--top N] [--app-url URL] [--language LANG]
+"""
+
+import argparse
+import json
+import sys
+import time
+from array import array
+from collections import namedtuple
+from itertools import combinations, islice, zip_longest
+
+import numpy as np
+
+from .conllu import FEATS, FORM, ID, XPOS, iter_tokens, read_file
+from .feats import parse_feats
+from .indexes import get_rule_index
+from .parallel import map_blocks
+from .table import parse_recommendation_id
+
+NONE = '_'
+APP_URL = 'http://localhost:8501'
+
+# observed: mean pairwise agreement; pairwise: {(a, b): Cohen's kappa};
+# confusion: label x label counts summed over annotator pairs (a's label
+# on rows)
+Agreement = namedtuple('Agreement', 'dimension tokens observed kappa pairwise confusion labels known')
+
+
+class LabelCodes:
+    # Label <-> integer code for one dimension. Code 0 is NONE ('_' or an
+    # absent feature); the next codes are the rule table's labels.
+
+    def __init__(self, labels=()):
+        self.labels = [NONE]
+        self._codes = {NONE: 0}
+        for label in labels:
+            self.code(label)
+        self.known = len(self.labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def code(self, label):
+        code = self._codes.get(label)
+        if code is None:
+            code = self._codes[label] = len(self.labels)
+            self.labels.append(label)
+        return code
+
+
+def read_aligned(paths, block_size):
+    # Yields ([(sentence of each annotator), ...],) work units of up to
+    # block_size sentences; a missing sentence is None
+    sentences = zip_longest(*(read_file(path) for path in paths))
+    while True:
+        block = list(islice(sentences, block_size))
+        if not block:
+            break
+        yield (block,)
+
+
+def _encode_block(block):
+    # Aligns a block; returns (per annotator: distinct (XPOS, FEATS) pairs
+    # and u32 ids into them per token, u32 lines, aligned, skipped). Ids are
+    # local to the block and remapped by the caller.
+    annotators = len(block[0])
+    combos = [{} for _ in range(annotators)]
+    ids = [array('I') for _ in range(annotators)]
+    lines = array('I')
+    aligned = skipped = 0
+    for sentences in block:
+        if any(sentence is None for sentence in sentences):
+            skipped += 1
+            continue
+        tokens = [list(iter_tokens(sentence)) for sentence in sentences]
+        first = [(fields[ID], fields[FORM]) for _, fields in tokens[0]]
+        if any([(fields[ID], fields[FORM]) for _, fields in other] != first for other in tokens[1:]):
+            skipped += 1
+            continue
+        aligned += 1
+        lines.extend(line for line, _ in tokens[0])
+        for seen, annotator_ids, annotated in zip(combos, ids, tokens):
+            annotator_ids.extend(seen.setdefault((fields[XPOS], fields[FEATS]), len(seen))
+                                 for _, fields in annotated)
+    return [list(seen) for seen in combos], [annotator_ids.tobytes() for annotator_ids in ids], \
+        lines.tobytes(), aligned, skipped
+
+
+class Annotations:
+    # Aligned annotations: for annotator i, combos[i] lists its distinct
+    # (XPOS, FEATS) pairs and ids[i][t] indexes them for aligned token t.
+    # lines[t] is the token's line in the first file.
+
+    def __init__(self, paths, workers=None, block_size=500):
+        if len(paths) < 2:
+            raise ValueError('agreement needs at least two annotations')
+        self.paths = list(paths)
+        self.sentences = 0
+        self.skipped = 0
+        combos = [{} for _ in paths]
+        ids = [[] for _ in paths]
+        lines = []
+        for local_combos, local_ids, block_lines, aligned, skipped in map_blocks(
+                _encode_block, read_aligned(paths, block_size), workers):
+            self.sentences += aligned
+            self.skipped += skipped
+            lines.append(np.frombuffer(block_lines, dtype=np.uint32))
+            for seen, annotator_ids, block_combos, block_ids in zip(combos, ids, local_combos, local_ids):
+                remap = np.array([seen.setdefault(combo, len(seen)) for combo in block_combos], dtype=np.intp)
+                annotator_ids.append(remap[np.frombuffer(block_ids, dtype=np.uint32)])
+        self.combos = [list(seen) for seen in combos]
+        self._feats = [[dict(parse_feats(feats)) for _, feats in seen] for seen in self.combos]
+        self.ids = [np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.intp) for chunks in ids]
+        self.lines = np.concatenate(lines) if lines else np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def xpos_codes(self, codes):
+        # (annotators, tokens) array of XPOS codes
+        return np.stack([np.array([codes.code(xpos) for xpos, _ in combos], dtype=np.intp)[ids]
+                         for combos, ids in zip(self.combos, self.ids)])
+
+    def feature_codes(self, name, codes):
+        # (annotators, tokens) array of the feature's value codes
+        rows = []
+        for parsed, ids in zip(self._feats, self.ids):
+            by_combo = [codes.code(','.join(sorted(feats[name])) if name in feats else NONE) for feats in parsed]
+            rows.append(np.array(by_combo, dtype=np.intp)[ids])
+        return np.stack(rows)
+
+    def features(self):
+        return sorted({name for parsed in self._feats for feats in parsed for name in feats}, key=str.lower)
+
+
+def _kappa(observed, expected):
+    return 1.0 if expected >= 1.0 else (observed - expected) / (1.0 - expected)
+
+
+def agreement(dimension, codes, labels):
+    # codes: (annotators, tokens) array of codes into labels (a LabelCodes)
+    size = len(labels)
+    annotators, tokens = codes.shape
+    confusion = np.zeros((size, size), dtype=np.int64)
+    pairwise = {}
+    observed = []
+    for a, b in combinations(range(annotators), 2):
+        pair = np.bincount(codes[a] * size + codes[b], minlength=size * size).reshape(size, size)
+        confusion += pair
+        agreed = np.trace(pair) / tokens if tokens else 1.0
+        observed.append(agreed)
+        expected = float(pair.sum(axis=1) @ pair.sum(axis=0)) / tokens ** 2 if tokens else 1.0
+        pairwise[a, b] = _kappa(agreed, expected)
+    mean_observed = float(np.mean(observed))
+    if annotators == 2:
+        kappa = pairwise[0, 1]
+    else:
+        # Fleiss: mean pairwise agreement against the pooled label distribution
+        shares = np.bincount(codes.ravel(), minlength=size) / codes.size if tokens else np.zeros(size)
+        kappa = _kappa(mean_observed, float(shares @ shares))
+    return Agreement(dimension, tokens, mean_observed, kappa, pairwise, confusion, list(labels.labels),
+                     labels.known)
+
+
+def label_kappas(result):
+    # One-vs-rest kappa per label from the symmetrised confusion matrix;
+    # NaN for labels nobody used
+    pooled = result.confusion + result.confusion.T
+    total = pooled.sum()
+    used = pooled.sum(axis=1)
+    both = np.diag(pooled)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        observed = (total - 2 * used + 2 * both) / total
+        share = used / total
+        expected = share ** 2 + (1 - share) ** 2
+        kappas = np.where(expected < 1.0, (observed - expected) / (1.0 - expected), 1.0)
+    return np.where(used > 0, kappas, np.nan)
+
+
+def disagreements(result):
+    # [(count, label, other label)] most frequent first, order-independent
+    pooled = np.triu(result.confusion + result.confusion.T, k=1)
+    rows, cols = np.nonzero(pooled)
+    order = np.argsort(-pooled[rows, cols], kind='stable')
+    return [(int(pooled[rows[i], cols[i]]), result.labels[rows[i]], result.labels[cols[i]]) for i in order]
+
+
+def example_lines(codes, lines, code, other, limit=3):
+    # Lines (in the first file) of tokens where two annotators chose code and other
+    hits = np.zeros(codes.shape[1], dtype=bool)
+    for a, b in combinations(range(codes.shape[0]), 2):
+        hits |= ((codes[a] == code) & (codes[b] == other)) | ((codes[a] == other) & (codes[b] == code))
+    return [int(line) for line in lines[np.flatnonzero(hits)[:limit]]]
+
+
+def decision_point(index, dimension, label, other):
+    # (analysis key, scenario index) offering both labels, else either; None if no rule does
+    def scenarios(value):
+        if value == NONE:
+            return []
+        if dimension == 'XPOS':
+            ids = index.lookup('xpos', value)
+        else:
+            ids = [unique_id for single in value.split(',')
+                   for unique_id in index.lookup('feature_value', (dimension, single))]
+        return list(dict.fromkeys(parse_recommendation_id(unique_id)[:2] for unique_id in ids))
+
+    first, second = scenarios(label), scenarios(other)
+    both = [scenario for scenario in first if scenario in second]
+    candidates = both or first or second
+    return candidates[0] if candidates else None
+
+
+def scenario_link(app_url, analysis_key, scenario_idx, language=None):
+    language = f"&lang={language}" if language else ''
+    return f"{app_url}?analysis={analysis_key}{language}#{analysis_key}-{scenario_idx}"
+
+
+def compare(paths, index=None, top=20, app_url=APP_URL, language=None, workers=None, block_size=500):
+    # The full report as a JSON-ready dict
+    index = index if index is not None else get_rule_index(language)
+    annotations = Annotations(paths, workers, block_size)
+    results = []
+    xpos_labels = LabelCodes(index.terms('xpos'))
+    codes = annotations.xpos_codes(xpos_labels)
+    results.append((agreement('XPOS', codes, xpos_labels), codes))
+    rule_values = {}
+    for name, value in index.terms('feature_value'):
+        rule_values.setdefault(name, []).append(value)
+    for name in annotations.features():
+        labels = LabelCodes(rule_values.get(name, ()))
+        codes = annotations.feature_codes(name, labels)
+        scored = codes[:, (codes != 0).any(axis=0)]
+        results.append((agreement(name, scored, labels), codes))
+
+    found = []
+    for result, codes in results:
+        for count, label, other in disagreements(result):
+            found.append((count, result, codes, label, other))
+    found.sort(key=lambda item: -item[0])
+    top_disagreements = []
+    for count, result, codes, label, other in found[:top]:
+        point = decision_point(index, result.dimension, label, other)
+        entry = {
+            'dimension': result.dimension, 'labels': [label, other], 'count': count,
+            'lines': example_lines(codes, annotations.lines, result.labels.index(label),
+                                   result.labels.index(other)),
+        }
+        if point is not None:
+            entry.update(analysis=point[0], scenario=point[1],
+                         link=scenario_link(app_url, *point, language))
+        top_disagreements.append(entry)
+
+    def summary(result):
+        kappas = label_kappas(result)
+        return {
+            'dimension': result.dimension, 'tokens': result.tokens, 'observed': result.observed,
+            'kappa': result.kappa,
+            'pairwise': [{'annotators': [paths[a], paths[b]], 'kappa': kappa}
+                         for (a, b), kappa in result.pairwise.items()],
+            'labels': [{'label': label, 'in_rules': code < result.known, 'kappa': None if np.isnan(kappas[code])
+                        else float(kappas[code]), 'count': int(result.confusion[code].sum() +
+                                                                result.confusion[:, code].sum())}
+                       for code, label in enumerate(result.labels)],
+            'confusion': result.confusion.tolist(),
+        }
+
+    return {
+        'files': list(paths),
+        'sentences': annotations.sentences,
+        'skipped_sentences': annotations.skipped,
+        'tokens': len(annotations),
+        'dimensions': [summary(result) for result, _ in results],
+        'disagreements': top_disagreements,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inter-annotator agreement on XPOS and FEATS.")
+    parser.add_argument('files', nargs='+', metavar='FILE', help='two or more annotations of the same text')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    parser.add_argument('--json', metavar='OUT', help='write the full report, with confusion matrices, here')
+    parser.add_argument('--top', type=int, default=20, help='disagreements to list')
+    parser.add_argument('--app-url', default=APP_URL, help='app address for links to scenarios')
+    parser.add_argument('--language', help='rule set whose vocabularies and scenarios are used')
+    args = parser.parse_args(argv)
+    if len(args.files) < 2:
+        parser.error('give at least two files')
+
+    started = time.perf_counter()
+    report = compare(args.files, top=args.top, app_url=args.app_url, language=args.language,
+                     workers=args.workers, block_size=args.block_size)
+    elapsed = time.perf_counter() - started
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+    out = sys.stdout
+    out.write(f"{'dimension':<16}{'tokens':>10}{'agreement':>11}{'kappa':>8}\n")
+    for dimension in report['dimensions']:
+        out.write(f"{dimension['dimension']:<16}{dimension['tokens']:>10}{dimension['observed']:>11.3f}"
+                  f"{dimension['kappa']:>8.3f}\n")
+    out.write('\nMost frequent disagreements:\n')
+    for entry in report['disagreements']:
+        labels = ' vs '.join(entry['labels'])
+        where = entry.get('link', 'no rule decides this')
+        out.write(f"{entry['count']:>8}  {entry['dimension']}: {labels}  (lines {', '.join(map(str, entry['lines']))})"
+                  f"  {where}\n")
+    print(f"{report['tokens']} aligned tokens in {report['sentences']} sentences "
+          f"({report['skipped_sentences']} skipped) in {elapsed:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""Minimal streaming CoNLL-U reader and writer."""
+
+from collections import namedtuple
+from itertools import islice
+
+ID, FORM, LEMMA, UPOS, XPOS, FEATS, HEAD, DEPREL, DEPS, MISC = range(10)
+
+# lines: the raw sentence lines (comments and tokens, no trailing blank
+# line); start: 1-based line number of the first of them in the file
+Sentence = namedtuple('Sentence', 'lines start')
+
+
+def read_sentences(lines):
+    # Yields one Sentence per blank-line separated block, holding only
+    # that block in memory
+    block = []
+    start = 1
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\n')
+        if line.strip():
+            if not block:
+                start = lineno
+            block.append(line)
+        elif block:
+            yield Sentence(block, start)
+            block = []
+    if block:
+        yield Sentence(block, start)
+
+
+def read_file(path):
+    with open(path, encoding='utf-8') as f:
+        yield from read_sentences(f)
+
+
+def read_blocks(paths, block_size):
+    # Yields (path, [Sentence, ...]) work units of up to block_size sentences
+    for path in paths:
+        sentences = read_file(path)
+        while True:
+            block = list(islice(sentences, block_size))
+            if not block:
+                break
+            yield path, block
+
+
+def iter_tokens(sentence):
+    # Yields (line number, fields) for syntactic words, skipping comments,
+    # multiword token ranges and empty nodes
+    for offset, line in enumerate(sentence.lines):
+        if line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) != 10 or '-' in fields[ID] or '.' in fields[ID]:
+            continue
+        yield sentence.start + offset, fields
+
+
+def format_sentence(lines):
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,275 @@
+"""Consistency and conflict checks over the rule table.
+
+Per analysis, each recommendation's ``feats`` is compared with its
+``morphological_rules``, its examples' inline ``(word=TAG, Feat=Val)``
+annotations with the recommendation, and the header's ``xpos_tags`` with
+the XPOS the recommendations actually use. Across analyses, every analysis
+contributes a profile per XPOS (its UPOS and the values it allows per
+feature). Profiles are indexed by (XPOS, feature) and grouped by their
+value sets, so a conflict is found by comparing the few distinct value
+sets of a group, never pairs of analyses.
+
+``ConsistencyChecker.sync`` re-checks only the analyses the table has
+reloaded and the XPOS groups they touch.
+
+Usage: python -m morphology.consistency [--rules DIR] [--ignore KIND]
+"""
+
+import argparse
+import sys
+import threading
+from collections import Counter, namedtuple
+
+from .feats import format_feats, parse_feats, parse_rule
+from .gold import example_problems, parse_example
+from .table import RuleTable, iter_recommendations, load_complete_morphology_data
+
+Finding = namedtuple('Finding', 'kind analysis rec_id xpos message')
+
+# Finding kinds
+FEATS_RULE_MISMATCH = 'feats-rule-mismatch'
+RULE_XPOS_MISMATCH = 'rule-xpos-mismatch'
+ALIAS_NOTATION = 'alias-notation'
+EXAMPLE_XPOS = 'example-xpos'
+EXAMPLE_FEATS = 'example-feats'
+XPOS_WITHOUT_RECOMMENDATION = 'xpos-without-recommendation'
+UNLISTED_XPOS = 'unlisted-xpos'
+XPOS_UPOS_CONFLICT = 'xpos-upos-conflict'
+XPOS_FEATS_CONFLICT = 'xpos-feats-conflict'
+
+
+def _raw_values(feats):
+    # Feature -> values as written, before alias normalisation
+    raw = {}
+    for part in feats.split('|'):
+        name, sep, values = part.strip().partition('=')
+        if sep:
+            raw[name.strip()] = {v.strip() for v in values.replace(',', '/').split('/') if v.strip()}
+    return raw
+
+
+def _describe_difference(have, want, have_label, want_label):
+    have, want = dict(have), dict(want)
+    problems = []
+    for name in sorted(set(have) | set(want), key=str.lower):
+        if name not in want:
+            problems.append(f"{name} only in {have_label}")
+        elif name not in have:
+            problems.append(f"{name} only in {want_label}")
+        elif have[name] != want[name]:
+            problems.append(f"{name}={'/'.join(sorted(have[name]))} in {have_label} "
+                            f"vs {'/'.join(sorted(want[name]))} in {want_label}")
+    return problems
+
+
+def check_recommendation(analysis_key, unique_id, rec):
+    # Findings local to one recommendation
+    xpos = rec['xpos']
+    feats = parse_feats(rec['feats'])
+    rule_xpos, rule_feats = parse_rule(rec['morphological_rules'])
+    if rule_xpos is not None and rule_xpos != xpos:
+        yield Finding(RULE_XPOS_MISMATCH, analysis_key, unique_id, xpos,
+                      f"rule is for {rule_xpos}, recommendation for {xpos}")
+    if feats != rule_feats:
+        yield Finding(FEATS_RULE_MISMATCH, analysis_key, unique_id, xpos,
+                      '; '.join(_describe_difference(feats, rule_feats, 'feats', 'rule')))
+    else:
+        written = _raw_values(rec['feats'])
+        rule_written = _raw_values(rec['morphological_rules'].partition(':')[2] or rec['morphological_rules'])
+        for name in sorted(written, key=str.lower):
+            if name in rule_written and written[name] != rule_written[name]:
+                yield Finding(ALIAS_NOTATION, analysis_key, unique_id, xpos,
+                              f"{name} written {'/'.join(sorted(written[name]))} in feats "
+                              f"but {'/'.join(sorted(rule_written[name]))} in rule")
+
+    for example in rec['examples']:
+        parsed = parse_example(example)
+        if parsed is None:
+            continue
+        words, gold_xpos, gold_feats = parsed
+        if gold_xpos != xpos:
+            yield Finding(EXAMPLE_XPOS, analysis_key, unique_id, xpos,
+                          f"example tags {'...'.join(words)}={gold_xpos} but recommends {xpos}: {example}")
+        problems = example_problems(xpos, feats, xpos, gold_feats)
+        if problems:
+            yield Finding(EXAMPLE_FEATS, analysis_key, unique_id, xpos, f"{'; '.join(problems)}: {example}")
+
+
+def analysis_profiles(analysis_key, analysis):
+    # XPOS -> (UPOS set, feature -> union of allowed values) for one analysis
+    profiles = {}
+    upos = frozenset(analysis['upos'].split('/'))
+    for _, _, _, rec in iter_recommendations({analysis_key: analysis}):
+        _, features = profiles.setdefault(rec['xpos'], (upos, {}))
+        for name, values in parse_feats(rec['feats']):
+            features[name] = features.get(name, frozenset()) | values
+    return profiles
+
+
+def check_analysis(analysis_key, analysis):
+    findings = []
+    used = set()
+    for unique_id, _, _, rec in iter_recommendations({analysis_key: analysis}):
+        used.add(rec['xpos'])
+        findings.extend(check_recommendation(analysis_key, unique_id, rec))
+    listed = analysis.get('xpos_tags', ())
+    for xpos in listed:
+        if xpos not in used:
+            findings.append(Finding(XPOS_WITHOUT_RECOMMENDATION, analysis_key, None, xpos,
+                                    f"{xpos} is listed in xpos_tags but no recommendation uses it"))
+    for xpos in sorted(used - set(listed)):
+        findings.append(Finding(UNLISTED_XPOS, analysis_key, None, xpos,
+                                f"{xpos} is recommended but missing from xpos_tags"))
+    return findings
+
+
+def _names(keys, limit=5):
+    keys = list(keys)
+    if len(keys) <= limit:
+        return ', '.join(keys)
+    return f"{', '.join(keys[:limit])} and {len(keys) - limit} more"
+
+
+class ConsistencyChecker:
+    # Cross-analysis state is grouped per (XPOS, feature), or (XPOS, None)
+    # for UPOS: each distinct set of allowed values maps to the analyses
+    # allowing exactly that. Only the distinct sets of a group are compared,
+    # and only groups a reloaded analysis touches are re-evaluated.
+
+    def __init__(self, decisions):
+        self._decisions = decisions
+        self._local = {}       # analysis key -> findings
+        self._profiles = {}    # analysis key -> XPOS -> profile
+        self._groups = {}      # (XPOS, feature) -> value set -> analysis keys
+        self._cross = {}       # (XPOS, feature) -> finding
+        self._checked = {}     # analysis key -> generation
+        self._order = {}       # analysis key -> table position
+        self._version = None
+        self._lock = threading.RLock()
+
+    def _generation(self, analysis_key):
+        generation = getattr(self._decisions, 'generation', None)
+        return generation(analysis_key) if generation else 0
+
+    @staticmethod
+    def _group_entries(profiles):
+        for xpos, (upos, features) in profiles.items():
+            yield (xpos, None), upos
+            for name, values in features.items():
+                yield (xpos, name), values
+
+    def _remove(self, analysis_key):
+        self._checked.pop(analysis_key, None)
+        self._local.pop(analysis_key, None)
+        dirty = set()
+        for group, values in self._group_entries(self._profiles.pop(analysis_key, {})):
+            by_values = self._groups[group]
+            by_values[values].discard(analysis_key)
+            if not by_values[values]:
+                del by_values[values]
+                if not by_values:
+                    del self._groups[group]
+            dirty.add(group)
+        return dirty
+
+    def _add(self, analysis_key):
+        analysis = self._decisions[analysis_key]
+        self._checked[analysis_key] = self._generation(analysis_key)
+        self._local[analysis_key] = check_analysis(analysis_key, analysis)
+        profiles = self._profiles[analysis_key] = analysis_profiles(analysis_key, analysis)
+        dirty = set()
+        for group, values in self._group_entries(profiles):
+            self._groups.setdefault(group, {}).setdefault(values, set()).add(analysis_key)
+            dirty.add(group)
+        return dirty
+
+    def _check_group(self, group):
+        self._cross.pop(group, None)
+        by_values = self._groups.get(group)
+        if not by_values or len(by_values) < 2:
+            return
+        distinct = list(by_values)
+        if not any(not first & second for i, first in enumerate(distinct) for second in distinct[i + 1:]):
+            return
+        xpos, name = group
+        # Largest camp first, each listing its analyses in table order
+        camps = sorted(((values, sorted(keys, key=self._position)) for values, keys in by_values.items()),
+                       key=lambda camp: (-len(camp[1]), self._position(camp[1][0])))
+        if name is None:
+            kind = XPOS_UPOS_CONFLICT
+            parts = [f"{'/'.join(sorted(values))} in {_names(keys)}" for values, keys in camps]
+        else:
+            kind = XPOS_FEATS_CONFLICT
+            parts = [f"{format_feats(((name, values),))} in {_names(keys)}" for values, keys in camps]
+        self._cross[group] = Finding(kind, camps[0][1][0], None, xpos,
+                                     f"{xpos} has incompatible {name or 'UPOS'}: {'; '.join(parts)}")
+
+    def _position(self, analysis_key):
+        return self._order.get(analysis_key, len(self._order))
+
+    def sync(self):
+        # Re-check analyses added or reloaded since the last sync; returns
+        # their keys (and those of removed analyses)
+        with self._lock:
+            poll = getattr(self._decisions, 'poll', None)
+            version = poll() if poll else None
+            if version == self._version and poll is not None and len(self._checked) == len(self._decisions):
+                return []
+            self._version = version
+            self._order = {analysis_key: i for i, analysis_key in enumerate(self._decisions)}
+            changed = []
+            dirty = set()
+            for analysis_key in list(self._checked):
+                if analysis_key not in self._decisions or \
+                        self._generation(analysis_key) != self._checked[analysis_key]:
+                    dirty |= self._remove(analysis_key)
+                    changed.append(analysis_key)
+            for analysis_key in self._decisions:
+                if analysis_key not in self._checked:
+                    dirty |= self._add(analysis_key)
+                    if analysis_key not in changed:
+                        changed.append(analysis_key)
+            for group in dirty:
+                self._check_group(group)
+            return changed
+
+    def findings(self, analysis_keys=None):
+        # Local findings in table order, then cross-analysis ones by XPOS
+        with self._lock:
+            self.sync()
+            if analysis_keys is None:
+                analysis_keys = self._decisions
+                groups = self._cross
+            else:
+                groups = {group for analysis_key in analysis_keys
+                          for group, _ in self._group_entries(self._profiles.get(analysis_key, {}))
+                          if group in self._cross}
+            found = [finding for analysis_key in analysis_keys for finding in self._local.get(analysis_key, ())]
+            for group in sorted(groups, key=lambda group: (group[0], group[1] or '')):
+                found.append(self._cross[group])
+            return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report contradictions and gaps in the rule table.")
+    parser.add_argument('--rules', metavar='DIR', help='rules directory (default: the bundled rules)')
+    parser.add_argument('--ignore', action='append', default=[], metavar='KIND',
+                        help=f"finding kind to skip, e.g. {ALIAS_NOTATION}")
+    args = parser.parse_args(argv)
+
+    decisions = RuleTable(args.rules) if args.rules else load_complete_morphology_data()
+    kinds = Counter()
+    for finding in ConsistencyChecker(decisions).findings():
+        if finding.kind in args.ignore:
+            continue
+        kinds[finding.kind] += 1
+        sys.stdout.write(f"{finding.analysis}\t{finding.rec_id or '-'}\t{finding.xpos}\t"
+                         f"{finding.kind}\t{finding.message}\n")
+    print(f"{len(decisions)} analyses, {sum(kinds.values())} findings", file=sys.stderr)
+    for kind, count in kinds.most_common():
+        print(f"  {kind}: {count}", file=sys.stderr)
+    return 1 if kinds else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""Convert XPOS-only CoNLL-U to UD UPOS + FEATS using the rule table.
+
+Every recommendation for an XPOS is a candidate analysis of that tag. A
+``ConversionTable`` is compiled once from the candidates:
+
+- UPOS is filled when all candidates agree on a single UPOS;
+- a feature is filled when every candidate gives it the same single value;
+- a feature the candidates disagree on (``CD`` NumType=Card vs Ord, ``RP``
+  Polarity=Neg vs Pos) or leave open (``NN`` Gender=M/F/N) is not guessed:
+  the token is flagged with ``Review=<features>`` in MISC, as is a token
+  whose UPOS is ambiguous.
+
+A token that already has a UPOS only takes values from the candidates
+allowing that UPOS; when none does (``AUX`` tagged ``VAUX``, whose rules
+are all VERB) nothing is filled and the token is flagged ``Review=UPOS``.
+Existing UPOS and FEATS values win over converted ones. Files are streamed
+and blocks of sentences converted in a process pool, preserving order.
+
+Usage: python -m morphology.convert FILE... [-o OUT | --output-dir DIR] [-j WORKERS] [--snapshot PATH] [--language LANG]
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter, namedtuple
+
+from .conllu import FEATS, MISC, UPOS, XPOS, format_sentence, read_blocks
+from .feats import format_feats, parse_feats
+from .indexes import RuleIndex, get_rule_index
+from .parallel import map_blocks
+from .snapshot import open_rule_table
+
+# upos: the UPOS or None when ambiguous; feats: parsed features every
+# candidate fixes to one value; review: the other feature names, plus 'UPOS'
+Conversion = namedtuple('Conversion', 'upos feats review')
+
+
+def compile_conversion(candidates):
+    upos_options = {upos for c in candidates for upos in c.upos}
+    upos = next(iter(upos_options)) if len(upos_options) == 1 else None
+    by_feature = {}
+    for candidate in candidates:
+        for name, values in candidate.feats:
+            by_feature.setdefault(name, []).append(values)
+    feats = []
+    review = [] if upos else ['UPOS']
+    for name, options in by_feature.items():
+        if len(options) == len(candidates) and len(set(options)) == 1 and len(options[0]) == 1:
+            feats.append((name, options[0]))
+        else:
+            review.append(name)
+    return Conversion(upos, tuple(sorted(feats, key=lambda item: item[0].lower())), tuple(sorted(review)))
+
+
+class ConversionTable:
+    # (XPOS, UPOS) -> Conversion, plus a cache of the filled UPOS and FEATS
+    # and the Review names per distinct (UPOS, XPOS, FEATS); MISC is applied
+    # after the lookup, so the cache is bounded by the tags, not the corpus
+
+    def __init__(self, index=None):
+        self._index = index if index is not None else get_rule_index()
+        self._conversions = {}
+        self._results = {}
+
+    def conversion(self, xpos, upos='_'):
+        # Conversion of the candidates for xpos that allow upos ('_' allows
+        # any), or None when there are none
+        key = (xpos, upos)
+        conversion = self._conversions.get(key, False)
+        if conversion is False:
+            candidates = [c for c in self._index.compiled_for('xpos', xpos) if upos == '_' or upos in c.upos]
+            conversion = self._conversions[key] = compile_conversion(candidates) if candidates else None
+        return conversion
+
+    def convert(self, upos, xpos, feats, misc):
+        # Returns (upos, feats, misc, status) with status one of
+        # 'converted', 'review' or 'unknown'
+        key = (upos, xpos, feats)
+        result = self._results.get(key)
+        if result is None:
+            result = self._results[key] = self._convert(upos, xpos, feats)
+        upos, feats, review, status = result
+        return upos, feats, review_flag(misc, review) if review else misc, status
+
+    def _convert(self, upos, xpos, feats):
+        conversion = self.conversion(xpos, upos)
+        if conversion is None:
+            if not self._index.compiled_for('xpos', xpos):
+                return upos, feats, (), 'unknown'
+            # The XPOS has rules, but none for the token's UPOS
+            return upos, feats, ('UPOS',), 'review'
+        upos, feats, review = fill_conversion(conversion, upos, feats)
+        return upos, feats, review, 'review' if review else 'converted'
+
+
+def fill_conversion(conversion, upos, feats):
+    # Fills a token from a Conversion, existing values winning; returns
+    # (upos, feats, names still to review)
+    if upos == '_' and conversion.upos:
+        upos = conversion.upos
+    existing = dict(parse_feats(feats))
+    merged = dict(conversion.feats)
+    merged.update(existing)
+    feats = format_feats(tuple(sorted(merged.items(), key=lambda item: item[0].lower())))
+    review = tuple(name for name in conversion.review
+                   if name not in existing and not (name == 'UPOS' and upos != '_'))
+    return upos, feats, review
+
+
+def review_flag(misc, review):
+    # MISC with Review=<names> added
+    flag = f"Review={','.join(review)}"
+    return flag if misc == '_' else f"{misc}|{flag}"
+
+
+def convert_sentences(sentences, table):
+    # Yields (converted text, status counts) per sentence
+    for sentence in sentences:
+        counts = Counter()
+        lines = []
+        for line in sentence.lines:
+            fields = line.split('\t')
+            if line.startswith('#') or len(fields) != 10 or '-' in fields[0] or '.' in fields[0]:
+                lines.append(line)
+                continue
+            fields[UPOS], fields[FEATS], fields[MISC], status = table.convert(
+                fields[UPOS], fields[XPOS], fields[FEATS], fields[MISC])
+            counts[status] += 1
+            lines.append('\t'.join(fields))
+        yield format_sentence(lines), counts
+
+
+_worker_table = None
+
+
+def _init_worker(snapshot, language):
+    global _worker_table
+    if snapshot:
+        _worker_table = ConversionTable(RuleIndex(open_rule_table(snapshot=snapshot, language=language)))
+    else:
+        _worker_table = ConversionTable(get_rule_index(language))
+
+
+def _convert_block(path, sentences):
+    chunks = []
+    counts = Counter()
+    for text, found in convert_sentences(sentences, _worker_table):
+        chunks.append(text)
+        counts.update(found)
+    return path, ''.join(chunks), counts
+
+
+def convert_files(paths, workers=None, block_size=500, snapshot=None, language=None):
+    # Yields (path, converted text, status counts) per block, in input order
+    return map_blocks(_convert_block, read_blocks(paths, block_size), workers, _init_worker, (snapshot, language))
+
+
+def _same_file(path, other):
+    return os.path.exists(path) and os.path.exists(other) and os.path.samefile(path, other)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill UPOS and FEATS from XPOS using the rule table.")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-o', '--output', help='write all output here (default: stdout)')
+    output.add_argument('--output-dir', help='write each input to DIR/<same name>')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='compiled rules snapshot, used when it matches the rule sources')
+    parser.add_argument('--language', help='rule set to convert with (default: the default set)')
+    args = parser.parse_args(argv)
+
+    # The output is opened before the inputs are read, so it must not be one of them
+    if args.output and any(_same_file(args.output, path) for path in args.files):
+        parser.error(f"{args.output} is an input and would be emptied before it is read")
+    if args.output_dir:
+        # Outputs are named after the input's basename: refuse to write two
+        # inputs to one file, or an input over itself
+        names = Counter(os.path.basename(path) for path in args.files)
+        clashes = sorted(name for name, count in names.items() if count > 1)
+        if clashes:
+            parser.error(f"several inputs would be written to the same output: {', '.join(clashes)}")
+        for path in args.files:
+            if _same_file(os.path.join(args.output_dir, os.path.basename(path)), path):
+                parser.error(f"{path} would be overwritten by its own output")
+        os.makedirs(args.output_dir, exist_ok=True)
+    started = time.perf_counter()
+    counts = Counter()
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    current = None
+    try:
+        for path, text, found in convert_files(args.files, args.workers, args.block_size, args.snapshot,
+                                                 args.language):
+            if args.output_dir and path != current:
+                if current is not None:
+                    out.close()
+                out = open(os.path.join(args.output_dir, os.path.basename(path)), 'w', encoding='utf-8')
+                current = path
+            out.write(text)
+            counts.update(found)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+
+    tokens = sum(counts.values())
+    rate = tokens / elapsed if elapsed else 0.0
+    print(f"{tokens} tokens in {elapsed:.2f}s ({rate:,.0f} tokens/sec): "
+          f"{counts['converted']} converted, {counts['review']} flagged for review, "
+          f"{counts['unknown']} with unknown XPOS", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Export of selected recommendations.
+
+Exports are produced as a stream of string chunks, so they can be written
+to any text writer (a file, ``sys.stdout``, the buffer behind a
+download button) without building the whole report in memory. Formats:
+
+- ``text``: the human-readable report shown by "Copy Selected"
+- ``jsonl``: one JSON object per recommendation
+- ``tsv``: one row per recommendation with a header row
+- ``conllu``: a CoNLL-U style feature sheet, one block per recommendation
+
+An ``ExportCache`` memoises the rendered block of each recommendation, so
+re-exporting after one more selection only renders the new block.
+"""
+
+import json
+import threading
+from datetime import datetime
+
+from .feats import format_feats, parse_feats
+
+FORMATS = ('text', 'jsonl', 'tsv', 'conllu')
+
+FILE_EXTENSIONS = {'text': 'txt', 'jsonl': 'jsonl', 'tsv': 'tsv', 'conllu': 'conllu'}
+
+MIME_TYPES = {
+    'text': 'text/plain',
+    'jsonl': 'application/jsonl',
+    'tsv': 'text/tab-separated-values',
+    'conllu': 'text/plain',
+}
+
+TSV_COLUMNS = ('id', 'decision_type', 'upos', 'xpos', 'feats', 'choice', 'context', 'when', 'rules')
+
+
+class ExportCache:
+    # Rendered blocks keyed by (format, record id). An entry is reused only
+    # for the very record object it was rendered from. Deferred downloads
+    # render off the script thread, so access holds the lock.
+
+    def __init__(self):
+        self._blocks = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def get(self, fmt, rec, render):
+        key = (fmt, rec['id'])
+        with self._lock:
+            entry = self._blocks.get(key)
+            if entry is None or entry[0] is not rec:
+                entry = self._blocks[key] = (rec, render(rec))
+            return entry[1]
+
+    def prune(self, selected):
+        # Drop blocks for records no longer selected; selected is any
+        # container of ids, e.g. a SelectionStore
+        with self._lock:
+            for key in [key for key in self._blocks if key[1] not in selected]:
+                del self._blocks[key]
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+
+
+def _render_text_block(rec):
+    # Everything after the "N. choice" line
+    parts = [
+        f"   UD Format: {rec['upos']} {rec['xpos']} {rec['feats']}\n",
+        f"   Context: {rec['context']}\n",
+        f"   When to use: {rec['when']}\n\n",
+    ]
+
+    # Decision factors
+    if rec.get('decision_factors'):
+        parts.append("   Decision Factors:\n")
+        parts.extend(f"   • {factor}\n" for factor in rec['decision_factors'])
+        parts.append("\n")
+
+    # Examples
+    parts.append("   Examples:\n")
+    parts.extend(f"   • {ex}\n" for ex in rec['examples'])
+
+    parts.append(f"\n   Morphological Rule: {rec['rules']}\n")
+    parts.append("\n" + "-" * 40 + "\n\n")
+    return ''.join(parts)
+
+
+def _render_jsonl(rec):
+    return json.dumps({key: list(value) if isinstance(value, tuple) else value for key, value in rec.items()},
+                      ensure_ascii=False) + "\n"
+
+
+def _tsv_field(value):
+    return str(value).replace('\t', ' ').replace('\n', ' ')
+
+
+def _render_tsv(rec):
+    return '\t'.join(_tsv_field(rec[column]) for column in TSV_COLUMNS) + "\n"
+
+
+def _render_conllu(rec):
+    return (
+        f"# rec_id = {rec['id']}\n"
+        f"# decision_type = {rec['decision_type']}\n"
+        f"# choice = {rec['choice']}\n"
+        f"# rule = {rec['rules']}\n"
+        f"1\t_\t_\t{rec['upos']}\t{rec['xpos']}\t{format_feats(parse_feats(rec['feats']))}\t_\t_\t_\t_\n\n"
+    )
+
+
+def _iter_text(selected, cache, generated_at):
+    if not selected:
+        yield "No recommendations selected."
+        return
+
+    yield "COMPLETE UD MORPHOLOGICAL ANALYSIS\n"
+    yield "=" * 50 + "\n\n"
+
+    # Group by decision type
+    grouped = {}
+    for rec in selected:
+        grouped.setdefault(rec['decision_type'], []).append(rec)
+
+    for decision_type, recs in grouped.items():
+        yield f"🎯 {decision_type}\n"
+        yield "-" * len(decision_type) + "\n\n"
+
+        for i, rec in enumerate(recs, 1):
+            yield f"{i}. {rec['choice']}\n"
+            yield cache.get('text', rec, _render_text_block)
+
+        yield "=" * 50 + "\n\n"
+
+    yield f"Generated: {generated_at.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    yield "Total Selected: " + str(len(selected)) + " recommendations\n"
+
+
+_RENDERERS = {'jsonl': _render_jsonl, 'tsv': _render_tsv, 'conllu': _render_conllu}
+
+
+def iter_export(selected, fmt='text', cache=None, generated_at=None):
+    # Yields the export as string chunks
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt!r}; expected one of {', '.join(FORMATS)}")
+    cache = cache if cache is not None else ExportCache()
+    if fmt == 'text':
+        yield from _iter_text(selected, cache, generated_at or datetime.now())
+        return
+    if fmt == 'tsv':
+        yield '\t'.join(TSV_COLUMNS) + "\n"
+    render = _RENDERERS[fmt]
+    for rec in selected:
+        yield cache.get(fmt, rec, render)
+
+
+def write_export(selected, out, fmt='text', cache=None, generated_at=None):
+    for chunk in iter_export(selected, fmt, cache, generated_at):
+        out.write(chunk)
+
+
+def generate_copy_text(selected, generated_at=None, cache=None):
+    return ''.join(iter_export(selected, 'text', cache, generated_at))
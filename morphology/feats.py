@@ -0,0 +1,196 @@
+"""Parsed, interned FEATS.
+
+Rule strings such as ``'Number=Sing | Gender=M/F/N'`` and CoNLL-U FEATS
+such as ``'Gender=Fem,Masc|Number=Sing'`` are parsed once into a canonical
+tuple of ``(name, frozenset(values))`` pairs with interned strings and
+alternatives expanded. A ``FeatureVocabulary`` then numbers every feature
+and value so that a rule and a token compile to ``FeatsMask`` bitsets and
+matching is a handful of integer operations.
+"""
+
+import threading
+from functools import lru_cache
+from sys import intern
+
+# Abbreviated values used in the morphological_rules strings
+FEATURE_VALUE_ALIASES = {
+    'Gender': {'M': 'Masc', 'F': 'Fem', 'N': 'Neut'},
+}
+
+
+def _feature_sort_key(item):
+    # UD orders features alphabetically, ignoring case
+    return item[0].lower()
+
+
+@lru_cache(maxsize=65536)
+def parse_feats(feats):
+    if not feats or feats == '_':
+        return ()
+    parsed = {}
+    for part in feats.split('|'):
+        name, sep, values = part.strip().partition('=')
+        if not sep:
+            continue
+        name = intern(name.strip())
+        aliases = FEATURE_VALUE_ALIASES.get(name, {})
+        for value in values.replace(',', '/').split('/'):
+            value = value.strip()
+            if value:
+                parsed.setdefault(name, set()).add(intern(aliases.get(value, value)))
+    return tuple(sorted(((name, frozenset(values)) for name, values in parsed.items()), key=_feature_sort_key))
+
+
+def parse_rule(rule):
+    # 'NN: Number=Sing | Case=Nom' -> ('NN', parsed feats)
+    xpos, sep, feats = rule.partition(':')
+    if not sep:
+        return None, parse_feats(rule)
+    return intern(xpos.strip()), parse_feats(feats)
+
+
+def format_feats(parsed):
+    # Canonical CoNLL-U form, e.g. 'Case=Acc,Nom|Person=2,3'
+    if not parsed:
+        return '_'
+    return '|'.join(f"{name}={','.join(sorted(values))}" for name, values in parsed)
+
+
+class FeatsMask:
+    # features: bitset of feature ids; values: feature id -> bitset of values
+    __slots__ = ('features', 'values')
+
+    def __init__(self, features, values):
+        self.features = features
+        self.values = values
+
+    def __repr__(self):
+        return f"FeatsMask({self.features:#b}, {self.values!r})"
+
+
+def feats_match(rule, token):
+    # Every feature the rule names must be present on the token with only
+    # allowed values; features the rule does not mention are ignored
+    if token.features & rule.features != rule.features:
+        return False
+    token_values = token.values
+    for feature_id, allowed in rule.values.items():
+        if token_values[feature_id] & ~allowed:
+            return False
+    return True
+
+
+class FeatureVocabulary:
+    # Extend-only numbering of feature names and, per feature, of values.
+    # Unseen token values get fresh bits, which no compiled rule allows.
+    # Lookups that hit take no lock; extending the numbering does, and
+    # re-checks under it, so two threads never hand out the same bit.
+    # Compiled masks are cached up to cache_size FEATS, then the cache
+    # starts over, so corpus FEATS cannot grow it without limit.
+
+    def __init__(self, cache_size=65536):
+        self._features = {}
+        self._compiled = {}
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._features)
+
+    def feature_id(self, name):
+        entry = self._features.get(name)
+        if entry is None:
+            with self._lock:
+                entry = self._features.get(name)
+                if entry is None:
+                    entry = self._features[intern(name)] = (len(self._features), {})
+        return entry[0]
+
+    def value_bit(self, name, value):
+        self.feature_id(name)
+        values = self._features[name][1]
+        bit = values.get(value)
+        if bit is None:
+            with self._lock:
+                bit = values.get(value)
+                if bit is None:
+                    bit = values[intern(value)] = 1 << len(values)
+        return bit
+
+    def features(self):
+        return list(self._features)
+
+    def values(self, name):
+        entry = self._features.get(name)
+        return list(entry[1]) if entry else []
+
+    def compile(self, feats):
+        # Accepts a FEATS string or parsed feats; results are cached
+        compiled = self._compiled.get(feats)
+        if compiled is None:
+            parsed = parse_feats(feats) if isinstance(feats, str) else feats
+            feature_mask = 0
+            value_masks = {}
+            for name, values in parsed:
+                feature_id = self.feature_id(name)
+                feature_mask |= 1 << feature_id
+                mask = 0
+                for value in values:
+                    mask |= self.value_bit(name, value)
+                value_masks[feature_id] = mask
+            compiled = FeatsMask(feature_mask, value_masks)
+            if len(self._compiled) >= self._cache_size:
+                self._compiled = {}
+            self._compiled[feats] = compiled
+        return compiled
+
+    def lookup(self, feats):
+        # Like compile, but never extends the numbering, for FEATS from
+        # untrusted input. Features no rule names are left out (matching
+        # ignores them) and a value no rule names makes its feature's mask
+        # -1, which no rule allows. Not cached: a later rule may add it.
+        parsed = parse_feats(feats) if isinstance(feats, str) else feats
+        feature_mask = 0
+        value_masks = {}
+        for name, values in parsed:
+            entry = self._features.get(name)
+            if entry is None:
+                continue
+            feature_id, bits = entry
+            feature_mask |= 1 << feature_id
+            mask = 0
+            for value in values:
+                mask |= bits.get(value, -1)
+            value_masks[feature_id] = mask
+        return FeatsMask(feature_mask, value_masks)
+
+
+# Shared by every rule set in the process
+VOCABULARY = FeatureVocabulary()
+
+
+class CompiledRecommendation:
+    __slots__ = ('id', 'upos', 'xpos', 'feats', 'rule_feats', 'mask')
+
+    def __init__(self, unique_id, upos, xpos, feats, rule_feats, mask):
+        self.id = unique_id
+        self.upos = upos
+        self.xpos = xpos
+        self.feats = feats
+        self.rule_feats = rule_feats
+        self.mask = mask
+
+    def matches(self, token_feats, vocabulary=VOCABULARY):
+        return feats_match(self.mask, vocabulary.compile(token_feats))
+
+
+def compile_recommendation(unique_id, analysis, rec, vocabulary=VOCABULARY):
+    feats = parse_feats(rec['feats'])
+    return CompiledRecommendation(
+        unique_id,
+        tuple(intern(upos) for upos in analysis['upos'].split('/')),
+        intern(rec['xpos']),
+        feats,
+        parse_rule(rec['morphological_rules'])[1],
+        vocabulary.compile(feats),
+    )
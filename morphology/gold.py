@@ -0,0 +1,160 @@
+"""Gold regression corpus from the annotated recommendation examples.
+
+Examples end with their gold annotation, e.g. ``'The cat sleeps (cat=NN,
+Number=Sing, Case=Nom)'``. ``extract_gold`` parses them into
+``GoldExample`` records (word(s), XPOS, parsed features) that can be saved
+as JSONL, and ``GoldChecker`` verifies in one pass that every example
+agrees with its recommendation: same XPOS, and only features and values
+the recommendation allows. Examples are compiled to the same bitmasks as
+rules and tokens, so the check doubles as a micro-benchmark of the
+matching engine.
+
+Usage: python -m morphology.gold extract [-o GOLD.jsonl]
+       python -m morphology.gold check [GOLD.jsonl] [--repeat N]
+"""
+
+import argparse
+import json
+import re
+import sys
+import time
+from collections import namedtuple
+
+from .feats import VOCABULARY, format_feats, parse_feats
+from .indexes import RuleIndex, get_rule_index
+from .table import iter_recommendations, load_complete_morphology_data
+
+GoldExample = namedtuple('GoldExample', 'rec_id text words xpos feats')
+
+# Trailing "(word=TAG, Feat=Val, ...)" of an example
+_ANNOTATION = re.compile(r'\(([^()]*=[^()]*)\)\s*$')
+
+
+def parse_example(text):
+    # -> (words, xpos, parsed feats), or None for an unannotated example.
+    # Discontinuous words are written 'both...and'.
+    match = _ANNOTATION.search(text)
+    if match is None:
+        return None
+    head, _, annotated = match.group(1).partition(',')
+    word, sep, xpos = head.partition('=')
+    if not sep:
+        return None
+    words = tuple(part for part in re.split(r'\.\.\.|\s+', word.strip()) if part)
+    return words, xpos.strip(), parse_feats(annotated.replace(',', '|'))
+
+
+def example_problems(xpos, feats, gold_xpos, gold_feats):
+    # Why a gold annotation disagrees with a recommendation; [] if it agrees
+    problems = []
+    if gold_xpos != xpos:
+        problems.append(f"tagged {gold_xpos}, recommendation is {xpos}")
+    allowed = dict(feats)
+    for name, values in gold_feats:
+        if name not in allowed:
+            problems.append(f"{name} not in feats")
+        elif not values <= allowed[name]:
+            problems.append(f"{name}={'/'.join(sorted(values - allowed[name]))} not allowed")
+    return problems
+
+
+def extract_gold(decisions=None):
+    decisions = decisions if decisions is not None else load_complete_morphology_data()
+    examples = []
+    for unique_id, _, _, rec in iter_recommendations(decisions):
+        for text in rec['examples']:
+            parsed = parse_example(text)
+            if parsed is not None:
+                examples.append(GoldExample(unique_id, text, *parsed))
+    return examples
+
+
+def write_gold(examples, out):
+    for example in examples:
+        out.write(json.dumps({'id': example.rec_id, 'text': example.text, 'words': list(example.words),
+                              'xpos': example.xpos, 'feats': format_feats(example.feats)},
+                             ensure_ascii=False) + '\n')
+
+
+def read_gold(lines):
+    for line in lines:
+        if line.strip():
+            entry = json.loads(line)
+            yield GoldExample(entry['id'], entry['text'], tuple(entry['words']), entry['xpos'],
+                              parse_feats(entry['feats']))
+
+
+class GoldChecker:
+
+    def __init__(self, index=None, vocabulary=VOCABULARY):
+        self._index = index if index is not None else get_rule_index()
+        self._vocabulary = vocabulary
+
+    def check(self, examples):
+        # Returns [(example, problems)] for the examples that disagree
+        compile_feats = self._vocabulary.compile
+        compiled = {}
+        failures = []
+        for example in examples:
+            rec = compiled.get(example.rec_id)
+            if rec is None:
+                try:
+                    rec = compiled[example.rec_id] = self._index.compiled(example.rec_id)
+                except (KeyError, IndexError, ValueError):
+                    failures.append((example, ['recommendation no longer exists']))
+                    continue
+            # The gold features must be a subset of the recommendation's,
+            # each with a subset of its allowed values
+            gold = compile_feats(example.feats)
+            allowed = rec.mask.values
+            if example.xpos == rec.xpos and not gold.features & ~rec.mask.features and \
+                    all(not values & ~allowed[feature_id] for feature_id, values in gold.values.items()):
+                continue
+            failures.append((example, example_problems(rec.xpos, rec.feats, example.xpos, example.feats)))
+        return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract or check the gold examples of the rule table.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    extract = commands.add_parser('extract', help='write the gold corpus as JSONL')
+    extract.add_argument('-o', '--output', help='output path (default: stdout)')
+    check = commands.add_parser('check', help='check gold examples against their recommendations')
+    check.add_argument('corpus', nargs='?', help='JSONL corpus (default: the examples in the rules)')
+    check.add_argument('--repeat', type=int, default=1, help='timed passes, for benchmarking')
+    args = parser.parse_args(argv)
+
+    if args.command == 'extract':
+        examples = extract_gold()
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as out:
+                write_gold(examples, out)
+        else:
+            write_gold(examples, sys.stdout)
+        print(f"{len(examples)} gold examples", file=sys.stderr)
+        return 0
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            examples = list(read_gold(f))
+    else:
+        examples = extract_gold()
+    # A fresh index: the first pass also compiles the rules, the best
+    # pass is the warm matching cost
+    checker = GoldChecker(RuleIndex(load_complete_morphology_data()))
+    timings = []
+    for _ in range(max(args.repeat, 1)):
+        started = time.perf_counter()
+        failures = checker.check(examples)
+        timings.append(time.perf_counter() - started)
+    for example, problems in failures:
+        sys.stdout.write(f"{example.rec_id}\t{example.text}\t{'; '.join(problems)}\n")
+    best = min(timings)
+    rate = len(examples) / best if best else 0.0
+    print(f"{len(examples)} gold examples, {len(failures)} disagree; best of {len(timings)}: "
+          f"{best * 1e3:.2f} ms ({rate:,.0f} examples/sec)", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
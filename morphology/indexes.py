@@ -0,0 +1,180 @@
+"""Inverted indexes over the decision table.
+
+XPOS, UPOS, feature name and (feature, value) each map to the ids of the
+recommendations that produce them, so lookups never walk the nested
+scenarios. Analyses are indexed on first use and re-indexed individually
+when the rule table reloads them.
+"""
+
+import threading
+from functools import lru_cache
+
+from .feats import VOCABULARY, compile_recommendation
+from .table import DEFAULT_LANGUAGE, iter_recommendations, load_complete_morphology_data, parse_recommendation_id
+
+
+class RuleIndex:
+    # Postings are kind -> term -> analysis key -> ids, so an analysis can
+    # be dropped or re-added without touching the others. XPOS and UPOS
+    # queries first index the analyses whose headers list the tag, and all
+    # analyses when those have no recommendation with it (a rule's tag
+    # missing from its analysis header).
+
+    KINDS = ('xpos', 'upos', 'feature', 'feature_value')
+
+    def __init__(self, decisions, vocabulary=VOCABULARY):
+        self._decisions = decisions
+        self._vocabulary = vocabulary
+        self._postings = {kind: {} for kind in self.KINDS}
+        self._terms = {}
+        self._compiled = {}
+        self._indexed = {}
+        self._version = None
+        self._headers = None
+        self._routes = {}
+        self._position = {}
+        self._lock = threading.RLock()
+
+    def add_analysis(self, analysis_key, analysis):
+        self.remove_analysis(analysis_key)
+        self._indexed[analysis_key] = self._generation(analysis_key)
+        self._terms[analysis_key] = set()
+        compiled = self._compiled[analysis_key] = {}
+        for unique_id, _, _, rec in iter_recommendations({analysis_key: analysis}):
+            compiled[unique_id] = record = compile_recommendation(unique_id, analysis, rec, self._vocabulary)
+            self._post('xpos', record.xpos, analysis_key, unique_id)
+            for upos in record.upos:
+                self._post('upos', upos, analysis_key, unique_id)
+            for name, values in record.feats:
+                self._post('feature', name, analysis_key, unique_id)
+                for value in values:
+                    self._post('feature_value', (name, value), analysis_key, unique_id)
+
+    def remove_analysis(self, analysis_key):
+        self._indexed.pop(analysis_key, None)
+        self._compiled.pop(analysis_key, None)
+        for kind, term in self._terms.pop(analysis_key, ()):
+            by_key = self._postings[kind][term]
+            del by_key[analysis_key]
+            if not by_key:
+                del self._postings[kind][term]
+
+    def _post(self, kind, term, analysis_key, unique_id):
+        ids = self._postings[kind].setdefault(term, {}).setdefault(analysis_key, [])
+        if unique_id not in ids:
+            ids.append(unique_id)
+        self._terms[analysis_key].add((kind, term))
+
+    def _generation(self, analysis_key):
+        generation = getattr(self._decisions, 'generation', None)
+        return generation(analysis_key) if generation else 0
+
+    def _route(self):
+        # XPOS/UPOS -> analysis keys from the headers, rebuilt when they change
+        headers = getattr(self._decisions, 'headers', lambda: self._decisions)()
+        if headers is not self._headers:
+            self._headers = headers
+            self._routes = {'xpos': {}, 'upos': {}}
+            self._position = {}
+            for position, (analysis_key, header) in enumerate(headers.items()):
+                self._position[analysis_key] = position
+                for xpos in header['xpos_tags']:
+                    self._routes['xpos'].setdefault(xpos, []).append(analysis_key)
+                for upos in header['upos'].split('/'):
+                    self._routes['upos'].setdefault(upos, []).append(analysis_key)
+        return self._routes
+
+    def sync(self, analysis_keys=None):
+        # Drop analyses reloaded since they were indexed, then index the
+        # requested ones (all by default) that are missing
+        poll = getattr(self._decisions, 'poll', None)
+        version = poll() if poll else None
+        if version != self._version:
+            self._version = version
+            for analysis_key, generation in list(self._indexed.items()):
+                if analysis_key not in self._decisions or self._generation(analysis_key) != generation:
+                    self.remove_analysis(analysis_key)
+        if analysis_keys is None:
+            if len(self._indexed) == len(self._decisions):
+                return
+            analysis_keys = self._decisions
+        for analysis_key in analysis_keys:
+            if analysis_key not in self._indexed:
+                self.add_analysis(analysis_key, self._decisions[analysis_key])
+
+    def lookup(self, kind, term):
+        # Recommendation ids in table order
+        with self._lock:
+            routes = self._route()
+            self.sync(routes[kind].get(term, ()) if kind in routes else None)
+            by_key = self._postings[kind].get(term)
+            if not by_key and kind in routes:
+                self.sync()
+                by_key = self._postings[kind].get(term)
+            by_key = by_key or {}
+            return [unique_id for analysis_key in sorted(by_key, key=self._position.get)
+                    for unique_id in by_key[analysis_key]]
+
+    def by_xpos(self, xpos):
+        return self.lookup('xpos', xpos)
+
+    def by_upos(self, upos):
+        return self.lookup('upos', upos)
+
+    def by_feature(self, name):
+        return self.lookup('feature', name)
+
+    def by_feature_value(self, name, value):
+        return self.lookup('feature_value', (name, value))
+
+    def analyses_with_feature_value(self, name, value):
+        with self._lock:
+            self._route()
+            self.sync()
+            return sorted(self._postings['feature_value'].get((name, value), {}), key=self._position.get)
+
+    # Vocabularies for pickers
+
+    def terms(self, kind):
+        with self._lock:
+            routes = self._route()
+            if kind in routes:
+                return sorted(routes[kind])
+            self.sync()
+            return sorted(self._postings[kind])
+
+    def xpos_tags(self):
+        return self.terms('xpos')
+
+    def upos_tags(self):
+        return self.terms('upos')
+
+    def features(self):
+        return self.terms('feature')
+
+    def feature_values(self, name=None):
+        return [pair for pair in self.terms('feature_value') if name is None or pair[0] == name]
+
+    def compiled(self, unique_id):
+        analysis_key = parse_recommendation_id(unique_id)[0]
+        with self._lock:
+            self.sync([analysis_key])
+            return self._compiled[analysis_key][unique_id]
+
+    def compiled_for(self, kind, term):
+        return [self.compiled(unique_id) for unique_id in self.lookup(kind, term)]
+
+    def recommendation(self, unique_id):
+        analysis_key, scenario_idx, rec_idx = parse_recommendation_id(unique_id)
+        return self._decisions[analysis_key]['scenarios'][scenario_idx]['recommendations'][rec_idx]
+
+
+def get_rule_index(language=None):
+    # Index over a language's shared table; analyses are indexed as queries
+    # reach them, and every language compiles into the shared VOCABULARY
+    return _rule_index(language or DEFAULT_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def _rule_index(language):
+    return RuleIndex(load_complete_morphology_data(language))
@@ -0,0 +1,161 @@
+"""Opt-in per-rerun profiling.
+
+A ``RerunProfile`` times named phases of one Streamlit rerun, counts
+events (widgets emitted, selection-store operations) and, when finished,
+logs one JSON line on the ``morphology.rerun`` logger and adds itself to
+the process-wide ``STATS`` so operators can see which sessions and
+analyses cost the most. ``enable_log`` gives that logger a handler, since
+nothing else configures one. When profiling is off, callers get ``NULL_PROFILE``
+whose methods do nothing and whose phases are a shared no-op context.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger('morphology.rerun')
+_log_lock = threading.Lock()
+_log_handler = None
+
+
+def enable_log(target='-'):
+    # Sends the rerun lines to stderr ('-') or appends them to a file; only
+    # the first call in a process attaches a handler
+    global _log_handler
+    with _log_lock:
+        if _log_handler is None:
+            handler = logging.StreamHandler() if target in (None, '', '-') else logging.FileHandler(target)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            _log_handler = handler
+        return _log_handler
+
+
+class RerunProfile:
+    enabled = True
+
+    def __init__(self, session, kind='rerun', analysis=None):
+        self.session = session
+        self.kind = kind
+        self.analysis = analysis
+        self.phases = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.total = None
+
+    @property
+    def finished(self):
+        return self.total is not None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def track(self, store):
+        return CountingStore(store, self)
+
+    def finish(self, stats=None):
+        if self.total is None:
+            self.total = time.perf_counter() - self.started
+            (stats if stats is not None else STATS).record(self)
+            logger.info(json.dumps(self.as_dict(), sort_keys=True))
+        return self
+
+    def as_dict(self):
+        return {
+            'session': self.session,
+            'kind': self.kind,
+            'analysis': self.analysis,
+            'total_ms': round(self.total * 1e3, 3) if self.total is not None else None,
+            'phases_ms': {name: round(seconds * 1e3, 3) for name, seconds in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+
+
+class _NullProfile:
+    enabled = False
+    finished = True
+    _phase = nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def track(self, store):
+        return store
+
+    def finish(self, stats=None):
+        return self
+
+
+NULL_PROFILE = _NullProfile()
+
+
+class CountingStore:
+    # Delegates to a SelectionStore, counting each operation on the profile
+
+    def __init__(self, store, profile):
+        self._store = store
+        self._profile = profile
+
+    def __contains__(self, unique_id):
+        self._profile.count('selection_ops')
+        return unique_id in self._store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def __getattr__(self, name):
+        attr = getattr(self._store, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self._profile.count('selection_ops')
+            return attr(*args, **kwargs)
+        return counted
+
+
+class RerunStats:
+    # Running totals per (session, analysis), safe to share across sessions
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, profile):
+        key = (profile.session, profile.analysis)
+        with self._lock:
+            entry = self._totals.setdefault(key, {'reruns': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            elapsed = profile.total * 1e3
+            entry['reruns'] += 1
+            entry['total_ms'] += elapsed
+            entry['max_ms'] = max(entry['max_ms'], elapsed)
+
+    def top(self, n=10, by='total_ms'):
+        with self._lock:
+            rows = [{'session': session, 'analysis': analysis, **entry}
+                    for (session, analysis), entry in self._totals.items()]
+        return sorted(rows, key=lambda row: row[by], reverse=True)[:n]
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+
+
+STATS = RerunStats()
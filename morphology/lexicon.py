@@ -0,0 +1,275 @@
+"""Word-form lexicon: which XPOS and FEATS each form has been seen with.
+
+Forms come from the annotated examples of the rule table and from CoNLL-U
+corpora, lowercased. A built lexicon is a flat binary image: the forms as
+UTF-8, sorted bytewise, with offset arrays into them and into per-form
+(tag, count) entries, most frequent first. It is opened with ``mmap`` and
+searched in place by binary search, so opening is instant, worker
+processes share one page-cached copy, and an exact or prefix lookup
+touches about log2(forms) strings however large the lexicon is.
+
+Usage: python -m morphology.lexicon build [FILE...] [-o PATH] [-j WORKERS] [--no-examples] [--language LANG]
+       python -m morphology.lexicon lookup WORD... [--lexicon PATH] [--prefix]
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter, namedtuple
+from itertools import accumulate
+
+from .conllu import FEATS, FORM, XPOS, iter_tokens, read_blocks
+from .feats import format_feats, parse_feats
+from .gold import extract_gold
+from .parallel import map_blocks
+from .table import DEFAULT_LANGUAGE, load_complete_morphology_data
+
+MAGIC = b'XPOMOLEX'
+FORMAT_VERSION = 1
+LEXICON_NAME = 'xpomo_lexicon.lex'
+
+# magic, format version, forms, entries, form bytes, tag table bytes
+HEADER = struct.Struct('<8sI4Q')
+
+Analysis = namedtuple('Analysis', 'xpos feats count')
+
+
+def lexicon_name(language=None):
+    # Default file name of a language's lexicon
+    if not language or language == DEFAULT_LANGUAGE:
+        return LEXICON_NAME
+    return f"xpomo_lexicon.{language}.lex"
+
+
+def normalize_form(form):
+    return form.lower()
+
+
+def count_sentences(sentences):
+    # (form, XPOS, canonical FEATS) -> tokens
+    raw = Counter()
+    for sentence in sentences:
+        for _, fields in iter_tokens(sentence):
+            raw[fields[FORM], fields[XPOS], fields[FEATS]] += 1
+    counts = Counter()
+    feats_seen = {}
+    for (form, xpos, feats), count in raw.items():
+        canonical = feats_seen.get(feats)
+        if canonical is None:
+            canonical = feats_seen[feats] = format_feats(parse_feats(feats))
+        counts[normalize_form(form), xpos, canonical] += count
+    return counts
+
+
+def _count_block(path, sentences):
+    return count_sentences(sentences)
+
+
+class LexiconBuilder:
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, form, xpos, feats='_', count=1):
+        self.counts[normalize_form(form), xpos, format_feats(parse_feats(feats))] += count
+
+    def add_examples(self, decisions=None):
+        # Every word of every annotated example, once per example
+        for example in extract_gold(decisions):
+            feats = format_feats(example.feats)
+            for word in example.words:
+                self.counts[normalize_form(word), example.xpos, feats] += 1
+
+    def add_files(self, paths, workers=None, block_size=500):
+        for counts in map_blocks(_count_block, read_blocks(paths, block_size), workers):
+            self.counts.update(counts)
+
+    def add_lexicon(self, lexicon):
+        for form, xpos, feats, count in lexicon.items():
+            self.counts[form, xpos, feats] += count
+
+    def to_bytes(self):
+        # One sort puts forms in byte order and each form's tags by
+        # descending count; the arrays are then sliced out of it
+        tags = {}
+        entries = sorted((form.encode('utf-8'), -count, tags.setdefault((xpos, feats), len(tags)))
+                         for (form, xpos, feats), count in self.counts.items())
+        forms = []
+        entry_offsets = array('I')
+        previous = None
+        for i, (form, _, _) in enumerate(entries):
+            if form != previous:
+                forms.append(form)
+                entry_offsets.append(i)
+                previous = form
+        entry_offsets.append(len(entries))
+        form_offsets = array('I', [0])
+        form_offsets.extend(accumulate(map(len, forms)))
+        form_data = b''.join(forms)
+        tag_table = json.dumps(list(tags), ensure_ascii=False).encode('utf-8')
+        return b''.join([
+            HEADER.pack(MAGIC, FORMAT_VERSION, len(forms), len(entries), len(form_data), len(tag_table)),
+            form_offsets.tobytes(), entry_offsets.tobytes(),
+            array('I', [tag_id for _, _, tag_id in entries]).tobytes(),
+            array('I', [-count for _, count, _ in entries]).tobytes(),
+            form_data, tag_table,
+        ])
+
+    def build(self):
+        return Lexicon(self.to_bytes())
+
+    def write(self, path):
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(self.to_bytes())
+        os.replace(f"{path}.tmp", path)
+
+
+class Lexicon:
+    # Read-only view over a lexicon image (bytes or an mmap). The u32
+    # arrays are memoryview casts, so nothing is copied or parsed up front
+    # except the small tag table.
+
+    def __init__(self, data):
+        self._data = data
+        magic, version, forms, entries, form_bytes, tag_bytes = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError('not a lexicon file, or from another version')
+        view = memoryview(data)
+        offset = HEADER.size
+        sections = []
+        for length in (forms + 1, forms + 1, entries, entries):
+            sections.append(view[offset:offset + 4 * length].cast('I'))
+            offset += 4 * length
+        self._form_offsets, self._entry_offsets, self._entry_tags, self._entry_counts = sections
+        self._forms_start = offset
+        offset += form_bytes
+        self._tags = [(xpos, feats) for xpos, feats in json.loads(bytes(view[offset:offset + tag_bytes]))]
+        self._len = forms
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, form):
+        return self._find(normalize_form(form)) is not None
+
+    def _form(self, i):
+        # Slicing the bytes or mmap itself copies just the form out
+        start = self._forms_start
+        return self._data[start + self._form_offsets[i]:start + self._form_offsets[i + 1]]
+
+    def _bisect(self, key):
+        # First form >= key (bytewise, which is code point order for UTF-8)
+        lo, hi = 0, self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._form(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, form):
+        key = form.encode('utf-8')
+        i = self._bisect(key)
+        return i if i < self._len and self._form(i) == key else None
+
+    def _analyses(self, i, limit=None):
+        # Entries are stored most frequent first, so the top ones are a slice
+        first, last = self._entry_offsets[i], self._entry_offsets[i + 1]
+        if limit is not None:
+            last = min(last, first + limit)
+        tags = self._tags
+        return [Analysis(*tags[tag_id], count) for tag_id, count in
+                zip(self._entry_tags[first:last].tolist(), self._entry_counts[first:last].tolist())]
+
+    def _prefix_range(self, prefix):
+        key = normalize_form(prefix).encode('utf-8')
+        # 0xFF never occurs in UTF-8, so key + 0xFF sorts after every
+        # form starting with key and before the next one
+        return self._bisect(key), self._bisect(key + b'\xff')
+
+    def lookup(self, form, limit=None):
+        # [Analysis] for the form, most frequent first (the top limit); [] if unknown
+        i = self._find(normalize_form(form))
+        return [] if i is None else self._analyses(i, limit)
+
+    def lookup_many(self, forms, limit=None):
+        return [self.lookup(form, limit) for form in forms]
+
+    def prefix(self, prefix, limit=20, analyses=None):
+        # [(form, [Analysis])] for up to limit forms starting with prefix, in
+        # form order, each with its top `analyses` analyses
+        first, last = self._prefix_range(prefix)
+        return [(self._form(i).decode('utf-8'), self._analyses(i, analyses))
+                for i in range(first, min(last, first + limit))]
+
+    def count_prefix(self, prefix):
+        first, last = self._prefix_range(prefix)
+        return last - first
+
+    def items(self):
+        # (form, xpos, feats, count) for every entry, in form order
+        for i in range(self._len):
+            form = self._form(i).decode('utf-8')
+            for analysis in self._analyses(i):
+                yield form, *analysis
+
+
+def build_lexicon(paths=(), decisions=None, examples=True, workers=None, block_size=500):
+    builder = LexiconBuilder()
+    if examples:
+        builder.add_examples(decisions)
+    if paths:
+        builder.add_files(paths, workers, block_size)
+    return builder
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query the word-form lexicon.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build a lexicon from the rule examples and CoNLL-U files')
+    build.add_argument('files', nargs='*', metavar='FILE')
+    build.add_argument('-o', '--output', help=f"lexicon path (default: {LEXICON_NAME}, or per language)")
+    build.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    build.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    build.add_argument('--no-examples', action='store_true', help="leave out the rule table's examples")
+    build.add_argument('--language', help='rule set whose examples are included')
+    lookup = commands.add_parser('lookup', help='print the analyses of words')
+    lookup.add_argument('words', nargs='+', metavar='WORD')
+    lookup.add_argument('--lexicon', default=LEXICON_NAME, help=f"lexicon path (default: {LEXICON_NAME})")
+    lookup.add_argument('--prefix', action='store_true', help='treat each word as a prefix')
+    lookup.add_argument('--limit', type=int, default=20, help='forms per prefix')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        started = time.perf_counter()
+        decisions = load_complete_morphology_data(args.language)
+        builder = build_lexicon(args.files, decisions, not args.no_examples, args.workers, args.block_size)
+        output = args.output or lexicon_name(args.language)
+        builder.write(output)
+        lexicon = Lexicon.open(output)
+        print(f"{len(lexicon)} forms, {len(builder.counts)} form/tag pairs in "
+              f"{time.perf_counter() - started:.2f}s -> {output}", file=sys.stderr)
+        return 0
+
+    lexicon = Lexicon.open(args.lexicon)
+    for word in args.words:
+        matches = lexicon.prefix(word, args.limit) if args.prefix else [(word, lexicon.lookup(word))]
+        for form, analyses in matches:
+            for analysis in analyses:
+                sys.stdout.write(f"{form}\t{analysis.xpos}\t{analysis.feats}\t{analysis.count}\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
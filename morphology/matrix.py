@@ -0,0 +1,188 @@
+"""UPOS x feature x value matrix derived from the rules.
+
+Every recommendation contributes its feature values to each UPOS of its
+analysis. Contributions are kept per analysis, so when the rule table
+reloads an analysis only its share is swapped out. The flat rows that the
+app filters, sorts and exports are rebuilt from the merged cells only
+after something changed.
+
+Usage: python -m morphology.matrix [-o OUT] [--format tsv|csv|json] [--pivot] [--language LANG]
+"""
+
+import argparse
+import csv
+import io
+import json
+import sys
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from .feats import parse_feats
+from .table import DEFAULT_LANGUAGE, iter_recommendations, load_complete_morphology_data
+
+MATRIX_FORMATS = ('tsv', 'csv', 'json')
+
+# rules: recommendations giving the value; xpos: their tags, sorted;
+# analyses: their analysis keys in table order
+Row = namedtuple('Row', 'upos feature value rules xpos analyses')
+
+COLUMNS = ('UPOS', 'Feature', 'Value', 'Rules', 'XPOS', 'Analyses')
+
+
+def analysis_cells(analysis_key, analysis):
+    # (UPOS, feature, value) -> (recommendations, XPOS set) for one analysis
+    cells = {}
+    upos_tags = analysis['upos'].split('/')
+    for _, _, _, rec in iter_recommendations({analysis_key: analysis}):
+        for name, values in parse_feats(rec['feats']):
+            for value in values:
+                for upos in upos_tags:
+                    rules, xpos = cells.get((upos, name, value), (0, frozenset()))
+                    cells[upos, name, value] = rules + 1, xpos | {rec['xpos']}
+    return cells
+
+
+class FeatureMatrix:
+    # Cells are (UPOS, feature, value) -> analysis key -> (recommendations,
+    # XPOS set), so one analysis can be dropped or re-added alone
+
+    def __init__(self, decisions):
+        self._decisions = decisions
+        self._contributed = {}  # analysis key -> cells it contributes to
+        self._cells = {}
+        self._checked = {}      # analysis key -> generation
+        self._order = {}
+        self._version = None
+        self._rows = None
+        self._lock = threading.RLock()
+
+    def _generation(self, analysis_key):
+        generation = getattr(self._decisions, 'generation', None)
+        return generation(analysis_key) if generation else 0
+
+    def _remove(self, analysis_key):
+        self._checked.pop(analysis_key, None)
+        for cell in self._contributed.pop(analysis_key, ()):
+            by_key = self._cells[cell]
+            del by_key[analysis_key]
+            if not by_key:
+                del self._cells[cell]
+
+    def _add(self, analysis_key):
+        self._checked[analysis_key] = self._generation(analysis_key)
+        cells = analysis_cells(analysis_key, self._decisions[analysis_key])
+        self._contributed[analysis_key] = list(cells)
+        for cell, entry in cells.items():
+            self._cells.setdefault(cell, {})[analysis_key] = entry
+
+    def sync(self):
+        # Re-derives analyses added or reloaded since the last sync; returns
+        # their keys (and those of removed analyses)
+        with self._lock:
+            poll = getattr(self._decisions, 'poll', None)
+            version = poll() if poll else None
+            if version == self._version and poll is not None and len(self._checked) == len(self._decisions):
+                return []
+            self._version = version
+            changed = []
+            for analysis_key in list(self._checked):
+                if analysis_key not in self._decisions or \
+                        self._generation(analysis_key) != self._checked[analysis_key]:
+                    self._remove(analysis_key)
+                    changed.append(analysis_key)
+            for analysis_key in self._decisions:
+                if analysis_key not in self._checked:
+                    self._add(analysis_key)
+                    if analysis_key not in changed:
+                        changed.append(analysis_key)
+            if changed:
+                self._order = {analysis_key: i for i, analysis_key in enumerate(self._decisions)}
+                self._rows = None
+            return changed
+
+    def rows(self):
+        # [Row] sorted by UPOS, feature and value; the same list until the rules change
+        with self._lock:
+            self.sync()
+            if self._rows is None:
+                position = self._order.get
+                self._rows = [
+                    Row(upos, name, value, sum(rules for rules, _ in by_key.values()),
+                        tuple(sorted(frozenset().union(*(xpos for _, xpos in by_key.values())))),
+                        tuple(sorted(by_key, key=position)))
+                    for (upos, name, value), by_key in sorted(
+                        self._cells.items(), key=lambda item: (item[0][0], item[0][1].lower(), item[0][2]))
+                ]
+            return self._rows
+
+
+def pivot(rows):
+    # One record per UPOS with a column per feature listing its values
+    features = sorted({row.feature for row in rows}, key=str.lower)
+    records = {}
+    for row in rows:
+        record = records.get(row.upos)
+        if record is None:
+            record = records[row.upos] = dict.fromkeys(features, '')
+            record['UPOS'] = row.upos
+        record[row.feature] = f"{record[row.feature]}, {row.value}" if record[row.feature] else row.value
+    return ['UPOS', *features], list(records.values())
+
+
+def records(rows):
+    return [dict(zip(COLUMNS, (row.upos, row.feature, row.value, row.rules, ' '.join(row.xpos),
+                               ' '.join(row.analyses)))) for row in rows]
+
+
+def write_matrix(rows, out, fmt='tsv', pivoted=False):
+    if fmt not in MATRIX_FORMATS:
+        raise ValueError(f"unknown matrix format {fmt!r}; expected one of {', '.join(MATRIX_FORMATS)}")
+    columns, table = pivot(rows) if pivoted else (list(COLUMNS), records(rows))
+    if fmt == 'json':
+        json.dump(table, out, ensure_ascii=False, indent=1)
+        out.write('\n')
+        return
+    writer = csv.DictWriter(out, columns, delimiter='\t' if fmt == 'tsv' else ',', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(table)
+
+
+def matrix_text(rows, fmt='tsv', pivoted=False):
+    out = io.StringIO()
+    write_matrix(rows, out, fmt, pivoted)
+    return out.getvalue()
+
+
+def get_feature_matrix(language=None):
+    # Matrix over a language's shared table, kept in step with its reloads
+    return _feature_matrix(language or DEFAULT_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def _feature_matrix(language):
+    return FeatureMatrix(load_complete_morphology_data(language))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the UPOS x feature x value matrix of the rules.")
+    parser.add_argument('-o', '--output', help='write here (default: stdout)')
+    parser.add_argument('--format', choices=MATRIX_FORMATS, default='tsv')
+    parser.add_argument('--pivot', action='store_true', help='one row per UPOS, one column per feature')
+    parser.add_argument('--language', help='rule set to use')
+    args = parser.parse_args(argv)
+
+    rows = get_feature_matrix(args.language).rows()
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        write_matrix(rows, out, args.format, args.pivot)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{len(rows)} UPOS/feature/value cells, {len({row.upos for row in rows})} UPOS, "
+          f"{len({row.feature for row in rows})} features", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
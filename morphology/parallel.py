@@ -0,0 +1,27 @@
+"""Ordered, bounded fan-out of work units over a process pool."""
+
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def map_blocks(func, blocks, workers=None, initializer=None, initargs=()):
+    # Yields func(*block) for each block, in input order. At most two blocks
+    # per worker are in flight, so memory stays flat however long the input
+    # is. With one worker everything runs in this process.
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        if initializer is not None:
+            initializer(*initargs)
+        for block in blocks:
+            yield func(*block)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.submit(func, *block))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,199 @@
+"""Rank candidate recommendations for tokens in context.
+
+Every recommendation is a row of a recommendation x factor matrix built
+from its ``decision_factors``. A token brings the factors that hold in its
+context (``'Subject position'``, ``'Plural verb'`` ...); its score for a
+recommendation is the number of those factors the recommendation lists,
+plus ``FORM_WEIGHT`` when the token's form is one of the annotated words in
+the recommendation's examples. Candidates are limited to the token's XPOS
+and/or UPOS when given.
+
+Tokens sharing an XPOS/UPOS are scored with one matrix product over that
+tag's candidate columns, so whole sentences or documents are ranked in a
+single call without a per-token loop. Requires NumPy.
+"""
+
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+import numpy as np
+
+from .gold import parse_example
+from .table import DEFAULT_LANGUAGE, iter_recommendations, load_complete_morphology_data
+
+# Score added when the token's form is annotated in a recommendation's
+# examples; below one factor so it only breaks ties between factor counts
+FORM_WEIGHT = 0.5
+
+# Tokens scored per matrix product, bounding memory to CHUNK_SIZE x candidates
+CHUNK_SIZE = 1024
+
+Token = namedtuple('Token', 'form xpos upos context', defaults=(None, None, ()))
+
+
+def normalize(label):
+    return ' '.join(label.lower().split())
+
+
+def annotated_words(example):
+    # "The cat sleeps (cat=NN, Number=Sing)" -> ('cat',); "both...and" -> both, and
+    parsed = parse_example(example)
+    return tuple(word.lower() for word in parsed[0]) if parsed else ()
+
+
+class CandidateRanker:
+
+    def __init__(self, decisions):
+        self._decisions = decisions
+        self._version = None
+        self._lock = threading.RLock()
+        self.ids = []
+
+    def _sync(self):
+        # Rebuild the matrices whenever the rule table has reloaded
+        poll = getattr(self._decisions, 'poll', None)
+        version = poll() if poll else None
+        if self.ids and version == self._version:
+            return
+        self._version = version
+        ids, xpos, upos = [], [], []
+        factors, forms = {}, {}
+        factor_rows, form_rows = [], []
+        for unique_id, analysis, _, rec in iter_recommendations(self._decisions):
+            row = len(ids)
+            ids.append(unique_id)
+            xpos.append(rec['xpos'])
+            upos.append(frozenset(analysis['upos'].split('/')))
+            for label in rec.get('decision_factors', ()):
+                factor_rows.append((row, factors.setdefault(normalize(label), len(factors))))
+            for example in rec['examples']:
+                for word in annotated_words(example):
+                    form_rows.append((row, forms.setdefault(word, len(forms))))
+
+        self._factor_matrix = np.zeros((len(factors), len(ids)), dtype=np.float32)
+        for row, column in factor_rows:
+            self._factor_matrix[column, row] = 1.0
+        # Forms are sparse (a few per recommendation), so they are kept as
+        # CSR: form f is annotated by recommendations
+        # form_columns[form_starts[f]:form_starts[f + 1]]. The extra last
+        # form, for forms no example annotates, has none.
+        pairs = sorted({(form, row) for row, form in form_rows})
+        counts = np.bincount(np.array([form for form, _ in pairs], dtype=np.intp), minlength=len(forms) + 1)
+        self._form_starts = np.concatenate(([0], np.cumsum(counts)))
+        self._form_columns = np.array([row for _, row in pairs], dtype=np.intp)
+        self._xpos = np.array(xpos, dtype=object)
+        self._upos = upos
+        self._factors = factors
+        self._forms = forms
+        self._columns = {}
+        self.ids = ids
+
+    def factors(self):
+        with self._lock:
+            self._sync()
+            return sorted(self._factors)
+
+    def _candidates(self, xpos, upos):
+        # Column indices, in table order, of the candidates for an (XPOS, UPOS) pair
+        key = (xpos, upos)
+        columns = self._columns.get(key)
+        if columns is None:
+            mask = np.ones(len(self.ids), dtype=bool)
+            if xpos is not None:
+                mask &= self._xpos == xpos
+            if upos is not None:
+                mask &= np.fromiter((upos in options for options in self._upos), dtype=bool, count=len(self.ids))
+            columns = self._columns[key] = np.flatnonzero(mask)
+        return columns
+
+    def _context(self, tokens):
+        # Token x factor indicator matrix and the form row of each token
+        context = np.zeros((len(tokens), len(self._factors)), dtype=np.float32)
+        rows, columns = [], []
+        for i, token in enumerate(tokens):
+            for label in token.context:
+                column = self._factors.get(normalize(label))
+                if column is not None:
+                    rows.append(i)
+                    columns.append(column)
+        context[rows, columns] = 1.0
+        no_form = len(self._forms)
+        forms = np.array([self._forms.get(token.form.lower(), no_form) if token.form else no_form
+                          for token in tokens], dtype=np.intp)
+        return context, forms
+
+    def rank_many(self, tokens, limit=None):
+        # Returns one [(id, score)] list per token, best first; ties keep
+        # table order. Tokens sharing an (XPOS, UPOS) pair are scored
+        # together against that pair's candidates only.
+        tokens = list(tokens)
+        rankings = [None] * len(tokens)
+        with self._lock:
+            self._sync()
+            groups = {}
+            for i, token in enumerate(tokens):
+                groups.setdefault((token.xpos, token.upos), []).append(i)
+            for key, members in groups.items():
+                candidates = self._candidates(*key)
+                for start in range(0, len(members), CHUNK_SIZE):
+                    chunk = members[start:start + CHUNK_SIZE]
+                    for i, ranking in zip(chunk, self._rank_group([tokens[i] for i in chunk], candidates, limit)):
+                        rankings[i] = ranking
+        return rankings
+
+    def _rank_group(self, tokens, candidates, limit):
+        context, forms = self._context(tokens)
+        scores = context @ self._factor_matrix[:, candidates]
+        # (token, recommendation) pairs of the tokens' forms, then the
+        # recommendations mapped to their position among the candidates
+        starts = self._form_starts[forms]
+        lengths = self._form_starts[forms + 1] - starts
+        rows = np.repeat(np.arange(len(tokens)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        position = np.full(len(self.ids), -1, dtype=np.intp)
+        position[candidates] = np.arange(len(candidates))
+        columns = position[self._form_columns[np.repeat(starts, lengths) + offsets]]
+        found = columns >= 0
+        scores[rows[found], columns[found]] += FORM_WEIGHT
+        width = len(candidates)
+        if limit is not None and limit < width:
+            order = self._top(scores, max(limit, 0))
+        else:
+            order = np.argsort(-scores, axis=1, kind='stable')
+        ranked = np.take_along_axis(scores, order, axis=1).tolist()
+        ids = [self.ids[column] for column in candidates]
+        return [[(ids[column], value) for column, value in zip(columns, values)]
+                for columns, values in zip(order.tolist(), ranked)]
+
+    @staticmethod
+    def _top(scores, limit):
+        # Columns of the best `limit` scores per row, best first with ties
+        # in column order, in linear time: keep everything above the
+        # limit-th best score, then the first few columns equal to it
+        if limit == 0:
+            return np.empty((len(scores), 0), dtype=np.intp)
+        threshold = -np.partition(-scores, limit - 1, axis=1)[:, limit - 1:limit]
+        above = scores > threshold
+        tied = scores == threshold
+        room = limit - above.sum(axis=1, keepdims=True)
+        keep = above | (tied & (np.cumsum(tied, axis=1) <= room))
+        columns = np.nonzero(keep)[1].reshape(len(scores), limit)
+        best = np.argsort(-np.take_along_axis(scores, columns, axis=1), axis=1, kind='stable')
+        return np.take_along_axis(columns, best, axis=1)
+
+    def rank(self, token, limit=None):
+        return self.rank_many([token], limit)[0]
+
+
+def get_ranker(language=None):
+    return _ranker(language or DEFAULT_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def _ranker(language):
+    return CandidateRanker(load_complete_morphology_data(language))
+
+
+def rank(form=None, xpos=None, upos=None, context=(), limit=None, language=None):
+    return get_ranker(language).rank(Token(form, xpos, upos, tuple(context)), limit)
@@ -0,0 +1,448 @@
+"""Pre-annotation of partially annotated CoNLL-U, with a persisted review queue.
+
+``ingest`` streams a file and finds each token's candidate recommendations:
+those for its XPOS that allow its UPOS and the FEATS it already has. A
+token with one candidate needs no decision. Tokens with several (``CD``
+NumType=Card vs Ord, ``RP`` Polarity=Neg vs Pos) are queued in SQLite
+together with their sentence. Blocks of sentences are matched in a process
+pool, and each block's queue entries are committed with the ingest
+position, so an interrupted ingest resumes after the last committed block.
+
+Queued tokens are resolved in the app or with ``ReviewQueue.resolve``.
+``apply`` then streams the file again and fills every token from its one
+candidate or the chosen one. Tokens still pending get what their
+candidates agree on and a ``Review=...`` flag in MISC, as in
+``morphology.convert``.
+
+Usage: python -m morphology.review ingest FILE... [--db PATH] [-j WORKERS] [--language LANG] [--restart]
+       python -m morphology.review status [--db PATH]
+       python -m morphology.review apply FILE [-o OUT] [--db PATH] [-j WORKERS]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from itertools import islice
+
+from .conllu import FEATS, FORM, ID, MISC, UPOS, XPOS, format_sentence, iter_tokens, read_blocks, read_file
+from .convert import compile_conversion, fill_conversion, review_flag
+from .feats import VOCABULARY
+from .indexes import get_rule_index
+from .parallel import map_blocks
+from .table import DEFAULT_LANGUAGE, file_stamp
+
+REVIEW_NAME = 'xpomo_review.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    language TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    done_line INTEGER NOT NULL DEFAULT 0,
+    finished INTEGER NOT NULL DEFAULT 0,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    filled INTEGER NOT NULL DEFAULT 0,
+    queued INTEGER NOT NULL DEFAULT 0,
+    unknown INTEGER NOT NULL DEFAULT 0,
+    conflict INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sentences (
+    job INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    PRIMARY KEY (job, line)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS items (
+    job INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    sentence INTEGER NOT NULL,
+    token_id TEXT NOT NULL,
+    form TEXT NOT NULL,
+    upos TEXT NOT NULL,
+    xpos TEXT NOT NULL,
+    feats TEXT NOT NULL,
+    candidates TEXT NOT NULL,
+    choice TEXT,
+    resolved_by TEXT,
+    PRIMARY KEY (job, line)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pending_items ON items (job, line) WHERE choice IS NULL;
+CREATE INDEX IF NOT EXISTS pending_forms ON items (job, form, xpos) WHERE choice IS NULL;
+"""
+
+# Token statuses: ingest counts filled/queued/unknown/conflict, apply counts
+# filled/resolved/pending/unknown/conflict. Unknown tokens have an XPOS
+# without rules; conflict tokens have a UPOS or FEATS that none of their
+# XPOS's rules allows.
+FILLED = 'filled'
+QUEUED = 'queued'
+RESOLVED = 'resolved'
+PENDING = 'pending'
+UNKNOWN = 'unknown'
+CONFLICT = 'conflict'
+
+Job = namedtuple('Job', 'job path language mtime_ns size done_line finished tokens filled queued unknown conflict '
+                        'pending')
+
+# line: the token's line in the file; sentence: the text of its sentence;
+# candidates: recommendation ids
+ReviewItem = namedtuple('ReviewItem', 'job line token_id form upos xpos feats candidates choice sentence')
+
+
+def _compatible(rule, token):
+    # The token's existing values of the features the rule names must be allowed
+    for feature_id, allowed in rule.values.items():
+        if token.features >> feature_id & 1 and token.values[feature_id] & ~allowed:
+            return False
+    return True
+
+
+class CandidateTable:
+    # Candidates per distinct (UPOS, XPOS, FEATS) token triple, and the
+    # Conversion of each candidate set
+
+    def __init__(self, index=None, vocabulary=VOCABULARY):
+        self._index = index if index is not None else get_rule_index()
+        self._vocabulary = vocabulary
+        self._candidates = {}
+        self._conversions = {}
+        self._results = {}
+
+    def candidates(self, upos, xpos, feats):
+        key = (upos, xpos, feats)
+        found = self._candidates.get(key)
+        if found is None:
+            token = self._vocabulary.compile(feats)
+            found = self._candidates[key] = tuple(
+                c for c in self._index.compiled_for('xpos', xpos)
+                if (upos == '_' or upos in c.upos) and _compatible(c.mask, token))
+        return found
+
+    def unmatched(self, xpos):
+        # Status of a token without candidates
+        return CONFLICT if self._index.compiled_for('xpos', xpos) else UNKNOWN
+
+    def conversion(self, candidates):
+        key = tuple(c.id for c in candidates)
+        conversion = self._conversions.get(key)
+        if conversion is None:
+            conversion = self._conversions[key] = compile_conversion(candidates)
+        return conversion
+
+    def fill(self, upos, xpos, feats, misc, choice=None):
+        # Returns (upos, feats, misc, status); choice is the id of the
+        # chosen candidate of an ambiguous token. MISC is not part of the
+        # memo key, so the memo stays bounded by the distinct tags.
+        key = (upos, xpos, feats, choice)
+        result = self._results.get(key)
+        if result is None:
+            result = self._results[key] = self._fill(upos, xpos, feats, choice)
+        upos, feats, review, status = result
+        return upos, feats, review_flag(misc, review) if review else misc, status
+
+    def _fill(self, upos, xpos, feats, choice):
+        candidates = self.candidates(upos, xpos, feats)
+        if not candidates:
+            return upos, feats, (), self.unmatched(xpos)
+        status = FILLED
+        if len(candidates) > 1:
+            # A choice that is no longer a candidate (the rules changed) is ignored
+            chosen = tuple(c for c in candidates if c.id == choice)
+            status = RESOLVED if chosen else PENDING
+            candidates = chosen or candidates
+        return (*fill_conversion(self.conversion(candidates), upos, feats), status)
+
+
+def sentence_text(sentence):
+    for line in sentence.lines:
+        if line.startswith('# text ='):
+            return line.partition('=')[2].strip()
+    return ' '.join(fields[FORM] for _, fields in iter_tokens(sentence))
+
+
+_worker_table = None
+
+
+def _init_worker(language):
+    global _worker_table
+    _worker_table = CandidateTable(get_rule_index(language))
+
+
+def _ingest_block(sentences):
+    # Returns (last line of the block, queued items, their sentences, status counts)
+    items = []
+    texts = []
+    counts = Counter()
+    for sentence in sentences:
+        queued = False
+        for line, fields in iter_tokens(sentence):
+            candidates = _worker_table.candidates(fields[UPOS], fields[XPOS], fields[FEATS])
+            if len(candidates) > 1:
+                items.append((line, sentence.start, fields[ID], fields[FORM], fields[UPOS], fields[XPOS],
+                              fields[FEATS], ','.join(c.id for c in candidates)))
+                queued = True
+            if candidates:
+                counts[QUEUED if len(candidates) > 1 else FILLED] += 1
+            else:
+                counts[_worker_table.unmatched(fields[XPOS])] += 1
+        if queued:
+            texts.append((sentence.start, sentence_text(sentence)))
+    last = sentences[-1]
+    return last.start + len(last.lines) - 1, items, texts, counts
+
+
+def _apply_block(sentences, choices):
+    chunks = []
+    counts = Counter()
+    for sentence in sentences:
+        lines = []
+        for offset, line in enumerate(sentence.lines):
+            fields = line.split('\t')
+            if line.startswith('#') or len(fields) != 10 or '-' in fields[ID] or '.' in fields[ID]:
+                lines.append(line)
+                continue
+            fields[UPOS], fields[FEATS], fields[MISC], status = _worker_table.fill(
+                fields[UPOS], fields[XPOS], fields[FEATS], fields[MISC], choices.get(sentence.start + offset))
+            counts[status] += 1
+            lines.append('\t'.join(fields))
+        chunks.append(format_sentence(lines))
+    return ''.join(chunks), counts
+
+
+class ReviewQueue:
+    # One connection per process, serialised by a lock, as in SessionDB
+
+    def __init__(self, path=REVIEW_NAME, timeout=10.0):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+            if 'conflict' not in {row[1] for row in self._conn.execute('PRAGMA table_info(jobs)')}:
+                # Queues from before conflicts were counted apart from unknown XPOS
+                self._conn.execute('ALTER TABLE jobs ADD COLUMN conflict INTEGER NOT NULL DEFAULT 0')
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Jobs
+
+    _JOB_COLUMNS = ('j.job, j.path, j.language, j.mtime_ns, j.size, j.done_line, j.finished, '
+                    'j.tokens, j.filled, j.queued, j.unknown, j.conflict, '
+                    '(SELECT COUNT(*) FROM items i WHERE i.job = j.job AND i.choice IS NULL)')
+
+    def jobs(self):
+        return [Job(*row) for row in self._query(f"SELECT {self._JOB_COLUMNS} FROM jobs j ORDER BY j.job")]
+
+    def job(self, job_id):
+        rows = self._query(f"SELECT {self._JOB_COLUMNS} FROM jobs j WHERE j.job = ?", (job_id,))
+        if not rows:
+            raise KeyError(f"no review job {job_id}")
+        return Job(*rows[0])
+
+    def find(self, path):
+        rows = self._query('SELECT job FROM jobs WHERE path = ?', (os.path.abspath(path),))
+        return self.job(rows[0][0]) if rows else None
+
+    def start(self, path, language=None, restart=False):
+        # The job for a file, created or, with restart, emptied as needed.
+        # A job whose file or language changed must be restarted.
+        path = os.path.abspath(path)
+        language = language or DEFAULT_LANGUAGE
+        mtime_ns, size = file_stamp(path)
+        with self._transaction() as cursor:
+            row = cursor.execute('SELECT job, language, mtime_ns, size FROM jobs WHERE path = ?', (path,)).fetchone()
+            if row is not None and not restart and tuple(row[1:]) != (language, mtime_ns, size):
+                raise ValueError(f"{path} or its language changed since it was ingested; ingest it with --restart")
+            if row is not None and restart:
+                for table in ('items', 'sentences', 'jobs'):
+                    cursor.execute(f"DELETE FROM {table} WHERE job = ?", (row[0],))
+                row = None
+            if row is None:
+                cursor.execute('INSERT INTO jobs (path, language, mtime_ns, size) VALUES (?, ?, ?, ?)',
+                               (path, language, mtime_ns, size))
+                job_id = cursor.lastrowid
+            else:
+                job_id = row[0]
+        return self.job(job_id)
+
+    def add_block(self, job_id, done_line, items, texts, counts):
+        # One block's queue entries and the new ingest position, atomically
+        with self._transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO items (job, line, sentence, token_id, form, upos, xpos, '
+                               'feats, candidates) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                               [(job_id, *item) for item in items])
+            cursor.executemany('INSERT OR REPLACE INTO sentences VALUES (?, ?, ?)',
+                               [(job_id, line, text) for line, text in texts])
+            cursor.execute('UPDATE jobs SET done_line = ?, tokens = tokens + ?, filled = filled + ?, '
+                           'queued = queued + ?, unknown = unknown + ?, conflict = conflict + ? WHERE job = ?',
+                           (done_line, sum(counts.values()), counts[FILLED], counts[QUEUED], counts[UNKNOWN],
+                            counts[CONFLICT], job_id))
+
+    def finish(self, job_id):
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE jobs SET finished = 1 WHERE job = ?', (job_id,))
+
+    # Review
+
+    def pending(self, job_id, after_line=0, limit=20):
+        # A page of unresolved items in file order, after a line
+        rows = self._query(
+            'SELECT i.job, i.line, i.token_id, i.form, i.upos, i.xpos, i.feats, i.candidates, i.choice, s.text '
+            'FROM items i JOIN sentences s ON s.job = i.job AND s.line = i.sentence '
+            'WHERE i.job = ? AND i.choice IS NULL AND i.line > ? ORDER BY i.line LIMIT ?',
+            (job_id, after_line, limit))
+        return [ReviewItem(*row[:7], tuple(row[7].split(',')), *row[8:]) for row in rows]
+
+    def resolve(self, job_id, line, choice, user=None):
+        # Records a choice (None reopens the item); returns whether it exists
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE items SET choice = ?, resolved_by = ? WHERE job = ? AND line = ?',
+                           (choice, user, job_id, line))
+            return cursor.rowcount > 0
+
+    def resolve_similar(self, item, choice, user=None):
+        # Resolves every pending token identical to item (form, UPOS, XPOS,
+        # FEATS) the same way; returns how many
+        with self._transaction() as cursor:
+            cursor.execute('UPDATE items SET choice = ?, resolved_by = ? WHERE job = ? AND choice IS NULL '
+                           'AND form = ? AND xpos = ? AND upos = ? AND feats = ?',
+                           (choice, user, item.job, item.form, item.xpos, item.upos, item.feats))
+            return cursor.rowcount
+
+    def choices(self, job_id, first_line, last_line):
+        return dict(self._query('SELECT line, choice FROM items WHERE job = ? AND line BETWEEN ? AND ? '
+                                'AND choice IS NOT NULL', (job_id, first_line, last_line)))
+
+
+def _pending_blocks(path, after_line, block_size):
+    sentences = (sentence for sentence in read_file(path) if sentence.start > after_line)
+    while True:
+        block = list(islice(sentences, block_size))
+        if not block:
+            return
+        yield (block,)
+
+
+def ingest(queue, path, language=None, workers=None, block_size=500, restart=False):
+    # Queues the ambiguous tokens of a file, resuming an interrupted ingest
+    job = queue.start(path, language, restart)
+    if not job.finished:
+        for done_line, items, texts, counts in map_blocks(
+                _ingest_block, _pending_blocks(job.path, job.done_line, block_size), workers,
+                _init_worker, (job.language,)):
+            queue.add_block(job.job, done_line, items, texts, counts)
+        queue.finish(job.job)
+    return queue.job(job.job)
+
+
+def apply_choices(queue, path, workers=None, block_size=500):
+    # Yields (filled text, status counts) per block of the file, in order
+    job = queue.find(path)
+    if job is None:
+        raise KeyError(f"{path} has not been ingested")
+    if file_stamp(job.path) != (job.mtime_ns, job.size):
+        raise ValueError(f"{path} changed since it was ingested")
+
+    def blocks():
+        for _, sentences in read_blocks([job.path], block_size):
+            last = sentences[-1]
+            yield sentences, queue.choices(job.job, sentences[0].start, last.start + len(last.lines) - 1)
+
+    return map_blocks(_apply_block, blocks(), workers, _init_worker, (job.language,))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-annotate CoNLL-U and queue ambiguous tokens for review.")
+    parser.add_argument('--db', default=REVIEW_NAME, help=f"review queue database (default: {REVIEW_NAME})")
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = commands.add_parser('ingest', help='queue the ambiguous tokens of files')
+    ingest_parser.add_argument('files', nargs='+', metavar='FILE')
+    ingest_parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    ingest_parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    ingest_parser.add_argument('--language', help='rule set to match against')
+    ingest_parser.add_argument('--restart', action='store_true', help='discard earlier progress and choices')
+    commands.add_parser('status', help='show review progress per file')
+    apply_parser = commands.add_parser('apply', help='write a file filled with the choices made so far')
+    apply_parser.add_argument('file', metavar='FILE')
+    apply_parser.add_argument('-o', '--output', help='output path (default: stdout)')
+    apply_parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    apply_parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    args = parser.parse_args(argv)
+
+    queue = ReviewQueue(args.db)
+    if args.command == 'status':
+        for job in queue.jobs():
+            state = 'done' if job.finished else f"ingested to line {job.done_line}"
+            print(f"{job.job}\t{job.path}\t{job.language}\t{state}\t{job.tokens} tokens, {job.filled} filled, "
+                  f"{job.queued} queued, {job.pending} pending, {job.unknown} unknown XPOS, "
+                  f"{job.conflict} conflicting")
+        return 0
+
+    if args.command == 'ingest':
+        for path in args.files:
+            started = time.perf_counter()
+            try:
+                job = ingest(queue, path, args.language, args.workers, args.block_size, args.restart)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 1
+            elapsed = time.perf_counter() - started
+            print(f"{path}: {job.tokens} tokens in {elapsed:.2f}s: {job.filled} filled, {job.queued} queued "
+                  f"for review, {job.unknown} with unknown XPOS, {job.conflict} with UPOS/FEATS no rule "
+                  f"for their XPOS allows", file=sys.stderr)
+        return 0
+
+    started = time.perf_counter()
+    counts = Counter()
+    # Checked before the output is opened, which would empty an input written over itself
+    try:
+        blocks = apply_choices(queue, args.file, args.workers, args.block_size)
+    except (KeyError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.output and os.path.exists(args.output) and os.path.samefile(args.output, args.file):
+        print(f"{args.output} is the input and would be emptied before it is read", file=sys.stderr)
+        return 1
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for text, found in blocks:
+            out.write(text)
+            counts.update(found)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"{sum(counts.values())} tokens in {time.perf_counter() - started:.2f}s: {counts[FILLED]} filled, "
+          f"{counts[RESOLVED]} resolved, {counts[PENDING]} still pending, {counts[UNKNOWN]} with unknown XPOS, "
+          f"{counts[CONFLICT]} with UPOS/FEATS no rule for their XPOS allows", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
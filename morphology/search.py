@@ -0,0 +1,273 @@
+"""Full-text search over recommendations.
+
+Indexes the ``examples``, ``when`` and ``decision_factors`` text of each
+recommendation together with its scenario ``context`` and ``question``
+(and the ``choice`` label). Words map to weighted postings; a trigram
+index over the word vocabulary resolves prefix/substring and misspelt
+query words to indexed words, so a search never scans the documents.
+Postings are also kept grouped by weight, and scores are combined one
+group at a time with set operations, so a query costs about the same
+whether a word is in fifty documents or in thousands.
+"""
+
+import heapq
+import math
+import operator
+import re
+import threading
+from collections import Counter
+from functools import lru_cache
+
+from .table import DEFAULT_LANGUAGE, iter_recommendations, load_complete_morphology_data
+
+# Field weights for ranking
+FIELD_WEIGHTS = {
+    'choice': 3.0,
+    'examples': 2.0,
+    'decision_factors': 2.0,
+    'when': 1.5,
+    'context': 1.0,
+    'question': 0.5,
+}
+
+# Score multipliers by how a query word matched an indexed word
+EXACT, PARTIAL, FUZZY = 1.0, 0.7, 0.5
+
+MIN_SIMILARITY = 0.45
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+def trigrams(word):
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _document_fields(analysis, scenario, rec):
+    yield 'choice', rec['choice']
+    yield 'when', rec['when']
+    yield 'context', scenario['context']
+    yield 'question', scenario['question']
+    for example in rec['examples']:
+        yield 'examples', example
+    for factor in rec.get('decision_factors', ()):
+        yield 'decision_factors', factor
+
+
+class SearchIndex:
+
+    def __init__(self, decisions):
+        self._decisions = decisions
+        self._postings = {}       # word -> {id: weight}
+        self._grams = {}          # trigram -> set of words
+        self._gram_counts = {}    # word -> number of its trigrams
+        self._groups = {}         # word -> {weight: set of ids}
+        self._words_by_key = {}   # analysis key -> words it posted
+        self._ids_by_key = {}     # analysis key -> recommendation ids
+        self._indexed = {}        # analysis key -> generation
+        self._version = None
+        self._documents = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._documents
+
+    def add_analysis(self, analysis_key, analysis):
+        self.remove_analysis(analysis_key)
+        generation = getattr(self._decisions, 'generation', None)
+        self._indexed[analysis_key] = generation(analysis_key) if generation else 0
+        words = self._words_by_key[analysis_key] = set()
+        ids = self._ids_by_key[analysis_key] = []
+        for unique_id, _, scenario, rec in iter_recommendations({analysis_key: analysis}):
+            ids.append(unique_id)
+            self._documents += 1
+            weights = {}
+            for field, text in _document_fields(analysis, scenario, rec):
+                weight = FIELD_WEIGHTS[field]
+                for word in tokenize(text):
+                    weights[word] = weights.get(word, 0.0) + weight
+            for word, weight in weights.items():
+                postings = self._postings.get(word)
+                if postings is None:
+                    postings = self._postings[word] = {}
+                    groups = self._groups[word] = {}
+                    grams = trigrams(word)
+                    self._gram_counts[word] = len(grams)
+                    for gram in grams:
+                        self._grams.setdefault(gram, set()).add(word)
+                else:
+                    groups = self._groups[word]
+                postings[unique_id] = weight
+                members = groups.get(weight)
+                if members is None:
+                    groups[weight] = {unique_id}
+                else:
+                    members.add(unique_id)
+            words.update(weights)
+
+    def remove_analysis(self, analysis_key):
+        self._indexed.pop(analysis_key, None)
+        ids = self._ids_by_key.pop(analysis_key, ())
+        self._documents -= len(ids)
+        for word in self._words_by_key.pop(analysis_key, ()):
+            postings = self._postings[word]
+            groups = self._groups[word]
+            for unique_id in ids:
+                weight = postings.pop(unique_id, None)
+                if weight is not None:
+                    groups[weight].discard(unique_id)
+                    if not groups[weight]:
+                        del groups[weight]
+            if not postings:
+                del self._postings[word]
+                del self._groups[word]
+                del self._gram_counts[word]
+                for gram in trigrams(word):
+                    self._grams[gram].discard(word)
+                    if not self._grams[gram]:
+                        del self._grams[gram]
+
+    def sync(self):
+        # Index every analysis, re-indexing ones the table has reloaded
+        poll = getattr(self._decisions, 'poll', None)
+        version = poll() if poll else None
+        generation = getattr(self._decisions, 'generation', None)
+        if version != self._version or poll is None:
+            self._version = version
+            for analysis_key in list(self._indexed):
+                if analysis_key not in self._decisions or \
+                        (generation and generation(analysis_key) != self._indexed[analysis_key]):
+                    self.remove_analysis(analysis_key)
+        if len(self._indexed) != len(self._decisions):
+            for analysis_key in self._decisions:
+                if analysis_key not in self._indexed:
+                    self.add_analysis(analysis_key, self._decisions[analysis_key])
+
+    def expand(self, word):
+        # Indexed words a query word stands for, with a match multiplier
+        matches = {}
+        if word in self._postings:
+            matches[word] = EXACT
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        gram_counts = self._gram_counts
+        for candidate, count in shared.items():
+            if candidate in matches:
+                continue
+            if len(word) >= 3 and word in candidate:
+                matches[candidate] = PARTIAL
+                continue
+            similarity = count / (len(grams) + gram_counts[candidate] - count)
+            if similarity >= MIN_SIMILARITY:
+                matches[candidate] = FUZZY * similarity
+        return matches
+
+    def search(self, query, limit=20):
+        # Returns [(id, score)] best first
+        with self._lock:
+            self.sync()
+            return self._search(query, limit)
+
+    def _search(self, query, limit):
+        # Scores are kept as {score: set of ids}. Each query word's weight
+        # groups are merged in with set intersections and differences, and
+        # groups that can no longer reach the top `limit` are dropped
+        total = max(len(self), 1)
+        words = []
+        for word in set(tokenize(query)):
+            matched, members = {}, None
+            for candidate, factor in self.expand(word).items():
+                postings = self._postings[candidate]
+                scale = factor * math.log(1 + total / len(postings))
+                groups = {weight * scale: ids for weight, ids in self._groups[candidate].items()}
+                matched = _merge(matched, [members] if members is not None else [], groups, [postings], max)
+                # The ids the word covers: its one match's postings, or a set
+                # once it has several
+                if members is None:
+                    members = postings
+                elif isinstance(members, dict):
+                    members = set(members).union(postings)
+                else:
+                    members.update(postings)
+            if matched:
+                words.append((matched, [members]))
+        # rest[i]: the most the words after the i-th can still add
+        rest = [0.0] * len(words)
+        for i in range(len(words) - 2, -1, -1):
+            rest[i] = rest[i + 1] + max(words[i + 1][0])
+        scores, scored, floor = {}, [], 0.0
+        for (matched, members), ceiling in zip(words, rest):
+            scores = _merge(scores, scored, matched, members, operator.add, floor - ceiling)
+            scored.extend(members)
+            floor = _floor(scores, limit)
+        ranked = []
+        for score in sorted(scores, reverse=True):
+            ids = scores[score]
+            if len(ids) > limit - len(ranked):
+                ids = heapq.nsmallest(limit - len(ranked), ids)
+            ranked.extend((unique_id, score) for unique_id in sorted(ids))
+            if len(ranked) >= limit:
+                break
+        return ranked
+
+
+def _without(ids, members):
+    for postings in members:
+        if not ids:
+            break
+        # A small posting list is checked for overlap before copying ids
+        if len(postings) < len(ids) and ids.isdisjoint(postings):
+            continue
+        ids = ids.difference(postings)
+    return ids
+
+
+def _merge(left, left_members, right, right_members, combine, cutoff=0.0):
+    # left and right map score -> ids, covering the ids of left_members and
+    # right_members; ids in both get combine(left score, right score), and
+    # scores below cutoff are dropped
+    merged = {}
+
+    def put(score, ids):
+        if ids:
+            merged[score] = merged[score] | ids if score in merged else ids
+
+    for other, others in right.items():
+        if other >= cutoff:
+            put(other, _without(others, left_members))
+    for score, ids in left.items():
+        if score >= cutoff:
+            put(score, _without(ids, right_members))
+        for other, others in right.items():
+            if combine(score, other) >= cutoff:
+                put(combine(score, other), ids.intersection(others))
+    return merged
+
+
+def _floor(scores, limit):
+    # A score that at least `limit` ids already reach, or 0.0
+    count = 0
+    for score in sorted(scores, reverse=True):
+        count += len(scores[score])
+        if count >= limit:
+            return score
+    return 0.0
+
+
+def get_search_index(language=None):
+    return _search_index(language or DEFAULT_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def _search_index(language):
+    return SearchIndex(load_complete_morphology_data(language))
+
+
+def search(query, limit=20, language=None):
+    return get_search_index(language).search(query, limit)
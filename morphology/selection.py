@@ -0,0 +1,107 @@
+"""Keyed store for the recommendations an annotator has selected."""
+
+import threading
+
+from .table import build_recommendation_record, parse_recommendation_id, recommendation_id
+
+
+class SelectionStore:
+    # Records keyed by recommendation id. Dicts keep insertion order, so
+    # iteration follows selection order for export; membership, add and
+    # discard are O(1). A second index groups ids by analysis and scenario
+    # for bulk operations. Changes and snapshots hold the lock, so a
+    # download built off the script thread sees a whole selection.
+
+    def __init__(self, records=()):
+        self._records = {}
+        self._groups = {}
+        self._lock = threading.RLock()
+        self.select_many(records)
+
+    def __contains__(self, unique_id):
+        return unique_id in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(self._records.values())
+
+    def get(self, unique_id, default=None):
+        return self._records.get(unique_id, default)
+
+    def ids(self):
+        with self._lock:
+            return list(self._records)
+
+    def snapshot(self):
+        # The selected records in selection order, safe to take while
+        # another thread changes the selection
+        with self._lock:
+            return list(self._records.values())
+
+    def add(self, record):
+        unique_id = record['id']
+        analysis_key, scenario_idx, _ = parse_recommendation_id(unique_id)
+        with self._lock:
+            if unique_id in self._records:
+                return False
+            self._records[unique_id] = record
+            self._groups.setdefault(analysis_key, {}).setdefault(scenario_idx, {})[unique_id] = None
+        return True
+
+    def discard(self, unique_id):
+        with self._lock:
+            if self._records.pop(unique_id, None) is None:
+                return False
+            analysis_key, scenario_idx, _ = parse_recommendation_id(unique_id)
+            scenarios = self._groups[analysis_key]
+            del scenarios[scenario_idx][unique_id]
+            if not scenarios[scenario_idx]:
+                del scenarios[scenario_idx]
+                if not scenarios:
+                    del self._groups[analysis_key]
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._groups.clear()
+
+    def select_many(self, records):
+        with self._lock:
+            return [record['id'] for record in records if self.add(record)]
+
+    def discard_many(self, unique_ids):
+        with self._lock:
+            return [unique_id for unique_id in list(unique_ids) if self.discard(unique_id)]
+
+    # Bulk operations per scenario or analysis; each returns the ids changed
+
+    def select_scenario(self, decisions, analysis_key, scenario_idx):
+        recs = decisions[analysis_key]['scenarios'][scenario_idx]['recommendations']
+        return self.select_many(
+            build_recommendation_record(decisions, recommendation_id(analysis_key, scenario_idx, rec_idx))
+            for rec_idx in range(len(recs))
+            if recommendation_id(analysis_key, scenario_idx, rec_idx) not in self._records
+        )
+
+    def select_analysis(self, decisions, analysis_key):
+        selected = []
+        for scenario_idx in range(len(decisions[analysis_key]['scenarios'])):
+            selected.extend(self.select_scenario(decisions, analysis_key, scenario_idx))
+        return selected
+
+    def deselect_scenario(self, analysis_key, scenario_idx):
+        ids = self._groups.get(analysis_key, {}).get(scenario_idx, {})
+        return self.discard_many(ids)
+
+    def deselect_analysis(self, analysis_key):
+        scenarios = self._groups.get(analysis_key, {})
+        return self.discard_many([unique_id for ids in scenarios.values() for unique_id in ids])
+
+    def selected_in(self, analysis_key, scenario_idx=None):
+        scenarios = self._groups.get(analysis_key, {})
+        if scenario_idx is not None:
+            return len(scenarios.get(scenario_idx, ()))
+        return sum(len(ids) for ids in scenarios.values())
@@ -0,0 +1,383 @@
+"""Standalone HTTP/JSON lookup service over the decision table.
+
+Endpoints (all JSON):
+
+    GET  /health
+    GET  /languages
+    GET  /terms/<xpos|upos|feature|feature_value>
+    GET  /lookup/xpos/<tag>   /lookup/upos/<tag>
+    GET  /lookup/feature/<name>   /lookup/feature/<name>=<value>
+    GET  /search?q=<text>&limit=<n>
+    POST /validate   {"tokens": [{"upos": ..., "xpos": ..., "feats": ...}, ...]}
+                     (upos and xpos required, feats defaults to "_")
+
+Every endpoint but /health and /languages takes ``?lang=<code>`` to pick a
+language's rule set (default: the top-level rules); a language's indexes
+are built on its first request.
+
+``LookupService`` maps a request to a response without any transport, so
+tools and tests can drive it through ``LocalClient``; ``LookupServer``
+serves it over HTTP/1.1 keep-alive connections from a fixed pool of worker
+threads. Encoded GET responses are kept in an LRU cache keyed by the rule
+table version, so a reload never serves stale data.
+
+Usage: python -m morphology.service [--host HOST] [--port PORT] [--workers N]
+       [--cache-size N] [--snapshot PATH]
+"""
+
+import argparse
+import json
+import socket
+import sys
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .indexes import RuleIndex, get_rule_index
+from .search import SearchIndex, get_search_index
+from .snapshot import open_rule_table
+from .table import DEFAULT_LANGUAGE, available_languages, build_recommendation_record, load_complete_morphology_data
+from .validate import TokenChecker
+
+LOOKUP_KINDS = ('xpos', 'upos', 'feature')
+MAX_BODY = 16 * 1024 * 1024
+# Distinct (upos, xpos, feats) triples each language's checker remembers
+CHECKER_CACHE_SIZE = 65536
+
+RuleSet = namedtuple('RuleSet', 'decisions index search_index')
+
+
+class ServiceError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    # Thread-safe LRU of encoded responses
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LookupService:
+
+    def __init__(self, decisions=None, cache_size=4096):
+        # Without decisions, serve every language from the process-wide
+        # tables and indexes; otherwise serve just the given table
+        self._shared = decisions is None
+        self._rule_sets = {}
+        if decisions is not None:
+            self._rule_sets[DEFAULT_LANGUAGE] = RuleSet(decisions, RuleIndex(decisions), SearchIndex(decisions))
+        self.cache = ResponseCache(cache_size)
+        self._checkers = {}    # language -> (table version, TokenChecker)
+        self._lock = threading.Lock()
+
+    def languages(self):
+        return available_languages() if self._shared else [DEFAULT_LANGUAGE]
+
+    def rule_set(self, language=None):
+        language = language or DEFAULT_LANGUAGE
+        rule_set = self._rule_sets.get(language)
+        if rule_set is None:
+            if language not in self.languages():
+                raise ServiceError(404, f"unknown language: {language}")
+            rule_set = self._rule_sets.setdefault(language, RuleSet(
+                load_complete_morphology_data(language), get_rule_index(language), get_search_index(language)))
+        return rule_set
+
+    @property
+    def decisions(self):
+        return self.rule_set().decisions
+
+    @property
+    def index(self):
+        return self.rule_set().index
+
+    @property
+    def search_index(self):
+        return self.rule_set().search_index
+
+    def version(self, language=None):
+        poll = getattr(self.rule_set(language).decisions, 'poll', None)
+        return poll() if poll else None
+
+    def handle(self, method, target, body=b''):
+        # Returns (status, encoded JSON body)
+        url = urlsplit(target)
+        if method == 'GET' and url.path.rstrip('/') == '/health':
+            return self._respond(self.health)
+        if method == 'GET':
+            try:
+                key = (self.version(_language(url)), url.path, url.query)
+            except ServiceError as e:
+                return self._respond(self._error, e.status, str(e))
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            response = self._respond(self._get, url)
+            if response[0] == 200:
+                self.cache.put(key, response)
+            return response
+        if method == 'POST':
+            return self._respond(self._post, url, body)
+        return self._respond(self._error, 405, f"method {method} not allowed")
+
+    def _respond(self, handler, *args):
+        try:
+            status, payload = 200, handler(*args)
+        except ServiceError as e:
+            status, payload = e.status, {'error': str(e)}
+        return status, json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+    def _error(self, status, message):
+        raise ServiceError(status, message)
+
+    def _get(self, url):
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = parse_qs(url.query)
+        language = _language(url)
+        if parts == ['languages']:
+            return {'languages': self.languages()}
+        if len(parts) == 2 and parts[0] == 'terms':
+            return self.terms(parts[1], language)
+        if len(parts) == 3 and parts[0] == 'lookup':
+            return self.lookup(parts[1], parts[2], language)
+        if parts == ['search']:
+            return self.search(query.get('q', [''])[0], _int_param(query, 'limit', 20), language)
+        raise ServiceError(404, f"no such endpoint: {url.path}")
+
+    def _post(self, url, body):
+        if url.path.rstrip('/') != '/validate':
+            raise ServiceError(404, f"no such endpoint: {url.path}")
+        try:
+            tokens = json.loads(body or b'{}')['tokens']
+        except (ValueError, KeyError, TypeError):
+            raise ServiceError(400, 'expected a JSON object with a "tokens" list')
+        return self.validate(tokens, _language(url))
+
+    # Endpoints
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'version': self.version(),
+            'analyses': len(self.decisions),
+            'languages': sorted(self._rule_sets),
+            'cache': {'size': len(self.cache), 'hits': self.cache.hits, 'misses': self.cache.misses},
+        }
+
+    def terms(self, kind, language=None):
+        if kind not in RuleIndex.KINDS:
+            raise ServiceError(404, f"unknown term kind: {kind}")
+        terms = self.rule_set(language).index.terms(kind)
+        if kind == 'feature_value':
+            terms = [f"{name}={value}" for name, value in terms]
+        return {'kind': kind, 'terms': terms}
+
+    def lookup(self, kind, term, language=None):
+        if kind not in LOOKUP_KINDS:
+            raise ServiceError(404, f"unknown lookup kind: {kind}")
+        rules = self.rule_set(language)
+        if kind == 'feature' and '=' in term:
+            ids = rules.index.by_feature_value(*term.split('=', 1))
+        else:
+            ids = rules.index.lookup(kind, term)
+        return {'kind': kind, 'term': term, 'count': len(ids),
+                'results': [build_recommendation_record(rules.decisions, unique_id) for unique_id in ids]}
+
+    def search(self, query, limit, language=None):
+        rules = self.rule_set(language)
+        results = rules.search_index.search(query, limit)
+        return {'query': query, 'count': len(results),
+                'results': [{'score': round(score, 4), **build_recommendation_record(rules.decisions, unique_id)}
+                            for unique_id, score in results]}
+
+    def checker(self, language=None):
+        # TokenChecker memoises per token triple (an LRU here, as clients
+        # send arbitrary FEATS), so start a fresh one whenever the
+        # language's table reloads
+        language = language or DEFAULT_LANGUAGE
+        rules = self.rule_set(language)
+        version = self.version(language)
+        with self._lock:
+            entry = self._checkers.get(language)
+            if entry is None or entry[0] != version:
+                checker = TokenChecker(rules.index, cache_size=CHECKER_CACHE_SIZE)
+                entry = self._checkers[language] = (version, checker)
+            return entry[1]
+
+    def validate(self, tokens, language=None):
+        if not isinstance(tokens, list):
+            raise ServiceError(400, '"tokens" must be a list')
+        checker = self.checker(language)
+        results = []
+        for token in tokens:
+            # A token without UPOS is a malformed request, not a mismatch
+            try:
+                upos, xpos, feats = token['upos'], token['xpos'], token.get('feats', '_')
+            except (AttributeError, KeyError, TypeError):
+                raise ServiceError(400, 'each token needs a "upos" and an "xpos"')
+            if not all(isinstance(value, str) for value in (upos, xpos, feats)):
+                raise ServiceError(400, '"upos", "xpos" and "feats" must be strings')
+            if not upos or not xpos:
+                raise ServiceError(400, 'each token needs a "upos" and an "xpos"')
+            result = checker.check(upos, xpos, feats)
+            results.append(None if result is None else {'kind': result[0], 'message': result[1]})
+        return {'count': len(results), 'issues': sum(result is not None for result in results),
+                'results': results}
+
+
+def _language(url):
+    return parse_qs(url.query).get('lang', [None])[0]
+
+
+def _int_param(query, name, default):
+    try:
+        return int(query[name][0]) if name in query else default
+    except ValueError:
+        raise ServiceError(400, f"{name} must be an integer")
+
+
+class LocalClient:
+    # In-process stand-in for an HTTP client; returns (status, decoded JSON)
+
+    def __init__(self, service):
+        self.service = service
+
+    def get(self, path):
+        status, body = self.service.handle('GET', path)
+        return status, json.loads(body)
+
+    def post(self, path, payload):
+        status, body = self.service.handle('POST', path, json.dumps(payload).encode('utf-8'))
+        return status, json.loads(body)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this keep-alive
+    # clients wait on delayed ACKs
+    disable_nagle_algorithm = True
+    # Idle keep-alive connections give their worker back after this long
+    timeout = 30
+
+    def do_GET(self):
+        self._send(*self.server.service.handle('GET', self.path))
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY:
+            self._send(413, json.dumps({'error': 'request body too large'}).encode('utf-8'))
+            self.close_connection = True
+            return
+        self._send(*self.server.service.handle('POST', self.path, self.rfile.read(length)))
+
+    def _send(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LookupServer(HTTPServer):
+    # Connections are handed to a fixed pool of worker threads; a
+    # keep-alive connection holds its worker until the client closes it
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, service, workers=16):
+        super().__init__(address, _Handler)
+        self.service = service
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix='lookup')
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        self._pool.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # Wake workers blocked on idle keep-alive connections
+        with self._connections_lock:
+            for request in self._connections:
+                try:
+                    request.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve rule lookups, search and validation over HTTP.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=16, help='worker threads (concurrent connections)')
+    parser.add_argument('--cache-size', type=int, default=4096, help='cached GET responses')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='compiled rules snapshot, used when it matches the rule sources')
+    args = parser.parse_args(argv)
+
+    decisions = open_rule_table(snapshot=args.snapshot) if args.snapshot else None
+    server = LookupServer((args.host, args.port), LookupService(decisions, args.cache_size), args.workers)
+    print(f"Serving on http://{args.host}:{server.server_port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""Annotation sessions persisted to SQLite.
+
+Selections are stored per (user, project) as one row per selected
+recommendation, and every add, discard or clear is appended to a change
+log. A ``PersistentSelectionStore`` queues its own operations and writes
+them in one transaction per ``flush`` (one row per toggle, never the whole
+list), and ``sync`` replays the log entries written since it last looked,
+so several app replicas or browser tabs on the same session converge.
+Records are rebuilt from the rule table on restore; only ids are stored.
+
+The database runs in WAL mode, so readers never block the writer.
+"""
+
+import sqlite3
+import threading
+
+from .selection import SelectionStore
+from .table import build_recommendation_record, parse_recommendation_id
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS selections (
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    rec_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (user, project, rec_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user TEXT NOT NULL,
+    project TEXT NOT NULL,
+    rec_id TEXT,
+    selected INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_by_session ON changes (user, project, seq);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+
+# Change log entries kept; sessions that fall further behind reload fully
+LOG_RETENTION = 100000
+PRUNE_EVERY = 1000
+
+
+class SessionDB:
+    # One connection shared by every session in the process, serialised
+    # by a lock; other processes coordinate through SQLite's own locking
+
+    def __init__(self, path, timeout=10.0):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def selections(self, user, project):
+        # ([ids in selection order], log position they reflect)
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN')
+            try:
+                ids = [row[0] for row in cursor.execute(
+                    'SELECT rec_id FROM selections WHERE user = ? AND project = ? ORDER BY position',
+                    (user, project))]
+                seq = cursor.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+            finally:
+                cursor.execute('COMMIT')
+        return ids, seq
+
+    def changes_since(self, user, project, seq):
+        # [(seq, rec_id, selected)] after seq, or None when the log no
+        # longer reaches back that far
+        with self._lock:
+            pruned = self._conn.execute("SELECT value FROM meta WHERE key = 'pruned_through'").fetchone()
+            if pruned is not None and seq < pruned[0]:
+                return None
+            return self._conn.execute(
+                'SELECT seq, rec_id, selected FROM changes WHERE user = ? AND project = ? AND seq > ? ORDER BY seq',
+                (user, project, seq)).fetchall()
+
+    def write(self, user, project, operations):
+        # Applies [(rec_id or None for clear, selected)] in one transaction;
+        # returns the last log position written
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                seq = 0
+                for rec_id, selected in operations:
+                    cursor.execute('INSERT INTO changes (user, project, rec_id, selected) VALUES (?, ?, ?, ?)',
+                                   (user, project, rec_id, int(selected)))
+                    seq = cursor.lastrowid
+                    if rec_id is None:
+                        cursor.execute('DELETE FROM selections WHERE user = ? AND project = ?', (user, project))
+                    elif selected:
+                        cursor.execute('INSERT OR IGNORE INTO selections VALUES (?, ?, ?, ?)',
+                                       (user, project, rec_id, seq))
+                    else:
+                        cursor.execute('DELETE FROM selections WHERE user = ? AND project = ? AND rec_id = ?',
+                                       (user, project, rec_id))
+                if seq // PRUNE_EVERY != (seq - len(operations)) // PRUNE_EVERY:
+                    self._prune(cursor, seq - LOG_RETENTION)
+                cursor.execute('COMMIT')
+            except BaseException:
+                cursor.execute('ROLLBACK')
+                raise
+        return seq
+
+    def _prune(self, cursor, through):
+        if through <= 0:
+            return
+        cursor.execute('DELETE FROM changes WHERE seq <= ?', (through,))
+        cursor.execute("INSERT INTO meta VALUES ('pruned_through', ?) "
+                       "ON CONFLICT (key) DO UPDATE SET value = MAX(value, excluded.value)", (through,))
+
+
+class PersistentSelectionStore(SelectionStore):
+    # A SelectionStore whose changes are queued for the database. Changes
+    # read back from the log are applied through the base class so they
+    # are not queued again.
+
+    def __init__(self, db, user, project, decisions):
+        self.db = db
+        self.user = user
+        self.project = project
+        self._decisions = decisions
+        self._pending = []
+        self._seq = 0
+        super().__init__()
+        self.reload()
+
+    def add(self, record):
+        if not super().add(record):
+            return False
+        self._pending.append((record['id'], True))
+        return True
+
+    def discard(self, unique_id):
+        if not super().discard(unique_id):
+            return False
+        self._pending.append((unique_id, False))
+        return True
+
+    def clear(self):
+        super().clear()
+        self._pending = [(None, False)]
+
+    def flush(self):
+        # A failed write (e.g. SQLITE_BUSY) keeps the batch, ahead of
+        # anything queued since, for the next flush
+        if self._pending:
+            pending, self._pending = self._pending, []
+            try:
+                self.db.write(self.user, self.project, pending)
+            except BaseException:
+                self._pending = pending + self._pending
+                raise
+
+    def reload(self):
+        # Replace the contents with the stored selection; returns changed ids
+        ids, self._seq = self.db.selections(self.user, self.project)
+        before = set(self.ids())
+        SelectionStore.clear(self)
+        for unique_id in ids:
+            self._restore(unique_id)
+        return list(before.symmetric_difference(self.ids()))
+
+    def sync(self):
+        # Write queued changes, then apply everything logged since the last
+        # sync, including changes from other replicas; returns changed ids
+        self.flush()
+        changes = self.db.changes_since(self.user, self.project, self._seq)
+        if changes is None:
+            return self.reload()
+        changed = set()
+        for seq, unique_id, selected in changes:
+            self._seq = seq
+            if unique_id is None:
+                changed.update(self.ids())
+                SelectionStore.clear(self)
+            elif selected:
+                if self._restore(unique_id):
+                    changed.add(unique_id)
+            elif SelectionStore.discard(self, unique_id):
+                changed.add(unique_id)
+        return list(changed)
+
+    def _restore(self, unique_id):
+        # Ids of analyses or recommendations since removed from the rules are skipped
+        if unique_id in self:
+            return False
+        analysis_key, scenario_idx, rec_idx = parse_recommendation_id(unique_id)
+        try:
+            self._decisions[analysis_key]['scenarios'][scenario_idx]['recommendations'][rec_idx]
+        except (KeyError, IndexError):
+            return False
+        return SelectionStore.add(self, build_recommendation_record(self._decisions, unique_id))
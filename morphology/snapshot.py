@@ -0,0 +1,324 @@
+"""Compiled binary snapshot of a rules directory.
+
+The snapshot holds a string table, the interned feature/value pairs and
+fixed-width record arrays for analyses, scenarios and recommendations. It
+is opened with ``mmap`` and read in place with ``struct``, so worker
+processes share one page-cached copy and nothing is parsed up front;
+records are materialised only when an analysis is accessed.
+
+Each snapshot records the language and rules directory it was built from
+and the mtime and size of their source files. ``open_rule_table`` uses it
+only for that language's directory and while the sources still match, and
+falls back to the JSON sources otherwise.
+
+Usage: python -m morphology.snapshot build [--language LANG | --rules DIR] [-o PATH]
+       python -m morphology.snapshot info [PATH]
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping
+
+from .feats import parse_feats
+from .table import DEFAULT_LANGUAGE, RULES_DIR, RuleTable, file_stamp, freeze, rules_dir
+
+MAGIC = b'XPOMOSNP'
+FORMAT_VERSION = 2
+SNAPSHOT_NAME = 'rules.snap'
+
+HEADER = struct.Struct('<8sII')          # magic, format version, section count
+SECTION = struct.Struct('<8sQQ')         # name, offset, record count
+U32 = struct.Struct('<I')
+SOURCE = struct.Struct('<IQQ')           # file name, mtime_ns, size
+META = struct.Struct('<II')              # language, rules directory
+ANALYSIS = struct.Struct('<8I')          # key, title, description, upos, xpos (first, count), scenarios (first, count)
+SCENARIO = struct.Struct('<4I')          # context, question, recommendations (first, count)
+RECOMMENDATION = struct.Struct('<11I')   # choice, xpos, feats, when, rules, examples, factors, feature values (first, count each)
+FEATURE_VALUE = struct.Struct('<II')     # feature, value
+
+SECTIONS = ('meta', 'sources', 'stroff', 'strdata', 'lists', 'analyses', 'scenario', 'recs', 'featvals')
+
+
+def default_snapshot_path(directory=RULES_DIR):
+    return os.path.join(directory, SNAPSHOT_NAME)
+
+
+def _same_directory(first, second):
+    return os.path.realpath(first) == os.path.realpath(second)
+
+
+class _Builder:
+
+    def __init__(self):
+        self.strings = {}
+        self.lists = []
+
+    def string(self, value):
+        sid = self.strings.get(value)
+        if sid is None:
+            sid = self.strings[value] = len(self.strings)
+        return sid
+
+    def string_list(self, values):
+        first = len(self.lists)
+        self.lists.extend(self.string(v) for v in values)
+        return first, len(values)
+
+
+def build_snapshot(directory=None, output=None, language=None):
+    # A language's rules (the default set unless given), or any directory
+    language = language or DEFAULT_LANGUAGE
+    directory = directory or rules_dir(language)
+    output = output or default_snapshot_path(directory)
+    table = RuleTable(directory)
+    builder = _Builder()
+    meta = (builder.string(language), builder.string(os.path.realpath(directory)))
+    sources = []
+    analyses = []
+    scenarios = []
+    recs = []
+    featvals = []
+
+    for path in table.sources():
+        sources.append((builder.string(os.path.relpath(path, directory)), *file_stamp(path)))
+    for analysis_key in table:
+        analysis = table[analysis_key]
+        scenario_first = len(scenarios)
+        for scenario in analysis['scenarios']:
+            rec_first = len(recs)
+            for rec in scenario['recommendations']:
+                fv_first = len(featvals)
+                for name, values in parse_feats(rec['feats']):
+                    featvals.extend((builder.string(name), builder.string(v)) for v in sorted(values))
+                recs.append((
+                    builder.string(rec['choice']), builder.string(rec['xpos']), builder.string(rec['feats']),
+                    builder.string(rec['when']), builder.string(rec['morphological_rules']),
+                    *builder.string_list(rec['examples']),
+                    *builder.string_list(rec.get('decision_factors', ())),
+                    fv_first, len(featvals) - fv_first,
+                ))
+            scenarios.append((builder.string(scenario['context']), builder.string(scenario['question']),
+                              rec_first, len(recs) - rec_first))
+        analyses.append((
+            builder.string(analysis_key), builder.string(analysis['title']),
+            builder.string(analysis['description']), builder.string(analysis['upos']),
+            *builder.string_list(analysis['xpos_tags']),
+            scenario_first, len(scenarios) - scenario_first,
+        ))
+
+    blobs = [s.encode('utf-8') for s in builder.strings]
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    payloads = {
+        'meta': (META.pack(*meta), 1),
+        'sources': (b''.join(SOURCE.pack(*r) for r in sources), len(sources)),
+        'stroff': (b''.join(U32.pack(o) for o in offsets), len(offsets)),
+        'strdata': (b''.join(blobs), offsets[-1]),
+        'lists': (b''.join(U32.pack(i) for i in builder.lists), len(builder.lists)),
+        'analyses': (b''.join(ANALYSIS.pack(*r) for r in analyses), len(analyses)),
+        'scenario': (b''.join(SCENARIO.pack(*r) for r in scenarios), len(scenarios)),
+        'recs': (b''.join(RECOMMENDATION.pack(*r) for r in recs), len(recs)),
+        'featvals': (b''.join(FEATURE_VALUE.pack(*r) for r in featvals), len(featvals)),
+    }
+
+    offset = HEADER.size + SECTION.size * len(SECTIONS)
+    directory_entries = []
+    body = []
+    for name in SECTIONS:
+        data, count = payloads[name]
+        pad = -offset % 8
+        body.append(b'\0' * pad)
+        offset += pad
+        directory_entries.append(SECTION.pack(name.encode('ascii'), offset, count))
+        body.append(data)
+        offset += len(data)
+
+    tmp = output + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(SECTIONS)))
+        f.write(b''.join(directory_entries))
+        f.write(b''.join(body))
+    os.replace(tmp, output)
+    return output
+
+
+class SnapshotTable(Mapping):
+    # Same read-only interface as RuleTable, served from a mapped snapshot.
+    # Freshness is checked against directory, by default the one it was
+    # built from.
+
+    def __init__(self, path, directory=None):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path}: not a version {FORMAT_VERSION} rules snapshot")
+        self._sections = {}
+        for i in range(count):
+            name, offset, records = SECTION.unpack_from(self._map, HEADER.size + i * SECTION.size)
+            self._sections[name.rstrip(b'\0').decode('ascii')] = (offset, records)
+        language, built_from = META.unpack_from(self._map, self._sections['meta'][0])
+        self.language = self._string(language)
+        self.built_from = self._string(built_from)
+        self.directory = directory or self.built_from
+        self._keys = {self._string(ANALYSIS.unpack_from(self._map, self._record_offset('analyses', ANALYSIS, i))[0]): i
+                      for i in range(self._sections['analyses'][1])}
+        self._headers = None
+        self._cache = {}
+
+    def _record_offset(self, section, record, i):
+        return self._sections[section][0] + i * record.size
+
+    def _string(self, sid):
+        offsets = self._sections['stroff'][0]
+        start, end = struct.unpack_from('<II', self._map, offsets + sid * U32.size)
+        data = self._sections['strdata'][0]
+        return self._map[data + start:data + end].decode('utf-8')
+
+    def _strings(self, first, count):
+        base = self._sections['lists'][0] + first * U32.size
+        return tuple(self._string(sid) for sid in struct.unpack_from(f'<{count}I', self._map, base))
+
+    def sources(self):
+        return [(self._string(name), (mtime, size))
+                for name, mtime, size in (SOURCE.unpack_from(self._map, self._record_offset('sources', SOURCE, i))
+                                          for i in range(self._sections['sources'][1]))]
+
+    def is_fresh(self):
+        if not _same_directory(self.directory, self.built_from):
+            return False
+        for name, stamp in self.sources():
+            try:
+                if file_stamp(os.path.join(self.directory, name)) != stamp:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def feature_values(self):
+        # Interned (feature, value) pairs, in recommendation order
+        return [tuple(self._string(sid) for sid in FEATURE_VALUE.unpack_from(
+            self._map, self._record_offset('featvals', FEATURE_VALUE, i)))
+            for i in range(self._sections['featvals'][1])]
+
+    def _header(self, fields):
+        _, title, description, upos, xpos_first, xpos_count, _, _ = fields
+        return {
+            'title': self._string(title),
+            'description': self._string(description),
+            'upos': self._string(upos),
+            'xpos_tags': self._strings(xpos_first, xpos_count),
+        }
+
+    def __getitem__(self, analysis_key):
+        analysis = self._cache.get(analysis_key)
+        if analysis is None:
+            fields = ANALYSIS.unpack_from(self._map, self._record_offset('analyses', ANALYSIS, self._keys[analysis_key]))
+            analysis = self._header(fields)
+            analysis['scenarios'] = [self._scenario(i) for i in range(fields[6], fields[6] + fields[7])]
+            analysis = self._cache[analysis_key] = freeze(analysis)
+        return analysis
+
+    def _scenario(self, i):
+        context, question, rec_first, rec_count = SCENARIO.unpack_from(
+            self._map, self._record_offset('scenario', SCENARIO, i))
+        return {
+            'context': self._string(context),
+            'question': self._string(question),
+            'recommendations': [self._recommendation(r) for r in range(rec_first, rec_first + rec_count)],
+        }
+
+    def _recommendation(self, i):
+        (choice, xpos, feats, when, rules, ex_first, ex_count,
+         factor_first, factor_count, _, _) = RECOMMENDATION.unpack_from(
+            self._map, self._record_offset('recs', RECOMMENDATION, i))
+        return {
+            'choice': self._string(choice),
+            'xpos': self._string(xpos),
+            'feats': self._string(feats),
+            'when': self._string(when),
+            'examples': self._strings(ex_first, ex_count),
+            'morphological_rules': self._string(rules),
+            'decision_factors': self._strings(factor_first, factor_count),
+        }
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, analysis_key):
+        return analysis_key in self._keys
+
+    def headers(self):
+        if self._headers is None:
+            self._headers = {
+                key: freeze(self._header(ANALYSIS.unpack_from(self._map, self._record_offset('analyses', ANALYSIS, i))))
+                for key, i in self._keys.items()
+            }
+        return self._headers
+
+    def loaded(self):
+        return list(self._cache)
+
+    # A snapshot never changes under an open table
+
+    version = 0
+
+    def generation(self, analysis_key):
+        return 0
+
+    def poll(self, force=False):
+        return self.version
+
+
+def open_rule_table(directory=None, snapshot=None, language=None):
+    # The snapshot if it exists, was built from this language's rules and
+    # matches their sources, else the JSON rules
+    directory = directory or rules_dir(language)
+    snapshot = snapshot or default_snapshot_path(directory)
+    if os.path.exists(snapshot):
+        try:
+            table = SnapshotTable(snapshot, directory)
+        except (OSError, ValueError, struct.error):
+            table = None
+        if table is not None and table.is_fresh():
+            return table
+    return RuleTable(directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or inspect a compiled rules snapshot.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='compile a rules directory')
+    source = build.add_mutually_exclusive_group()
+    source.add_argument('--language', help='language whose rules are compiled (default: the default set)')
+    source.add_argument('--rules', help='rules directory')
+    build.add_argument('-o', '--output', help=f"snapshot path (default: RULES/{SNAPSHOT_NAME})")
+    info = commands.add_parser('info', help='describe a snapshot')
+    info.add_argument('path', nargs='?', default=default_snapshot_path())
+    info.add_argument('--rules', help='rules directory to check it against (default: the one it was built from)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        path = build_snapshot(args.rules, args.output, args.language)
+        print(f"wrote {path} ({os.path.getsize(path)} bytes)")
+        return 0
+
+    table = SnapshotTable(args.path, args.rules)
+    print(f"{args.path}: {len(table)} analyses, {os.path.getsize(args.path)} bytes, "
+          f"language {table.language} from {table.built_from}")
+    for name, (offset, count) in table._sections.items():
+        print(f"  {name:<10} {count:>8} records at {offset}")
+    print("  fresh" if table.is_fresh() else "  stale: sources changed since build")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
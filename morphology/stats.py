@@ -0,0 +1,180 @@
+"""Feature-distribution statistics over CoNLL-U corpora.
+
+Counts every UPOS x XPOS x FEATS combination with a map-reduce over a
+process pool: each block of sentences is counted into a ``Counter`` and
+the counters are summed per file. Per-file counts are cached under the
+SHA-256 of the file, so re-running over a growing corpus only counts new
+or changed files. The merged counts are then matched against the rule
+table once per distinct combination to give the tokens covered by each
+recommendation, the rules never observed and the observed combinations
+no rule allows.
+
+The report is written as JSON for the app, which only renders it.
+
+Usage: python -m morphology.stats FILE... [-o STATS.json] [-j WORKERS] [--cache-dir DIR]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from .conllu import FEATS, UPOS, XPOS, iter_tokens, read_blocks
+from .feats import VOCABULARY, feats_match, format_feats, parse_feats
+from .indexes import get_rule_index
+from .parallel import map_blocks
+from .table import iter_recommendations, load_complete_morphology_data
+
+STATS_NAME = 'xpomo_stats.json'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'xpomo', 'stats')
+
+
+def canonical_feats(feats):
+    return format_feats(parse_feats(feats))
+
+
+def count_sentences(sentences):
+    # (UPOS, XPOS, canonical FEATS) -> tokens
+    raw = Counter()
+    for sentence in sentences:
+        for _, fields in iter_tokens(sentence):
+            raw[fields[UPOS], fields[XPOS], fields[FEATS]] += 1
+    counts = Counter()
+    for (upos, xpos, feats), count in raw.items():
+        counts[upos, xpos, canonical_feats(feats)] += count
+    return counts
+
+
+def _count_block(path, sentences):
+    return path, count_sentences(sentences)
+
+
+def file_digest(path):
+    with open(path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{digest}.json")
+
+
+def _load_cached(cache_dir, digest):
+    try:
+        with open(_cache_path(cache_dir, digest), encoding='utf-8') as f:
+            return Counter({(upos, xpos, feats): count for upos, xpos, feats, count in json.load(f)['counts']})
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _store_cached(cache_dir, digest, counts):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, digest)
+    with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+        json.dump({'counts': [[*key, count] for key, count in counts.items()]}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def count_files(paths, workers=None, block_size=500, cache_dir=CACHE_DIR):
+    # Returns {path: (digest, Counter)}; only files missing from the cache are read
+    results = {}
+    digests = {path: file_digest(path) for path in paths}
+    todo = []
+    for path in digests:
+        cached = _load_cached(cache_dir, digests[path]) if cache_dir else None
+        if cached is None:
+            todo.append(path)
+        else:
+            results[path] = (digests[path], cached)
+    fresh = {path: Counter() for path in todo}
+    for path, counts in map_blocks(_count_block, read_blocks(todo, block_size), workers):
+        fresh[path].update(counts)
+    for path, counts in fresh.items():
+        if cache_dir:
+            _store_cached(cache_dir, digests[path], counts)
+        results[path] = (digests[path], counts)
+    return results
+
+
+def build_report(counts, files=(), index=None, decisions=None):
+    # Matches each distinct combination against the rules once
+    index = index if index is not None else get_rule_index()
+    decisions = decisions if decisions is not None else load_complete_morphology_data()
+    coverage = Counter()
+    unruled = []
+    upos_features = {}
+    for (upos, xpos, feats), count in counts.most_common():
+        token_mask = VOCABULARY.compile(feats)
+        matched = [c.id for c in index.compiled_for('xpos', xpos)
+                   if upos in c.upos and feats_match(c.mask, token_mask)]
+        for unique_id in matched:
+            coverage[unique_id] += count
+        if not matched:
+            unruled.append({'upos': upos, 'xpos': xpos, 'feats': feats, 'count': count})
+        by_feature = upos_features.setdefault(upos, {})
+        for name, values in parse_feats(feats):
+            for value in values:
+                by_value = by_feature.setdefault(name, {})
+                by_value[value] = by_value.get(value, 0) + count
+
+    rules = []
+    for unique_id, analysis, _, rec in iter_recommendations(decisions):
+        rules.append({'id': unique_id, 'upos': analysis['upos'], 'xpos': rec['xpos'], 'feats': rec['feats'],
+                      'choice': rec['choice'], 'count': coverage[unique_id]})
+    return {
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'tokens': sum(counts.values()),
+        'files': list(files),
+        'combinations': [{'upos': upos, 'xpos': xpos, 'feats': feats, 'count': count}
+                         for (upos, xpos, feats), count in counts.most_common()],
+        'upos_features': upos_features,
+        'coverage': rules,
+        'unobserved_rules': [rule['id'] for rule in rules if not rule['count']],
+        'unruled': unruled,
+    }
+
+
+def load_report(path=STATS_NAME):
+    # The report written by main(), or None when there is none yet
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count UPOS x XPOS x FEATS combinations and rule coverage.")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('-o', '--output', default=STATS_NAME, help=f"report path (default: {STATS_NAME})")
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='per-file count cache')
+    parser.add_argument('--no-cache', action='store_true', help='count every file, ignoring the cache')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    per_file = count_files(args.files, args.workers, args.block_size, None if args.no_cache else args.cache_dir)
+    total = Counter()
+    files = []
+    for path in dict.fromkeys(args.files):
+        digest, counts = per_file[path]
+        total.update(counts)
+        files.append({'path': path, 'sha256': digest, 'tokens': sum(counts.values())})
+    report = build_report(total, files)
+    with open(f"{args.output}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=1)
+    os.replace(f"{args.output}.tmp", args.output)
+    elapsed = time.perf_counter() - started
+
+    print(f"{report['tokens']} tokens in {len(files)} files, {len(report['combinations'])} combinations "
+          f"in {elapsed:.2f}s: {len(report['unobserved_rules'])} rules never observed, "
+          f"{len(report['unruled'])} combinations without a rule", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
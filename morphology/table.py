@@ -0,0 +1,234 @@
+"""Decision table for the UD morphological decision support tool.
+
+``rules/`` holds the default rule set; each subdirectory with its own
+``index.json`` is the rule set of one language (e.g. ``rules/hi/``). Every
+language gets its own lazily loaded table, while tags, feature names and
+values are interned so that languages loaded side by side share them.
+"""
+
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from functools import lru_cache
+from sys import intern
+from types import MappingProxyType
+
+RULES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rules')
+
+# The rule set at the top of RULES_DIR
+DEFAULT_LANGUAGE = 'default'
+
+# Fields whose strings repeat across analyses and languages
+INTERNED_FIELDS = frozenset({'upos', 'xpos', 'xpos_tags', 'feats'})
+
+
+def freeze(value, interned=False):
+    # Dicts become read-only mapping proxies and lists become tuples, so one
+    # table can be shared by every session without defensive copies. Keys
+    # and tag/FEATS strings are interned, one copy for all rule sets.
+    if isinstance(value, dict):
+        return MappingProxyType({intern(k): freeze(v, k in INTERNED_FIELDS) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v, interned) for v in value)
+    if interned and isinstance(value, str):
+        return intern(value)
+    return value
+
+
+class RuleTable(Mapping):
+    # Read-only mapping of analysis key -> frozen analysis, backed by a rules
+    # directory. index.json lists the analyses in order with their headers
+    # (title, description, upos, xpos_tags); each analysis file holds its
+    # scenarios and is read only when that analysis is first accessed.
+    # Files are re-stat'ed at most once per check_interval and changed ones
+    # are reloaded; generation(key) changes whenever an analysis is reloaded
+    # so dependent indexes can rebuild just that analysis.
+
+    def __init__(self, directory=RULES_DIR, check_interval=1.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.version = 0
+        self._lock = threading.RLock()
+        self._manifest_stamp = None
+        self._headers = {}
+        self._files = {}
+        self._loaded = {}
+        self._generations = {}
+        self._last_poll = float('-inf')
+        with self._lock:
+            self._load_manifest()
+
+    def __getitem__(self, analysis_key):
+        self.poll()
+        analysis = self._loaded.get(analysis_key)
+        if analysis is None:
+            with self._lock:
+                analysis = self._loaded.get(analysis_key)
+                if analysis is None:
+                    analysis = self._load_analysis(analysis_key)
+        return analysis[1]
+
+    def __iter__(self):
+        return iter(list(self._headers))
+
+    def __len__(self):
+        return len(self._headers)
+
+    def __contains__(self, analysis_key):
+        return analysis_key in self._headers
+
+    def headers(self):
+        # Titles, UPOS and XPOS tags for every analysis without loading scenarios
+        self.poll()
+        return self._headers
+
+    def loaded(self):
+        return list(self._loaded)
+
+    def sources(self):
+        # The manifest followed by each analysis file, in table order
+        return [self._manifest_path()] + [self._files[key] for key in self._headers]
+
+    def generation(self, analysis_key):
+        return self._generations.get(analysis_key, 0)
+
+    def poll(self, force=False):
+        # Cheap stat-based change check; returns the table version
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.check_interval:
+            return self.version
+        with self._lock:
+            self._last_poll = now
+            if file_stamp(self._manifest_path()) != self._manifest_stamp:
+                self._load_manifest()
+            for analysis_key, (stamp, _) in list(self._loaded.items()):
+                if file_stamp(self._files[analysis_key]) != stamp:
+                    self._invalidate(analysis_key)
+        return self.version
+
+    def _manifest_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _invalidate(self, analysis_key):
+        self._loaded.pop(analysis_key, None)
+        self._generations[analysis_key] = self.generation(analysis_key) + 1
+        self.version += 1
+
+    def _load_manifest(self):
+        path = self._manifest_path()
+        stamp = file_stamp(path)
+        with open(path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        headers = {}
+        files = {}
+        for entry in manifest['analyses']:
+            entry = dict(entry)
+            analysis_key = entry.pop('key')
+            files[analysis_key] = os.path.join(self.directory, entry.pop('file'))
+            headers[analysis_key] = freeze(entry)
+        for analysis_key in set(self._headers) | set(headers):
+            if self._headers.get(analysis_key) != headers.get(analysis_key) or \
+                    self._files.get(analysis_key) != files.get(analysis_key):
+                self._invalidate(analysis_key)
+        self._headers = headers
+        self._files = files
+        self._manifest_stamp = stamp
+        self.version += 1
+
+    def _load_analysis(self, analysis_key):
+        path = self._files[analysis_key]
+        stamp = file_stamp(path)
+        with open(path, encoding='utf-8') as f:
+            body = json.load(f)
+        analysis = freeze({**self._headers[analysis_key], **body})
+        self._loaded[analysis_key] = (stamp, analysis)
+        return stamp, analysis
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+def build_morphology_data(directory=RULES_DIR):
+    # Plain, mutable copy of a whole rules directory
+    table = RuleTable(directory)
+    return {key: thaw(table[key]) for key in table}
+
+
+def thaw(value):
+    if isinstance(value, Mapping):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+def available_languages(directory=RULES_DIR):
+    # The default rule set, then every language subdirectory with an index.json
+    languages = [DEFAULT_LANGUAGE]
+    with os.scandir(directory) as entries:
+        languages.extend(sorted(entry.name for entry in entries
+                                if entry.is_dir() and entry.name != DEFAULT_LANGUAGE
+                                and os.path.isfile(os.path.join(entry.path, 'index.json'))))
+    return languages
+
+
+def rules_dir(language=None, directory=RULES_DIR):
+    language = language or DEFAULT_LANGUAGE
+    if language not in available_languages(directory):
+        raise KeyError(f"no rules for language {language!r}")
+    return directory if language == DEFAULT_LANGUAGE else os.path.join(directory, language)
+
+
+def load_complete_morphology_data(language=None):
+    # One lazily loaded, hot-reloading table per language and process,
+    # shared by every caller; other languages are never read
+    return _rule_table(language or DEFAULT_LANGUAGE)
+
+
+@lru_cache(maxsize=None)
+def _rule_table(language):
+    return RuleTable(rules_dir(language))
+
+
+def recommendation_id(analysis_key, scenario_idx, rec_idx):
+    return f"{analysis_key}_{scenario_idx}_{rec_idx}"
+
+
+def parse_recommendation_id(unique_id):
+    analysis_key, scenario_idx, rec_idx = unique_id.rsplit('_', 2)
+    return analysis_key, int(scenario_idx), int(rec_idx)
+
+
+def iter_recommendations(decisions):
+    # Yields (id, analysis, scenario, recommendation) in table order
+    for key, analysis in decisions.items():
+        for scenario_idx, scenario in enumerate(analysis['scenarios']):
+            for rec_idx, rec in enumerate(scenario['recommendations']):
+                yield recommendation_id(key, scenario_idx, rec_idx), analysis, scenario, rec
+
+
+def build_recommendation_record(decisions, unique_id):
+    # Flat record used for selections and export
+    analysis_key, scenario_idx, rec_idx = parse_recommendation_id(unique_id)
+    decision_data = decisions[analysis_key]
+    scenario = decision_data['scenarios'][scenario_idx]
+    rec = scenario['recommendations'][rec_idx]
+    return {
+        'id': unique_id,
+        'decision_type': decision_data['title'],
+        'upos': decision_data['upos'],
+        'context': scenario['context'],
+        'question': scenario['question'],
+        'choice': rec['choice'],
+        'xpos': rec['xpos'],
+        'feats': rec['feats'],
+        'when': rec['when'],
+        'examples': rec['examples'],
+        'rules': rec['morphological_rules'],
+        'decision_factors': rec.get('decision_factors', ()),
+        'xpos_tags': decision_data['xpos_tags']
+    }
@@ -0,0 +1,164 @@
+"""Check CoNLL-U tokens against the rule table.
+
+Every token's UPOS/XPOS/FEATS triple is compared with the recommendations
+for its XPOS; combinations no rule allows are reported. Files are streamed
+sentence by sentence and blocks of sentences are sharded across a process
+pool, with a bounded number of blocks in flight so memory stays constant.
+
+Usage: python -m morphology.validate FILE... [-j WORKERS] [--block-size N] [--snapshot PATH] [--language LANG]
+"""
+
+import argparse
+import sys
+import time
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+from .conllu import FEATS, FORM, ID, UPOS, XPOS, iter_tokens, read_blocks
+from .feats import VOCABULARY, feats_match, parse_feats
+from .indexes import RuleIndex, get_rule_index
+from .parallel import map_blocks
+from .snapshot import open_rule_table
+
+Issue = namedtuple('Issue', 'path line token_id form upos xpos feats kind message')
+
+# Issue kinds
+UNKNOWN_XPOS = 'unknown-xpos'
+UPOS_MISMATCH = 'upos-mismatch'
+FEATS_NOT_ALLOWED = 'feats-not-allowed'
+
+
+def _describe_mismatch(rule_feats, token_feats):
+    token = dict(token_feats)
+    problems = []
+    for name, allowed in rule_feats:
+        values = token.get(name)
+        if values is None:
+            problems.append(f"missing {name}")
+        elif not values <= allowed:
+            problems.append(f"{name}={','.join(sorted(values - allowed))} not in {'/'.join(sorted(allowed))}")
+    return problems
+
+
+class TokenChecker:
+    # Results are memoised per (upos, xpos, feats) triple: corpora repeat a
+    # few thousand distinct triples millions of times. Long-running callers
+    # pass cache_size to bound the memo as an LRU. Token FEATS are looked
+    # up without adding their features or values to the vocabulary.
+
+    def __init__(self, index=None, vocabulary=VOCABULARY, cache_size=None):
+        self._index = index if index is not None else get_rule_index()
+        self._vocabulary = vocabulary
+        self._cache = {}
+        if cache_size is not None:
+            self.check = lru_cache(maxsize=cache_size)(self._check)
+
+    def check(self, upos, xpos, feats):
+        key = (upos, xpos, feats)
+        try:
+            return self._cache[key]
+        except KeyError:
+            result = self._cache[key] = self._check(upos, xpos, feats)
+            return result
+
+    def _check(self, upos, xpos, feats):
+        candidates = self._index.compiled_for('xpos', xpos)
+        if not candidates:
+            return UNKNOWN_XPOS, f"no rule for XPOS {xpos}"
+        candidates = [c for c in candidates if upos in c.upos]
+        if not candidates:
+            return UPOS_MISMATCH, f"no rule for {upos} {xpos}"
+        token_mask = self._vocabulary.lookup(feats)
+        if any(feats_match(c.mask, token_mask) for c in candidates):
+            return None
+        # Report the closest candidate
+        token_feats = parse_feats(feats)
+        problems = min((_describe_mismatch(c.feats, token_feats) for c in candidates), key=len)
+        return FEATS_NOT_ALLOWED, f"{xpos}: {'; '.join(problems)}"
+
+
+def validate_sentences(sentences, path='-', checker=None):
+    # Yields (token count, issues) per sentence
+    checker = checker or TokenChecker()
+    for sentence in sentences:
+        count = 0
+        issues = []
+        for line, fields in iter_tokens(sentence):
+            count += 1
+            result = checker.check(fields[UPOS], fields[XPOS], fields[FEATS])
+            if result is not None:
+                issues.append(Issue(path, line, fields[ID], fields[FORM], fields[UPOS],
+                                    fields[XPOS], fields[FEATS], *result))
+        yield count, issues
+
+
+def _checker(snapshot=None, language=None):
+    # With a snapshot, rules come from the shared mapped file when it is
+    # fresh for the language's rules
+    if snapshot is None:
+        return TokenChecker(get_rule_index(language))
+    return TokenChecker(RuleIndex(open_rule_table(snapshot=snapshot, language=language)))
+
+
+_worker_checker = None
+
+
+def _init_worker(snapshot, language):
+    global _worker_checker
+    _worker_checker = _checker(snapshot, language)
+
+
+def _validate_block(path, sentences):
+    # Runs in a worker process set up by _init_worker
+    tokens = 0
+    issues = []
+    for count, found in validate_sentences(sentences, path, _worker_checker):
+        tokens += count
+        issues.extend(found)
+    return tokens, issues
+
+
+def validate_files(paths, workers=None, block_size=500, snapshot=None, language=None):
+    # Yields (token count, issues) per block of sentences, in input order
+    return map_blocks(_validate_block, read_blocks(paths, block_size), workers, _init_worker, (snapshot, language))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check CoNLL-U tokens against the rule table.")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='worker processes (default: CPU count)')
+    parser.add_argument('--block-size', type=int, default=500, help='sentences per work unit')
+    parser.add_argument('--snapshot', metavar='PATH',
+                        help='compiled rules snapshot, used when it matches the rule sources')
+    parser.add_argument('--language', help='rule set to check against (default: the default set)')
+    parser.add_argument('--ignore', action='append', default=[], metavar='KIND',
+                        help=f"issue kind to skip, e.g. {UNKNOWN_XPOS}")
+    parser.add_argument('--summary-only', action='store_true', help='print only the summary')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    tokens = 0
+    kinds = Counter()
+    out = sys.stdout
+    for count, issues in validate_files(args.files, args.workers, args.block_size, args.snapshot,
+                                           args.language):
+        tokens += count
+        for issue in issues:
+            if issue.kind in args.ignore:
+                continue
+            kinds[issue.kind] += 1
+            if not args.summary_only:
+                out.write(f"{issue.path}:{issue.line}\t{issue.form}\t{issue.upos}\t{issue.xpos}\t"
+                          f"{issue.feats}\t{issue.kind}\t{issue.message}\n")
+    elapsed = time.perf_counter() - started
+
+    rate = tokens / elapsed if elapsed else 0.0
+    print(f"{tokens} tokens, {sum(kinds.values())} issues in {elapsed:.2f}s ({rate:,.0f} tokens/sec)",
+          file=sys.stderr)
+    for kind, count in kinds.most_common():
+        print(f"  {kind}: {count}", file=sys.stderr)
+    return 1 if kinds else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
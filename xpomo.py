@@ -1,6 +1,31 @@
+import io
+import os
+import tempfile
+import uuid
+
 import streamlit as st
-import json
-from datetime import datetime
+
+from morphology import (
+    FORMATS,
+    ExportCache,
+    SelectionStore,
+    build_recommendation_record,
+    generate_copy_text,
+    get_rule_index,
+    load_complete_morphology_data,
+    parse_recommendation_id,
+    recommendation_id,
+    write_export,
+)
+from morphology.export import FILE_EXTENSIONS, MIME_TYPES
+from morphology.instrument import NULL_PROFILE, STATS, RerunProfile, enable_log
+from morphology.lexicon import Lexicon, LexiconBuilder, lexicon_name
+from morphology.matrix import COLUMNS, MATRIX_FORMATS, get_feature_matrix, matrix_text, pivot, records
+from morphology.review import REVIEW_NAME, ReviewQueue
+from morphology.search import search
+from morphology.sessions import PersistentSelectionStore, SessionDB
+from morphology.stats import STATS_NAME, load_report
+from morphology.table import DEFAULT_LANGUAGE, available_languages
 
 # Configure page
 st.set_page_config(
@@ -10,705 +35,620 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Complete UD morphological data
-@st.cache_data
-def load_complete_morphology_data():
-    return {
-        'NOUN_analysis': {
-            'title': 'NOUN Complete Analysis (NN, NNP, NNS)',
-            'description': 'Comprehensive noun selection with all morphological features',
-            'upos': 'NOUN',
-            'xpos_tags': ['NN', 'NNP', 'NNS'],
-            'scenarios': [
-                {
-                    'context': 'Number and Case Selection',
-                    'question': 'Which noun form should I use?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use NN (Singular Nominative)',
-                            'xpos': 'NN',
-                            'feats': 'Number=Sing | Case=Nom | Gender=Masc/Fem/Neut',
-                            'when': 'For singular subjects',
-                            'examples': [
-                                'The cat sleeps (cat=NN, Number=Sing, Case=Nom)',
-                                'A student reads (student=NN, Number=Sing, Case=Nom)',
-                                'This house stands (house=NN, Number=Sing, Case=Nom)'
-                            ],
-                            'morphological_rules': 'NN: Number=Sing | Case=Nom | Gender=M/F/N',
-                            'decision_factors': ['Subject position', 'Singular verb', 'No object marking']
-                        },
-                        {
-                            'choice': 'Use NNS (Plural Nominative)',
-                            'xpos': 'NNS',
-                            'feats': 'Number=Plur | Case=Acc',
-                            'when': 'For plural objects',
-                            'examples': [
-                                'I see cats (cats=NNS, Number=Plur, Case=Acc)',
-                                'She reads books (books=NNS, Number=Plur, Case=Acc)',
-                                'They built houses (houses=NNS, Number=Plur, Case=Acc)'
-                            ],
-                            'morphological_rules': 'NNS: Number=Plur | Case=Acc',
-                            'decision_factors': ['Object position', 'Plural form', 'Accusative case']
-                        },
-                        {
-                            'choice': 'Use NNP (Proper Noun)',
-                            'xpos': 'NNP',
-                            'feats': 'Number=Sing | Case=Nom',
-                            'when': 'For names and proper nouns',
-                            'examples': [
-                                'John works here (John=NNP, Number=Sing, Case=Nom)',
-                                'Paris is beautiful (Paris=NNP, Number=Sing, Case=Nom)',
-                                'Microsoft announced (Microsoft=NNP, Number=Sing, Case=Nom)'
-                            ],
-                            'morphological_rules': 'NNP: Number=Sing | Case=Nom',
-                            'decision_factors': ['Proper name', 'Capitalized', 'Unique reference']
-                        }
-                    ]
-                }
-            ]
-        },
-        'VERB_analysis': {
-            'title': 'VERB Complete Analysis (VM, VINF, VAUX)',
-            'description': 'Comprehensive verb selection with tense, mood, honorificity',
-            'upos': 'VERB',
-            'xpos_tags': ['VM', 'VINF', 'VAUX'],
-            'scenarios': [
-                {
-                    'context': 'Finite Verb Forms',
-                    'question': 'Which finite verb form should I use?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use VM (Present Finite)',
-                            'xpos': 'VM',
-                            'feats': 'VerbForm=Fin | Tense=Pres/Past/Fut | Person=1/2/3',
-                            'when': 'For main verbs showing tense and person',
-                            'examples': [
-                                'I walk daily (walk=VM, VerbForm=Fin, Tense=Pres, Person=1)',
-                                'She walks fast (walks=VM, VerbForm=Fin, Tense=Pres, Person=3)',
-                                'They walked yesterday (walked=VM, VerbForm=Fin, Tense=Past)'
-                            ],
-                            'morphological_rules': 'VM: VerbForm=Fin | Tense=Pres/Past/Fut | Person=1/2/3',
-                            'decision_factors': ['Main verb', 'Shows tense', 'Person agreement']
-                        },
-                        {
-                            'choice': 'Use VINF (Infinitive)',
-                            'xpos': 'VINF',
-                            'feats': 'VerbForm=Inf',
-                            'when': 'For infinitive forms',
-                            'examples': [
-                                'I want to walk (walk=VINF, VerbForm=Inf)',
-                                'She can walk (walk=VINF, VerbForm=Inf)',
-                                'They need to go (go=VINF, VerbForm=Inf)'
-                            ],
-                            'morphological_rules': 'VINF: VerbForm=Inf',
-                            'decision_factors': ['After modals', 'To + verb', 'No tense marking']
-                        },
-                        {
-                            'choice': 'Use VAUX (Auxiliary)',
-                            'xpos': 'VAUX',
-                            'feats': 'Mood=Ind | VerbForm=Part',
-                            'when': 'For auxiliary verbs',
-                            'examples': [
-                                'He has walked (has=VAUX, Mood=Ind)',
-                                'She is walking (is=VAUX, VerbForm=Part)',
-                                'They were seen (were=VAUX, VerbForm=Part)'
-                            ],
-                            'morphological_rules': 'VAUX: Mood=Ind | VerbForm=Part',
-                            'decision_factors': ['Helper verb', 'Compound tense', 'Passive construction']
-                        }
-                    ]
-                },
-                {
-                    'context': 'Honorificity in Verbs',
-                    'question': 'Should I use honorific verb forms?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use VM (Honorific)',
-                            'xpos': 'VM',
-                            'feats': 'VerbForm=Fin | Honorificity=Yes',
-                            'when': 'When showing respect to subject/addressee',
-                            'examples': [
-                                'The professor teaches (teaches=VM, Honorificity=Yes)',
-                                'Please come, sir (come=VM, Honorificity=Yes)',
-                                'May I help you? (help=VM, Honorificity=Yes)'
-                            ],
-                            'morphological_rules': 'VM: VerbForm=Fin | Honorificity=Yes',
-                            'decision_factors': ['Respectful context', 'Formal situation', 'Superior status']
-                        },
-                        {
-                            'choice': 'Use VM (Non-Honorific)',
-                            'xpos': 'VM',
-                            'feats': 'VerbForm=Fin | Honorificity=No',
-                            'when': 'For casual or equal-status contexts',
-                            'examples': [
-                                'My friend walks (walks=VM, Honorificity=No)',
-                                'Kids play outside (play=VM, Honorificity=No)',
-                                'We eat lunch (eat=VM, Honorificity=No)'
-                            ],
-                            'morphological_rules': 'VM: VerbForm=Fin | Honorificity=No',
-                            'decision_factors': ['Casual context', 'Equal status', 'Informal setting']
-                        }
-                    ]
-                }
-            ]
-        },
-        'ADVERB_analysis': {
-            'title': 'ADVERB Complete Analysis (RB)',
-            'description': 'Complete adverb selection with semantic types and degrees',
-            'upos': 'ADV',
-            'xpos_tags': ['RB'],
-            'scenarios': [
-                {
-                    'context': 'Adverb Semantic Types',
-                    'question': 'Which semantic type of adverb?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use RB (Manner)',
-                            'xpos': 'RB',
-                            'feats': 'Degree=Pos | AdvType=Manner',
-                            'when': 'For describing how actions are performed',
-                            'examples': [
-                                'She walks quickly (quickly=RB, AdvType=Manner)',
-                                'He speaks softly (softly=RB, AdvType=Manner)',
-                                'They work carefully (carefully=RB, AdvType=Manner)'
-                            ],
-                            'morphological_rules': 'RB: Degree=Pos | AdvType=Manner',
-                            'decision_factors': ['How question', 'Action modification', 'Process description']
-                        },
-                        {
-                            'choice': 'Use RB (Temporal)',
-                            'xpos': 'RB',
-                            'feats': 'Degree=Pos | AdvType=Temporal',
-                            'when': 'For indicating when actions occur',
-                            'examples': [
-                                'She arrived yesterday (yesterday=RB, AdvType=Temporal)',
-                                'He always comes early (always=RB, AdvType=Temporal)',
-                                'They will leave soon (soon=RB, AdvType=Temporal)'
-                            ],
-                            'morphological_rules': 'RB: Degree=Pos | AdvType=Temporal',
-                            'decision_factors': ['When question', 'Time reference', 'Temporal sequence']
-                        },
-                        {
-                            'choice': 'Use RB (Locative)',
-                            'xpos': 'RB',
-                            'feats': 'Degree=Pos | AdvType=Locative',
-                            'when': 'For indicating where actions occur',
-                            'examples': [
-                                'She works here (here=RB, AdvType=Locative)',
-                                'He lives nearby (nearby=RB, AdvType=Locative)',
-                                'They went upstairs (upstairs=RB, AdvType=Locative)'
-                            ],
-                            'morphological_rules': 'RB: Degree=Pos | AdvType=Locative',
-                            'decision_factors': ['Where question', 'Location reference', 'Spatial relation']
-                        },
-                        {
-                            'choice': 'Use RB (Frequentative)',
-                            'xpos': 'RB',
-                            'feats': 'Degree=Pos | AdvType=Frequentative',
-                            'when': 'For indicating how often actions occur',
-                            'examples': [
-                                'She often visits (often=RB, AdvType=Frequentative)',
-                                'He rarely complains (rarely=RB, AdvType=Frequentative)',
-                                'They always help (always=RB, AdvType=Frequentative)'
-                            ],
-                            'morphological_rules': 'RB: Degree=Pos | AdvType=Frequentative',
-                            'decision_factors': ['How often', 'Frequency indication', 'Habitual pattern']
-                        },
-                        {
-                            'choice': 'Use RB (Resultative)',
-                            'xpos': 'RB',
-                            'feats': 'Degree=Pos | AdvType=Resultative',
-                            'when': 'For indicating results or outcomes',
-                            'examples': [
-                                'Door opened completely (completely=RB, AdvType=Resultative)',
-                                'She finished successfully (successfully=RB, AdvType=Resultative)',
-                                'They solved it perfectly (perfectly=RB, AdvType=Resultative)'
-                            ],
-                            'morphological_rules': 'RB: Degree=Pos | AdvType=Resultative',
-                            'decision_factors': ['End state', 'Completion degree', 'Result emphasis']
-                        }
-                    ]
-                }
-            ]
-        },
-        'PRONOUN_analysis': {
-            'title': 'PRONOUN Complete Analysis (PRP, V_PRON-HON)',
-            'description': 'Complete pronoun selection with honorificity and case',
-            'upos': 'PRON',
-            'xpos_tags': ['PRP', 'V_PRON-HON'],
-            'scenarios': [
-                {
-                    'context': 'Person and Case Selection',
-                    'question': 'Which pronoun form should I use?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use PRP (1st Person Nom)',
-                            'xpos': 'PRP',
-                            'feats': 'Person=1 | Number=Sing | Case=Nom | Honorificity=No',
-                            'when': 'For first person subjects',
-                            'examples': [
-                                'I am walking (I=PRP, Person=1, Case=Nom)',
-                                'I can help (I=PRP, Person=1, Case=Nom)',
-                                'I understand (I=PRP, Person=1, Case=Nom)'
-                            ],
-                            'morphological_rules': 'PRP: Person=1 | Number=Sing | Case=Nom',
-                            'decision_factors': ['Speaker reference', 'Subject position', 'First person']
-                        },
-                        {
-                            'choice': 'Use PRP (2nd Person Acc)',
-                            'xpos': 'PRP',
-                            'feats': 'Person=2 | Number=Sing | Case=Acc | Honorificity=No',
-                            'when': 'For second person objects',
-                            'examples': [
-                                'I help you (you=PRP, Person=2, Case=Acc)',
-                                'She called you (you=PRP, Person=2, Case=Acc)',
-                                'They invited you (you=PRP, Person=2, Case=Acc)'
-                            ],
-                            'morphological_rules': 'PRP: Person=2 | Number=Sing | Case=Acc',
-                            'decision_factors': ['Addressee reference', 'Object position', 'Casual context']
-                        }
-                    ]
-                },
-                {
-                    'context': 'Honorificity in Pronouns',
-                    'question': 'Should I use honorific pronouns?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use V_PRON-HON (Honorific)',
-                            'xpos': 'V_PRON-HON',
-                            'feats': 'Person=2/3 | Case=Nom/Acc | Honorificity=Yes',
-                            'when': 'When showing respect to addressee/referent',
-                            'examples': [
-                                'You are kind, sir (You=V_PRON-HON, Honorificity=Yes)',
-                                'May I help you? (you=V_PRON-HON, Honorificity=Yes)',
-                                'His Excellency arrived (His=V_PRON-HON, Honorificity=Yes)'
-                            ],
-                            'morphological_rules': 'V_PRON-HON: Person=2/3 | Honorificity=Yes',
-                            'decision_factors': ['Respectful address', 'Formal context', 'High status person']
-                        },
-                        {
-                            'choice': 'Use PRP (Non-Honorific)',
-                            'xpos': 'PRP',
-                            'feats': 'Person=1/2/3 | Case=Nom/Acc | Honorificity=No',
-                            'when': 'For casual or equal-status contexts',
-                            'examples': [
-                                'You can sit here (you=PRP, Honorificity=No)',
-                                'He is my friend (he=PRP, Honorificity=No)',
-                                'They are students (they=PRP, Honorificity=No)'
-                            ],
-                            'morphological_rules': 'PRP: Person=1/2/3 | Honorificity=No',
-                            'decision_factors': ['Equal status', 'Informal context', 'Casual relationship']
-                        }
-                    ]
-                }
-            ]
-        },
-        'CONJUNCTION_analysis': {
-            'title': 'CONJUNCTION Complete Analysis (CC, SC)',
-            'description': 'Complete conjunction selection with coordination types',
-            'upos': 'CCONJ/SCONJ',
-            'xpos_tags': ['CC', 'SC'],
-            'scenarios': [
-                {
-                    'context': 'Coordination Types',
-                    'question': 'Which coordination type should I use?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use CC (Coordinating)',
-                            'xpos': 'CC',
-                            'feats': 'ConjType=Coordinating',
-                            'when': 'For connecting equal elements',
-                            'examples': [
-                                'John and Mary (and=CC, ConjType=Coordinating)',
-                                'Run or walk (or=CC, ConjType=Coordinating)',
-                                'Smart but lazy (but=CC, ConjType=Coordinating)'
-                            ],
-                            'morphological_rules': 'CC: ConjType=Coordinating',
-                            'decision_factors': ['Equal elements', 'Same level', 'Addition/contrast']
-                        },
-                        {
-                            'choice': 'Use CC (Correlative)',
-                            'xpos': 'CC',
-                            'feats': 'ConjType=Correlative',
-                            'when': 'For paired conjunctions',
-                            'examples': [
-                                'Both John and Mary (both...and=CC, ConjType=Correlative)',
-                                'Either run or walk (either...or=CC, ConjType=Correlative)',
-                                'Neither smart nor lazy (neither...nor=CC, ConjType=Correlative)'
-                            ],
-                            'morphological_rules': 'CC: ConjType=Correlative',
-                            'decision_factors': ['Paired conjunctions', 'Emphasis', 'Binary choice']
-                        },
-                        {
-                            'choice': 'Use SC (Subordinating)',
-                            'xpos': 'SC',
-                            'feats': 'ConjType=Subordinating',
-                            'when': 'For dependent clauses',
-                            'examples': [
-                                'Because he was tired (because=SC, ConjType=Subordinating)',
-                                'When she arrives (when=SC, ConjType=Subordinating)',
-                                'If you want (if=SC, ConjType=Subordinating)'
-                            ],
-                            'morphological_rules': 'SC: ConjType=Subordinating',
-                            'decision_factors': ['Dependent clause', 'Subordination', 'Hierarchy']
-                        }
-                    ]
-                }
-            ]
-        },
-        'DETERMINER_analysis': {
-            'title': 'DETERMINER Complete Analysis (DT)',
-            'description': 'Complete determiner selection with definiteness and deixis',
-            'upos': 'DET',
-            'xpos_tags': ['DT'],
-            'scenarios': [
-                {
-                    'context': 'Article vs Demonstrative',
-                    'question': 'Should I use article or demonstrative?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use DT (Article)',
-                            'xpos': 'DT',
-                            'feats': 'PronType=Art',
-                            'when': 'For definite/indefinite articles',
-                            'examples': [
-                                'The book is here (the=DT, PronType=Art)',
-                                'A cat is sleeping (a=DT, PronType=Art)',
-                                'An apple fell (an=DT, PronType=Art)'
-                            ],
-                            'morphological_rules': 'DT: PronType=Art',
-                            'decision_factors': ['General reference', 'Definiteness', 'First/repeated mention']
-                        },
-                        {
-                            'choice': 'Use DT (Demonstrative)',
-                            'xpos': 'DT',
-                            'feats': 'PronType=Dem',
-                            'when': 'For pointing to specific items',
-                            'examples': [
-                                'This book is mine (this=DT, PronType=Dem)',
-                                'That car is fast (that=DT, PronType=Dem)',
-                                'These ideas are good (these=DT, PronType=Dem)'
-                            ],
-                            'morphological_rules': 'DT: PronType=Dem',
-                            'decision_factors': ['Specific pointing', 'Distance indication', 'Contextual reference']
-                        }
-                    ]
-                }
-            ]
-        },
-        'PREPOSITION_analysis': {
-            'title': 'PREPOSITION Complete Analysis (IN)',
-            'description': 'Complete preposition selection with case government',
-            'upos': 'ADP',
-            'xpos_tags': ['IN'],
-            'scenarios': [
-                {
-                    'context': 'Case Government',
-                    'question': 'Which case should this preposition govern?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use IN (Locative)',
-                            'xpos': 'IN',
-                            'feats': 'Case=Loc',
-                            'when': 'For location and time',
-                            'examples': [
-                                'In the house (in=IN, Case=Loc)',
-                                'At the store (at=IN, Case=Loc)',
-                                'On the table (on=IN, Case=Loc)'
-                            ],
-                            'morphological_rules': 'IN: Case=Loc',
-                            'decision_factors': ['Static location', 'Time periods', 'Containment']
-                        },
-                        {
-                            'choice': 'Use IN (Instrumental)',
-                            'xpos': 'IN',
-                            'feats': 'Case=Ins',
-                            'when': 'For instrument or means',
-                            'examples': [
-                                'With a hammer (with=IN, Case=Ins)',
-                                'By train (by=IN, Case=Ins)',
-                                'Through hard work (through=IN, Case=Ins)'
-                            ],
-                            'morphological_rules': 'IN: Case=Ins',
-                            'decision_factors': ['Instrument', 'Means', 'Method']
-                        }
-                    ]
-                }
-            ]
-        },
-        'NUMBER_analysis': {
-            'title': 'NUMBER Complete Analysis (CD)',
-            'description': 'Complete number selection with cardinal/ordinal types',
-            'upos': 'NUM',
-            'xpos_tags': ['CD'],
-            'scenarios': [
-                {
-                    'context': 'Number Type Selection',
-                    'question': 'Should I use cardinal or ordinal?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use CD (Cardinal)',
-                            'xpos': 'CD',
-                            'feats': 'NumType=Card',
-                            'when': 'For counting or quantity',
-                            'examples': [
-                                'Three books (three=CD, NumType=Card)',
-                                'Five cats (five=CD, NumType=Card)',
-                                'Ten dollars (ten=CD, NumType=Card)'
-                            ],
-                            'morphological_rules': 'CD: NumType=Card',
-                            'decision_factors': ['Counting', 'Quantity', 'Amount']
-                        },
-                        {
-                            'choice': 'Use CD (Ordinal)',
-                            'xpos': 'CD',
-                            'feats': 'NumType=Ord',
-                            'when': 'For ordering or ranking',
-                            'examples': [
-                                'Third place (third=CD, NumType=Ord)',
-                                'First time (first=CD, NumType=Ord)',
-                                'Fifth floor (fifth=CD, NumType=Ord)'
-                            ],
-                            'morphological_rules': 'CD: NumType=Ord',
-                            'decision_factors': ['Ordering', 'Ranking', 'Sequence']
-                        }
-                    ]
-                }
-            ]
-        },
-        'PARTICLE_analysis': {
-            'title': 'PARTICLE Complete Analysis (RP)',
-            'description': 'Complete particle selection with polarity',
-            'upos': 'PART',
-            'xpos_tags': ['RP'],
-            'scenarios': [
-                {
-                    'context': 'Polarity Selection',
-                    'question': 'Should I use negative or positive particle?',
-                    'recommendations': [
-                        {
-                            'choice': 'Use RP (Negative)',
-                            'xpos': 'RP',
-                            'feats': 'Polarity=Neg',
-                            'when': 'For negative particles',
-                            'examples': [
-                                'Not going (not=RP, Polarity=Neg)',
-                                'Never again (never=RP, Polarity=Neg)',
-                                "Don't do it (n't=RP, Polarity=Neg)"
-                            ],
-                            'morphological_rules': 'RP: Polarity=Neg',
-                            'decision_factors': ['Negation', 'Denial', 'Prohibition']
-                        },
-                        {
-                            'choice': 'Use RP (Positive)',
-                            'xpos': 'RP',
-                            'feats': 'Polarity=Pos',
-                            'when': 'For positive particles',
-                            'examples': [
-                                'Yes indeed (yes=RP, Polarity=Pos)',
-                                'Do come (do=RP, Polarity=Pos)',
-                                'Please help (please=RP, Polarity=Pos)'
-                            ],
-                            'morphological_rules': 'RP: Polarity=Pos',
-                            'decision_factors': ['Affirmation', 'Emphasis', 'Politeness']
-                        }
-                    ]
-                }
-            ]
-        }
-    }
+RECOMMENDATIONS_PER_PAGE = 10
+REVIEW_ITEMS_PER_PAGE = 10
+
+# Rerun profiling: XPOMO_PROFILE=1 for every session, or ?debug=1 for one
+PROFILE_ALL = os.environ.get('XPOMO_PROFILE') == '1'
+
+# Where profiled reruns log their JSON line: '-' for stderr, or a file
+PROFILE_LOG = os.environ.get('XPOMO_PROFILE_LOG', '-')
+
+# Corpus statistics written by `python -m morphology.stats`
+STATS_FILE = os.environ.get('XPOMO_STATS', STATS_NAME)
+
+# Lexicons written by `python -m morphology.lexicon build`
+LEXICON_DIR = os.environ.get('XPOMO_LEXICON_DIR', '.')
+
+# Selections are saved here for sessions opened with ?user=...[&project=...]
+SESSION_DB = os.environ.get('XPOMO_DB', 'xpomo_sessions.db')
+
+@st.cache_resource
+def get_session_db(path):
+    return SessionDB(path)
+
+# Review queues filled by `python -m morphology.review ingest`
+REVIEW_DB = os.environ.get('XPOMO_REVIEW_DB', REVIEW_NAME)
+
+@st.cache_resource
+def get_review_queue(path):
+    return ReviewQueue(path)
+
+def reset_checkboxes(unique_ids):
+    # Dropping the widget state makes each checkbox re-read its value from the store
+    for unique_id in unique_ids:
+        st.session_state.pop(f"checkbox_{unique_id}", None)
+
+def current_language():
+    # ?lang=<code> picks a language's rule set; unknown codes get the default
+    language = st.query_params.get('lang', DEFAULT_LANGUAGE)
+    return language if language in available_languages() else DEFAULT_LANGUAGE
+
+def switch_language():
+    language = st.session_state.language_picker
+    if language == DEFAULT_LANGUAGE:
+        st.query_params.pop('lang', None)
+    else:
+        st.query_params['lang'] = language
+
+def linked_analysis(headers):
+    # ?analysis=<key> (as in agreement reports) opens that analysis first
+    analysis_key = st.query_params.get('analysis', '')
+    return analysis_key if analysis_key in headers else ''
+
+def init_selection():
+    # In-memory selection, or the persisted one of the user and project in
+    # the URL; switching either, or the language, swaps the store
+    user = st.query_params.get('user')
+    project = st.query_params.get('project', 'default')
+    language = current_language()
+    owner = (user, project, language)
+    store = st.session_state.get('selected_recommendations')
+    if store is not None and st.session_state.get('selection_owner') == owner:
+        return
+    if user is None:
+        new_store = SelectionStore()
+    else:
+        # Recommendation ids are only unique within a language, so other
+        # languages are saved under their own project key
+        if language != DEFAULT_LANGUAGE:
+            project = f"{project}@{language}"
+        new_store = PersistentSelectionStore(get_session_db(SESSION_DB), user, project,
+                                             load_complete_morphology_data(language))
+    if store is not None:
+        reset_checkboxes(store.ids())
+    reset_checkboxes(new_store.ids())
+    st.session_state.selected_recommendations = new_store
+    st.session_state.selection_owner = owner
+
+def sync_selection():
+    # Pick up changes saved by other tabs or replicas
+    store = st.session_state.selected_recommendations
+    if isinstance(store, PersistentSelectionStore):
+        reset_checkboxes(store.sync())
+
+def flush_selection():
+    store = st.session_state.selected_recommendations
+    if isinstance(store, PersistentSelectionStore):
+        store.flush()
 
 # Initialize session state
-if 'selected_recommendations' not in st.session_state:
-    st.session_state.selected_recommendations = []
+init_selection()
+if 'export_cache' not in st.session_state:
+    st.session_state.export_cache = ExportCache()
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex[:8]
+
+def start_profile(kind='rerun', analysis=None):
+    if PROFILE_ALL or st.query_params.get('debug') == '1':
+        enable_log(PROFILE_LOG)
+        profile = RerunProfile(st.session_state.session_id, kind, analysis)
+    else:
+        profile = NULL_PROFILE
+    st.session_state.rerun_profile = profile
+    return profile
+
+def current_profile():
+    return st.session_state.get('rerun_profile', NULL_PROFILE)
+
+def selection_store():
+    # The session's store, counting operations while profiling
+    return current_profile().track(st.session_state.selected_recommendations)
+
+def render_debug_panel(container, profile):
+    with container.container():
+        with st.expander("🛠️ Rerun profile", expanded=True):
+            st.json(profile.as_dict())
+            st.caption("Costliest sessions and analyses in this process")
+            st.dataframe(STATS.top(10), hide_index=True)
+
+def clear_selection():
+    store = st.session_state.selected_recommendations
+    reset_checkboxes(store.ids())
+    store.clear()
+
+def select_scenario(decisions, analysis_key, scenario_idx):
+    store = st.session_state.selected_recommendations
+    reset_checkboxes(store.select_scenario(decisions, analysis_key, scenario_idx))
+
+def deselect_scenario(analysis_key, scenario_idx):
+    store = st.session_state.selected_recommendations
+    reset_checkboxes(store.deselect_scenario(analysis_key, scenario_idx))
+
+def select_analysis(decisions, analysis_key):
+    store = st.session_state.selected_recommendations
+    reset_checkboxes(store.select_analysis(decisions, analysis_key))
+
+def deselect_analysis(analysis_key):
+    store = st.session_state.selected_recommendations
+    reset_checkboxes(store.deselect_analysis(analysis_key))
+
+def export_data(store, fmt, cache):
+    # Rendered from the live selection only when the download is clicked
+    # (fragment reruns may have changed it since), off the script thread.
+    # The store and cache both lock, so the snapshot is a whole selection
+    # even while a rerun changes it. The writers stream into an unlinked
+    # temporary file, not a string; Streamlit takes a raw file and reads
+    # it once into its media store.
+    def build():
+        records = store.snapshot()
+        with tempfile.TemporaryFile() as out:
+            writer = io.TextIOWrapper(out, encoding='utf-8', write_through=True)
+            write_export(records, writer, fmt, cache)
+            writer.detach()
+            out.flush()
+            data = io.FileIO(os.dup(out.fileno()), 'rb')
+        cache.prune({rec['id'] for rec in records})
+        return data
+    return build
+
+def render_rule_lookup(decisions, language):
+    index = get_rule_index(language)
+    st.header("🔎 Rule Lookup")
+    kind = st.selectbox(
+        "Look up by:",
+        options=['xpos', 'upos', 'feature', 'feature_value'],
+        format_func=lambda x: {'xpos': 'XPOS', 'upos': 'UPOS', 'feature': 'Feature',
+                               'feature_value': 'Feature=Value'}[x],
+        key="lookup_kind"
+    )
+    term = st.selectbox(
+        "Value:",
+        options=[None] + index.terms(kind),
+        format_func=lambda x: "-- Select --" if x is None else (f"{x[0]}={x[1]}" if isinstance(x, tuple) else x),
+        key=f"lookup_term_{kind}"
+    )
+    if term is None:
+        return
+    
+    ids = index.lookup(kind, term)
+    st.caption(f"{len(ids)} recommendation(s)")
+    for unique_id in ids:
+        analysis_key = parse_recommendation_id(unique_id)[0]
+        rec = index.recommendation(unique_id)
+        st.markdown(f"**{rec['choice']}** — {decisions[analysis_key]['title']}")
+        st.code(f"{decisions[analysis_key]['upos']} {rec['xpos']} {rec['feats']}", language="text")
+
+def render_search(decisions, language):
+    st.header("🔍 Search")
+    query = st.text_input("Examples, usage notes, decision factors:", key="search_query",
+                          placeholder="e.g. honorific, sir, plural")
+    if not query.strip():
+        return
+    
+    results = search(query, limit=10, language=language)
+    if not results:
+        st.caption("No matches")
+    for unique_id, _ in results:
+        analysis_key, scenario_idx, rec_idx = parse_recommendation_id(unique_id)
+        scenario = decisions[analysis_key]['scenarios'][scenario_idx]
+        rec = scenario['recommendations'][rec_idx]
+        st.markdown(f"**{rec['choice']}** — {decisions[analysis_key]['title']}")
+        st.caption(f"{scenario['context']} · {rec['when']}")
+
+@st.cache_resource(show_spinner=False)
+def open_lexicon(path, mtime_ns):
+    return Lexicon.open(path)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def examples_lexicon(language, version):
+    # Without a lexicon file, just the rule examples; rebuilt when the rules reload
+    builder = LexiconBuilder()
+    builder.add_examples(load_complete_morphology_data(language))
+    return builder.build()
+
+def get_lexicon(decisions, language):
+    path = os.path.join(LEXICON_DIR, lexicon_name(language))
+    try:
+        mtime_ns = os.stat(path).st_mtime_ns
+    except OSError:
+        return examples_lexicon(language, decisions.poll())
+    return open_lexicon(path, mtime_ns)
+
+def render_lexicon(decisions, language):
+    st.header("📖 Lexicon")
+    word = st.text_input("Word or prefix:", key="lexicon_word", placeholder="e.g. you, th").strip()
+    if not word:
+        return
+    
+    lexicon = get_lexicon(decisions, language)
+    analyses = lexicon.lookup(word, limit=20)
+    if analyses:
+        st.dataframe([analysis._asdict() for analysis in analyses], hide_index=True)
+    
+    # Other forms with this prefix
+    total = lexicon.count_prefix(word)
+    completions = [(form, analyses) for form, analyses in lexicon.prefix(word, limit=11, analyses=3) if form != word.lower()]
+    if not analyses and not completions:
+        st.caption(f"No forms starting with “{word}”")
+    if completions:
+        st.caption(f"{total:,} form(s) starting with “{word}”")
+        for form, analyses in completions[:10]:
+            st.markdown(f"**{form}** " + ' · '.join(f"`{a.xpos} {a.feats}` ({a.count:,})" for a in analyses))
+
+@st.cache_data(show_spinner=False)
+def load_corpus_stats(path, mtime_ns):
+    # Keyed by mtime so a new report is picked up; the feature matrix is
+    # flattened once here rather than on every rerun
+    report = load_report(path)
+    if report is None:
+        return None
+    matrix = [
+        {'UPOS': upos, 'Feature': name,
+         'Values': ', '.join(f"{value} ({count:,})" for value, count in
+                             sorted(values.items(), key=lambda item: -item[1])),
+         'Tokens': sum(values.values())}
+        for upos, features in sorted(report['upos_features'].items())
+        for name, values in sorted(features.items())
+    ]
+    return report, matrix
+
+MATRIX_SORTS = {
+    'UPOS': lambda row: (row.upos, row.feature.lower(), row.value),
+    'Feature': lambda row: (row.feature.lower(), row.value, row.upos),
+    'Rules': lambda row: -row.rules,
+}
+
+MATRIX_MIME_TYPES = {'tsv': 'text/tab-separated-values', 'csv': 'text/csv', 'json': 'application/json'}
+
+@st.fragment
+def render_feature_matrix(language):
+    # Filters and sorts the matrix' flat rows, which are derived once per
+    # rule change; widgets here rerun only this fragment
+    rows = get_feature_matrix(language).rows()
+    
+    col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+    with col1:
+        upos = st.multiselect("UPOS:", options=sorted({row.upos for row in rows}), key="matrix_upos")
+    with col2:
+        features = st.multiselect("Feature:", options=sorted({row.feature for row in rows}, key=str.lower),
+                                  key="matrix_features")
+    with col3:
+        view = st.radio("View:", options=['pivot', 'values'], horizontal=True, key="matrix_view",
+                        format_func=lambda x: {'pivot': "UPOS × feature", 'values': "Values"}[x])
+    with col4:
+        order = st.selectbox("Sort by:", options=list(MATRIX_SORTS), key="matrix_sort")
+    
+    shown = [row for row in rows if (not upos or row.upos in upos) and (not features or row.feature in features)]
+    shown.sort(key=MATRIX_SORTS[order])
+    if view == 'pivot':
+        columns, table = pivot(shown)
+        st.dataframe(table, hide_index=True, column_order=columns)
+    else:
+        st.dataframe(records(shown), hide_index=True, column_order=COLUMNS)
+    st.caption(f"{len(shown)} of {len(rows)} UPOS/feature/value cells, from the rules")
+    
+    col1, col2, _ = st.columns([1, 1, 4])
+    with col1:
+        fmt = st.selectbox("Export format:", options=MATRIX_FORMATS, key="matrix_format")
+    with col2:
+        st.download_button(
+            label="📥 Export matrix",
+            data=matrix_text(shown, fmt, view == 'pivot'),
+            file_name=f"ud_feature_matrix.{fmt}",
+            mime=MATRIX_MIME_TYPES[fmt]
+        )
+
+def render_corpus_stats():
+    st.subheader("🧮 Corpus statistics")
+    try:
+        mtime_ns = os.stat(STATS_FILE).st_mtime_ns
+    except OSError:
+        mtime_ns = None
+    loaded = load_corpus_stats(STATS_FILE, mtime_ns) if mtime_ns is not None else None
+    if loaded is None:
+        st.info("No corpus statistics yet: run `python -m morphology.stats corpus/*.conllu`")
+        return
+    report, matrix = loaded
+    st.caption(f"{report['tokens']:,} tokens in {len(report['files'])} file(s), generated {report['generated_at']}")
+    st.dataframe(matrix, hide_index=True)
+    
+    with st.expander(f"📈 Rule coverage ({len(report['unobserved_rules'])} never observed)"):
+        st.dataframe(report['coverage'], hide_index=True,
+                     column_order=('id', 'choice', 'upos', 'xpos', 'feats', 'count'))
+    with st.expander(f"❔ Observed without a rule ({len(report['unruled'])})"):
+        st.dataframe(report['unruled'], hide_index=True)
+
+def review_jobs():
+    # Only an existing queue is opened; the app never creates one
+    if not os.path.exists(REVIEW_DB):
+        return []
+    return get_review_queue(REVIEW_DB).jobs()
+
+def save_review(job_id, items, similar):
+    queue = get_review_queue(REVIEW_DB)
+    user = st.query_params.get('user')
+    for item in items:
+        choice = st.session_state.get(f"review_{job_id}_{item.line}")
+        if choice is None:
+            continue
+        if similar:
+            queue.resolve_similar(item, choice, user)
+        else:
+            queue.resolve(job_id, item.line, choice, user)
+
+def set_review_page(job_id, after_line):
+    st.session_state[f"review_after_{job_id}"] = after_line
+
+def render_review(job_id):
+    # Pages through the still ambiguous tokens of one ingested file
+    queue = get_review_queue(REVIEW_DB)
+    job = queue.job(job_id)
+    decisions = load_complete_morphology_data(job.language)
+    st.header(f"📝 Review: {os.path.basename(job.path)}")
+    state = "" if job.finished else " · ingest not finished"
+    st.caption(f"{job.tokens:,} tokens: {job.filled:,} filled automatically, {job.queued:,} ambiguous, "
+               f"{job.pending:,} left to review{state}")
+    if job.queued:
+        st.progress(1 - job.pending / job.queued)
+    
+    after = st.session_state.get(f"review_after_{job_id}", 0)
+    items = queue.pending(job_id, after, REVIEW_ITEMS_PER_PAGE)
+    if not items:
+        if after:
+            st.button("⏮️ Back to the first page", on_click=set_review_page, args=(job_id, 0))
+        else:
+            st.success("✅ Nothing left to review")
+        return
+    
+    similar = st.checkbox("Apply each choice to all identical pending tokens (form, UPOS, XPOS, FEATS)",
+                          value=True, key="review_similar")
+    with st.form(f"review_{job_id}"):
+        for item in items:
+            st.markdown(f"**{item.form}** (token {item.token_id}, line {item.line:,}) — {item.sentence}")
+            options = {}
+            for unique_id in item.candidates:
+                try:
+                    rec = build_recommendation_record(decisions, unique_id)
+                except (KeyError, IndexError, ValueError):
+                    continue
+                options[unique_id] = f"{rec['choice']} · {rec['upos']} {rec['xpos']} {rec['feats']}"
+            st.radio(f"`{item.upos} {item.xpos} {item.feats}`", options=list(options), index=None,
+                     format_func=options.get, key=f"review_{job_id}_{item.line}")
+        st.form_submit_button("💾 Save choices", on_click=save_review, args=(job_id, items, similar))
+    
+    col1, col2, _ = st.columns([1, 1, 4])
+    with col1:
+        st.button("⏮️ First page", on_click=set_review_page, args=(job_id, 0), disabled=not after)
+    with col2:
+        st.button("⏭️ Skip page", on_click=set_review_page, args=(job_id, items[-1].line))
+
+# Each recommendation is a fragment: toggling its checkbox or details
+# reruns just that recommendation, not the whole page
+@st.fragment
+def render_recommendation(decisions, analysis_key, scenario_idx, rec_idx):
+    # A fragment-only rerun gets its own profile
+    profile = current_profile()
+    fragment_rerun = profile.enabled and profile.finished
+    if fragment_rerun:
+        profile = start_profile('fragment', analysis_key)
+    had_selection = bool(st.session_state.selected_recommendations)
+    with profile.phase('recommendations'):
+        _render_recommendation(decisions, analysis_key, scenario_idx, rec_idx)
+    # Fragment reruns skip main(), so save a toggle here
+    flush_selection()
+    if fragment_rerun:
+        profile.finish()
+    # The sidebar's export controls only exist with a selection, and a
+    # fragment rerun does not redraw them
+    if bool(st.session_state.selected_recommendations) != had_selection:
+        st.rerun(scope="app")
+
+def _render_recommendation(decisions, analysis_key, scenario_idx, rec_idx):
+    profile = current_profile()
+    store = selection_store()
+    decision_data = decisions[analysis_key]
+    rec = decision_data['scenarios'][scenario_idx]['recommendations'][rec_idx]
+    unique_id = recommendation_id(analysis_key, scenario_idx, rec_idx)
+    
+    with st.container():
+        # Checkbox
+        is_selected = st.checkbox(
+            f"**{rec['choice']}**",
+            key=f"checkbox_{unique_id}",
+            value=unique_id in store
+        )
+        
+        # Handle selection
+        if is_selected:
+            if unique_id not in store:
+                rec_data = build_recommendation_record(decisions, unique_id)
+                store.add(rec_data)
+        else:
+            store.discard(unique_id)
+        
+        # UD format display
+        st.code(f"{decision_data['upos']} {rec['xpos']} {rec['feats']}", language="text")
+        
+        # Details are only built while shown
+        profile.count('widgets', 2)
+        if st.toggle("📋 View Details", key=f"details_{unique_id}"):
+            st.markdown(f"**When to use:** {rec['when']}")
+            
+            # Decision factors
+            if rec.get('decision_factors'):
+                st.markdown("**🎯 Decision Factors:**")
+                for factor in rec['decision_factors']:
+                    st.write(f"• {factor}")
+            
+            # Examples
+            st.markdown("**📝 Examples:**")
+            for example in rec['examples']:
+                st.code(example, language="text")
+            
+            # Morphological rule
+            st.markdown("**🔧 Morphological Rule:**")
+            st.code(rec['morphological_rules'], language="text")
+        
+        st.markdown("---")
 
 def main():
+    profile = start_profile()
     st.title("🧠 Complete UD Morphological Decision Support")
     st.markdown("**Comprehensive Universal Dependencies Analysis** - Complete morphological decision making with all features")
     
-    decisions = load_complete_morphology_data()
+    # Shared, read-only table: no per-rerun copy. Headers come from the
+    # rules index; an analysis' scenarios load when it is first opened.
+    with profile.phase('data'):
+        language = current_language()
+        decisions = load_complete_morphology_data(language)
+        headers = decisions.headers()
+        sync_selection()
+    debug_panel = st.sidebar.empty() if profile.enabled else None
     
     # Sidebar
-    with st.sidebar:
+    with profile.phase('sidebar'), st.sidebar:
+        languages = available_languages()
+        if len(languages) > 1:
+            st.selectbox("🌐 Language:", options=languages, index=languages.index(language),
+                         key="language_picker", on_change=switch_language)
+        
         st.header("📋 Select Analysis Type")
         
-        decision_options = {key: data['title'] for key, data in decisions.items()}
+        decision_options = {key: data['title'] for key, data in headers.items()}
+        analysis_options = [''] + list(decision_options.keys())
         selected_key = st.selectbox(
             "Choose analysis type:",
-            options=[''] + list(decision_options.keys()),
+            options=analysis_options,
+            index=analysis_options.index(linked_analysis(headers)),
             format_func=lambda x: "-- Select --" if x == '' else decision_options[x]
         )
         
         if selected_key:
             st.success(f"✅ Selected")
+        
+        jobs = {job.job: job for job in review_jobs()}
+        review_job = None
+        if jobs:
+            review_job = st.selectbox(
+                "📝 Review queue:",
+                options=[None] + list(jobs),
+                format_func=lambda x: "-- None --" if x is None else
+                f"{os.path.basename(jobs[x].path)} ({jobs[x].pending:,} left)",
+                key="review_job"
+            )
+        
+        render_rule_lookup(decisions, language)
+        render_search(decisions, language)
+        render_lexicon(decisions, language)
+        profile.count('widgets', 4)
             
         # Show selection count
         if st.session_state.selected_recommendations:
             st.info(f"📌 Selected: {len(st.session_state.selected_recommendations)}")
             
-            if st.button("🗑️ Clear All"):
-                st.session_state.selected_recommendations = []
-                st.rerun()
+            st.button("🗑️ Clear All", on_click=clear_selection)
+                
+            selected = st.session_state.selected_recommendations
+            cache = st.session_state.export_cache
+            profile.count('widgets', 4)
+            with profile.phase('export'):
+                if st.button("📋 Copy Selected"):
+                    cache.prune(selected)
+                    copy_text = generate_copy_text(selected, cache=cache)
+                    st.code(copy_text, language="text")
+                    st.success("✅ Copy the text above!")
                 
-            if st.button("📋 Copy Selected"):
-                copy_text = generate_copy_text()
-                st.code(copy_text, language="text")
-                st.success("✅ Copy the text above!")
+                export_format = st.selectbox("Export format:", options=FORMATS, key="export_format")
+                st.download_button(
+                    "⬇️ Download",
+                    data=export_data(selected, export_format, cache),
+                    file_name=f"ud_morphology.{FILE_EXTENSIONS[export_format]}",
+                    mime=MIME_TYPES[export_format]
+                )
 
     # Main content
-    if not selected_key:
-        st.info("👆 Please select an analysis type from the sidebar")
+    with profile.phase('render'):
+        if review_job is not None:
+            render_review(review_job)
         
-        st.header("📚 Available Analysis Types")
-        
-        # Show feature overview
-        cols = st.columns(2)
-        for i, (key, data) in enumerate(decisions.items()):
-            with cols[i % 2]:
-                with st.expander(f"🎯 {data['title']}"):
-                    st.write(f"**UPOS:** {data['upos']}")
-                    st.write(f"**XPOS:** {' • '.join(data['xpos_tags'])}")
-                    st.write(f"**Description:** {data['description']}")
-        
-        # Feature matrix
-        st.header("📊 Morphological Features")
-        feature_info = {
-            'VERB': 'Honorificity=Yes/No, Tense, Aspect, Mood, Voice',
-            'ADV': 'AdvType=Manner/Temporal/Locative/Frequentative/Resultative',
-            'CONJ': 'ConjType=Coordinating/Correlative/Subordinating',
-            'PRON': 'Honorificity=Yes/No, Person, Number, Case'
-        }
-        
-        for upos, features in feature_info.items():
-            st.markdown(f"**{upos}:** {features}")
-    
-    else:
-        decision_data = decisions[selected_key]
-        
-        # Header
-        st.header(f"🎯 {decision_data['title']}")
-        st.write(decision_data['description'])
-        
-        col1, col2 = st.columns(2)
-        with col1:
-            st.info(f"**UPOS:** {decision_data['upos']}")
-        with col2:
-            st.info(f"**XPOS:** {' • '.join(decision_data['xpos_tags'])}")
-        
-        st.markdown("---")
-        
-        # Scenarios
-        for scenario_idx, scenario in enumerate(decision_data['scenarios']):
-            st.subheader(f"📍 {scenario['context']}")
-            st.markdown(f"**❓ {scenario['question']}**")
+        elif not selected_key:
+            st.info("👆 Please select an analysis type from the sidebar")
             
-            # Recommendations
-            for rec_idx, rec in enumerate(scenario['recommendations']):
-                unique_id = f"{selected_key}_{scenario_idx}_{rec_idx}"
-                
-                with st.container():
-                    # Checkbox
-                    is_selected = st.checkbox(
-                        f"**{rec['choice']}**",
-                        key=f"checkbox_{unique_id}",
-                        value=any(r['id'] == unique_id for r in st.session_state.selected_recommendations)
-                    )
-                    
-                    # Handle selection
-                    if is_selected:
-                        rec_data = {
-                            'id': unique_id,
-                            'decision_type': decision_data['title'],
-                            'upos': decision_data['upos'],
-                            'context': scenario['context'],
-                            'question': scenario['question'],
-                            'choice': rec['choice'],
-                            'xpos': rec['xpos'],
-                            'feats': rec['feats'],
-                            'when': rec['when'],
-                            'examples': rec['examples'],
-                            'rules': rec['morphological_rules'],
-                            'decision_factors': rec.get('decision_factors', []),
-                            'xpos_tags': decision_data['xpos_tags']
-                        }
-                        
-                        if not any(r['id'] == unique_id for r in st.session_state.selected_recommendations):
-                            st.session_state.selected_recommendations.append(rec_data)
-                    else:
-                        st.session_state.selected_recommendations = [
-                            r for r in st.session_state.selected_recommendations if r['id'] != unique_id
-                        ]
-                    
-                    # UD format display
-                    st.code(f"{decision_data['upos']} {rec['xpos']} {rec['feats']}", language="text")
-                    
-                    # Details in expandable section
-                    with st.expander("📋 View Details"):
-                        st.markdown(f"**When to use:** {rec['when']}")
-                        
-                        # Decision factors
-                        if rec.get('decision_factors'):
-                            st.markdown("**🎯 Decision Factors:**")
-                            for factor in rec['decision_factors']:
-                                st.write(f"• {factor}")
-                        
-                        # Examples
-                        st.markdown("**📝 Examples:**")
-                        for example in rec['examples']:
-                            st.code(example, language="text")
-                        
-                        # Morphological rule
-                        st.markdown("**🔧 Morphological Rule:**")
-                        st.code(rec['morphological_rules'], language="text")
-                    
-                    st.markdown("---")
-
-def generate_copy_text():
-    if not st.session_state.selected_recommendations:
-        return "No recommendations selected."
-    
-    copy_text = "COMPLETE UD MORPHOLOGICAL ANALYSIS\n"
-    copy_text += "=" * 50 + "\n\n"
-    
-    # Group by decision type
-    grouped = {}
-    for rec in st.session_state.selected_recommendations:
-        decision_type = rec['decision_type']
-        if decision_type not in grouped:
-            grouped[decision_type] = []
-        grouped[decision_type].append(rec)
-    
-    for decision_type, recs in grouped.items():
-        copy_text += f"🎯 {decision_type}\n"
-        copy_text += "-" * len(decision_type) + "\n\n"
+            st.header("📚 Available Analysis Types")
+            
+            # Show feature overview
+            cols = st.columns(2)
+            for i, (key, data) in enumerate(headers.items()):
+                with cols[i % 2]:
+                    with st.expander(f"🎯 {data['title']}"):
+                        st.write(f"**UPOS:** {data['upos']}")
+                        st.write(f"**XPOS:** {' • '.join(data['xpos_tags'])}")
+                        st.write(f"**Description:** {data['description']}")
+            
+            # Features the rules allow per UPOS, then what the corpora use
+            st.header("📊 Morphological Features")
+            render_feature_matrix(language)
+            render_corpus_stats()
         
-        for i, rec in enumerate(recs, 1):
-            copy_text += f"{i}. {rec['choice']}\n"
-            copy_text += f"   UD Format: {rec['upos']} {rec['xpos']} {rec['feats']}\n"
-            copy_text += f"   Context: {rec['context']}\n"
-            copy_text += f"   When to use: {rec['when']}\n\n"
+        else:
+            decision_data = decisions[selected_key]
             
-            # Decision factors
-            if rec.get('decision_factors'):
-                copy_text += f"   Decision Factors:\n"
-                for factor in rec['decision_factors']:
-                    copy_text += f"   • {factor}\n"
-                copy_text += "\n"
+            # Header
+            st.header(f"🎯 {decision_data['title']}")
+            st.write(decision_data['description'])
             
-            # Examples
-            copy_text += f"   Examples:\n"
-            for ex in rec['examples']:
-                copy_text += f"   • {ex}\n"
+            col1, col2 = st.columns(2)
+            with col1:
+                st.info(f"**UPOS:** {decision_data['upos']}")
+            with col2:
+                st.info(f"**XPOS:** {' • '.join(decision_data['xpos_tags'])}")
             
-            copy_text += f"\n   Morphological Rule: {rec['rules']}\n"
-            copy_text += "\n" + "-" * 40 + "\n\n"
+            # Bulk selection for the whole analysis
+            profile.count('widgets', 2)
+            col1, col2, _ = st.columns([1, 1, 4])
+            with col1:
+                st.button("☑️ Select all", key=f"select_{selected_key}",
+                          on_click=select_analysis, args=(decisions, selected_key))
+            with col2:
+                st.button("⬜ Clear all", key=f"deselect_{selected_key}",
+                          on_click=deselect_analysis, args=(selected_key,))
+            
+            st.markdown("---")
+            
+            # Scenarios
+            for scenario_idx, scenario in enumerate(decision_data['scenarios']):
+                # Anchor for #<analysis>-<scenario> links
+                st.subheader(f"📍 {scenario['context']}", anchor=f"{selected_key}-{scenario_idx}")
+                st.markdown(f"**❓ {scenario['question']}**")
+                
+                # Bulk selection for this scenario
+                profile.count('widgets', 2)
+                col1, col2, _ = st.columns([1, 1, 4])
+                with col1:
+                    st.button("☑️ Select scenario", key=f"select_{selected_key}_{scenario_idx}",
+                              on_click=select_scenario, args=(decisions, selected_key, scenario_idx))
+                with col2:
+                    st.button("⬜ Clear scenario", key=f"deselect_{selected_key}_{scenario_idx}",
+                              on_click=deselect_scenario, args=(selected_key, scenario_idx))
+                
+                # Recommendations, one page at a time
+                recs = scenario['recommendations']
+                pages = (len(recs) + RECOMMENDATIONS_PER_PAGE - 1) // RECOMMENDATIONS_PER_PAGE
+                page = 1
+                if pages > 1:
+                    page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages,
+                                           key=f"page_{selected_key}_{scenario_idx}")
+                first = (page - 1) * RECOMMENDATIONS_PER_PAGE
+                for rec_idx in range(first, min(first + RECOMMENDATIONS_PER_PAGE, len(recs))):
+                    render_recommendation(decisions, selected_key, scenario_idx, rec_idx)
         
-        copy_text += "=" * 50 + "\n\n"
-    
-    copy_text += f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-    copy_text += "Total Selected: " + str(len(st.session_state.selected_recommendations)) + " recommendations\n"
-    
-    return copy_text
+    with profile.phase('save'):
+        flush_selection()
+    profile.analysis = selected_key or None
+    profile.finish()
+    if debug_panel is not None:
+        render_debug_panel(debug_panel, profile)
 
 if __name__ == "__main__":
     main()